@@ -0,0 +1,139 @@
+"""
+The analytics mode of lambda_get over a full year of day rollups.
+
+A year of day rollups with --exercises distinct exercises is generated,
+a handful of them trained on each training day, and written to moto.
+The NumPy results are first checked against a plain Python recomputation,
+then the array build, the analytics, and the whole mode with a cold and a
+warm response cache are timed.
+
+    pip install moto boto3 numpy
+    python scripts/bench/bench_analytics.py --exercises 120 --iterations 50
+"""
+import argparse
+import json
+import logging
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from bench_load import TABLES, create_tables
+from bench_utils import load_handler, quiet, report, timed
+
+USER = "analytics@example.com"
+
+
+def year_of_rollups(rng, year, exercises, through):
+    """Day rollup items of year up to through, as lambda_aggregate writes them"""
+    names = [f"exercise {i:03d}" for i in range(exercises)]
+    # A few staple lifts get most of the volume
+    weights = [1 / (rank + 1) for rank in range(exercises)]
+    items = []
+    day = date(year, 1, 1)
+    while day <= through:
+        if rng.random() < 0.8:
+            item = {"user": USER, "bucket": f"day#{day.isoformat()}", "total_volume": Decimal(0)}
+            for name in set(rng.choices(names, weights=weights, k=rng.randint(4, 10))):
+                volume = Decimal(5 * rng.randint(100, 2000))
+                item[f"volume:{name}"] = volume
+                item[f"reps:{name}"] = Decimal(rng.randint(10, 60))
+                item["total_volume"] += volume
+            items.append(item)
+        day += timedelta(days=1)
+    return items
+
+
+def reference(items, year, today):
+    """The numbers the analytics are checked against, computed with plain loops"""
+    totals = {}
+    exercise_totals = {}
+    for item in items:
+        day = date.fromisoformat(item["bucket"].split("#", 1)[1])
+        totals[day] = float(item["total_volume"])
+        for attribute, value in item.items():
+            if attribute.startswith("volume:"):
+                exercise_totals[attribute[7:]] = exercise_totals.get(attribute[7:], 0) + float(value)
+
+    days = [date(year, 1, 1) + timedelta(days=offset) for offset in range((today - date(year, 1, 1)).days + 1)]
+    runs = []
+    run = 0
+    for day in days:
+        run = run + 1 if totals.get(day, 0) > 0 else 0
+        runs.append(run)
+    current = runs[-1] or (runs[-2] if len(runs) > 1 else 0)
+    grand_total = sum(exercise_totals.values())
+    top = max(exercise_totals, key=exercise_totals.get)
+    return {
+        "year_to_date": round(sum(totals.get(day, 0) for day in days), 2),
+        "average_7_days": round(sum(totals.get(day, 0) for day in days[-7:]) / 7, 2),
+        "average_28_days": round(sum(totals.get(day, 0) for day in days[-28:]) / 28, 2),
+        "current": current,
+        "longest": max(runs),
+        "training_days": sum(1 for day in days if totals.get(day, 0) > 0),
+        "top": (top, round(exercise_totals[top] / grand_total, 4)),
+    }
+
+
+def check(analytics, expected):
+    actual = {
+        "year_to_date": analytics["pace"]["year_to_date"],
+        "average_7_days": analytics["rolling"]["average_7_days"],
+        "average_28_days": analytics["rolling"]["average_28_days"],
+        "current": analytics["streaks"]["current"],
+        "longest": analytics["streaks"]["longest"],
+        "training_days": analytics["streaks"]["training_days"],
+        "top": (analytics["exercises"][0]["name"], analytics["exercises"][0]["share"]),
+    }
+    mismatched = {key: (actual[key], value) for key, value in expected.items() if actual[key] != value}
+    assert not mismatched, f"analytics != reference: {mismatched}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--exercises", type=int, default=120)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--year", type=int, default=date.today().year - 1, help="a past year is a full year")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        get_app = load_handler("lambda_get", TABLES)
+        create_tables()
+        logging.getLogger().setLevel(logging.WARNING)
+        import fitness_analytics
+
+        rng = random.Random(args.seed)
+        through = min(date(args.year, 12, 31), date.today())
+        items = year_of_rollups(rng, args.year, args.exercises, through)
+        with boto3.resource("dynamodb").Table(TABLES["ROLLUPS_TABLE"]).batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+        analytics = fitness_analytics.year_analytics(items, args.year, date.today(), get_app.GOAL_ANNUAL_VOLUME)
+        check(analytics, reference(items, args.year, through))
+
+        event = {"body": json.dumps({"user": USER, "mode": "analytics", "year": args.year}),
+                 "headers": {"x-user-email": USER}}
+        with quiet():
+            response = get_app.lambda_handler(event, None)
+        assert response["statusCode"] == 200, response
+        exercises_seen = len({key for item in items for key in item if key.startswith("volume:")})
+        print(f"{args.year}: {len(items)} training days, {exercises_seen} exercises, "
+              f"response {len(response['body'])} bytes")
+
+        def cold():
+            get_app._response_cache.clear()
+            get_app.lambda_handler(event, None)
+
+        report("daily_arrays", timed(lambda: fitness_analytics.daily_arrays(items, args.year), args.iterations))
+        report("year_analytics", timed(lambda: fitness_analytics.year_analytics(
+            items, args.year, date.today(), get_app.GOAL_ANNUAL_VOLUME), args.iterations))
+        report("analytics mode, cold cache", timed(cold, args.iterations))
+        report("analytics mode, warm cache", timed(lambda: get_app.lambda_handler(event, None), args.iterations))
+
+
+if __name__ == "__main__":
+    main()
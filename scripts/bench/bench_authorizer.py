@@ -0,0 +1,193 @@
+"""
+Authorizer latency with a warm and a cold API key cache, and for Firebase ID tokens.
+
+Secrets Manager is replaced by an in-process stub that sleeps for a
+configurable round trip, so the numbers show what the cache saves per
+request without touching AWS. ID tokens are signed with RSA keys generated
+here and served by a stub of the signing key endpoint with the same
+latency. Before timing, forged, expired and foreign tokens are checked to
+be rejected, and so is the web key without a token, while the mobile key
+may still name its user with x-user-email.
+
+    pip install cryptography
+    python scripts/bench/bench_authorizer.py --iterations 500 --latency-ms 15
+"""
+import argparse
+import base64
+import json
+import logging
+import time
+
+from bench_utils import load_handler, quiet, report, timed
+
+API_KEY = "0123456789abcdef0123456789abcdef"
+MOBILE_API_KEY = "fedcba9876543210fedcba9876543210"
+
+
+PROJECT_ID = "bench-fitness"
+TOKEN_USER = "Token.User@example.com"
+
+
+class StubSecretsManager:
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {"SecretString": json.dumps({"API_KEY": API_KEY, "MOBILE_API_KEY": MOBILE_API_KEY})}
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+class TokenIssuer:
+    """Signs Firebase-style ID tokens with locally generated RSA keys"""
+
+    def __init__(self, kids=("key-1", "key-2")):
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        self.keys = {kid: rsa.generate_private_key(public_exponent=65537, key_size=2048) for kid in kids}
+        self.fetches = 0
+
+    def public_keys(self, kids=None):
+        return {kid: key.public_key() for kid, key in self.keys.items() if kids is None or kid in kids}
+
+    def issue(self, kid="key-1", email=TOKEN_USER, lifetime=3600, **overrides):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        now = int(time.time())
+        claims = {
+            "iss": f"https://securetoken.google.com/{PROJECT_ID}", "aud": PROJECT_ID, "auth_time": now - 60,
+            "user_id": "uid-1", "sub": "uid-1", "iat": now - 60, "exp": now + lifetime,
+            "email": email, "email_verified": True,
+        }
+        claims.update(overrides)
+        signing_input = ".".join(
+            b64url(json.dumps(part).encode()) for part in ({"alg": "RS256", "kid": kid, "typ": "JWT"}, claims)
+        )
+        signature = self.keys[kid].sign(signing_input.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return f"{signing_input}.{b64url(signature)}"
+
+
+def check_token_rejections(app, issuer, call):
+    """Tokens the authorizer must refuse, and one it must accept"""
+    token = issuer.issue()
+    header, payload, signature = token.split(".")
+    forged_claims = json.loads(base64.urlsafe_b64decode(payload + "=="))
+    forged_claims["email"] = "someone.else@example.com"
+    cases = {
+        "forged payload": f"{header}.{b64url(json.dumps(forged_claims).encode())}.{signature}",
+        "expired": issuer.issue(lifetime=-1),
+        "other project": issuer.issue(aud="another-project"),
+        "other issuer": issuer.issue(iss="https://securetoken.google.com/another-project"),
+        "unverified email": issuer.issue(email_verified=False),
+        "unknown key": issuer.issue(kid="key-2"),
+        "garbage": "not.a.token",
+    }
+    for label, bad_token in cases.items():
+        assert not call(bad_token)["isAuthorized"], f"{label} token accepted"
+    response = call(token)
+    assert response["isAuthorized"] and response["context"]["user"] == TOKEN_USER.lower(), response
+
+
+def check_client_scoping(app):
+    """Only the mobile key may name its user with x-user-email once ID tokens are required"""
+    def call(api_key):
+        return app.lambda_handler({"headers": {"x-api-key": api_key, "x-user-email": "named@example.com"}}, None)
+
+    assert not call(API_KEY)["isAuthorized"], "web key accepted without an ID token"
+    assert not call(" ")["isAuthorized"], "blank key accepted"
+    response = call(MOBILE_API_KEY)
+    assert response["isAuthorized"] and response["context"]["user"] == "named@example.com", response
+
+
+def bench_tokens(app, args):
+    issuer = TokenIssuer()
+    latency = args.latency_ms / 1000
+
+    def fetch_signing_keys():
+        issuer.fetches += 1
+        time.sleep(latency)
+        # key-2 stands for a key Google has not published yet
+        return issuer.public_keys(kids=("key-1",)), 21600
+
+    app.FIREBASE_PROJECT_ID = PROJECT_ID
+    app.REQUIRE_ID_TOKEN = True
+    app.fetch_signing_keys = fetch_signing_keys
+
+    def call(token):
+        return app.lambda_handler({"headers": {"x-api-key": API_KEY, "authorization": f"Bearer {token}"}}, None)
+
+    with quiet():
+        check_token_rejections(app, issuer, call)
+        check_client_scoping(app)
+
+    token = issuer.issue()
+    tokens = [issuer.issue(email=f"user{i}@example.com") for i in range(args.iterations)]
+    with quiet():
+        call(token)
+
+    issuer.fetches = 0
+    warm = timed(lambda: call(token), args.iterations)
+    warm_fetches = issuer.fetches
+
+    fresh = iter(tokens)
+    issuer.fetches = 0
+    verify = timed(lambda: call(next(fresh)), args.iterations)
+    verify_fetches = issuer.fetches
+
+    def cold():
+        app._token_cache.clear()
+        app._signing_keys.update(keys={}, expires_at=0.0, fetched_at=0.0)
+        call(token)
+
+    issuer.fetches = 0
+    cold_samples = timed(cold, args.iterations)
+    cold_fetches = issuer.fetches
+
+    print(f"Signing key endpoint stub latency: {args.latency_ms} ms")
+    report(f"token cache hit ({warm_fetches} key fetches)", warm)
+    report(f"new token ({verify_fetches} key fetches)", verify)
+    report(f"cold container ({cold_fetches} key fetches)", cold_samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=15.0)
+    args = parser.parse_args()
+
+    app = load_handler("lambda_authorizer", {"API_KEY_SECRET": "bench_api_key"})
+    logging.getLogger().setLevel(logging.WARNING)
+    stub = StubSecretsManager(args.latency_ms)
+    app.secrets_manager = stub
+
+    event = {"headers": {"x-api-key": API_KEY, "x-user-email": "bench@example.com"}}
+    with quiet():
+        assert app.lambda_handler(event, None)["isAuthorized"]
+
+    stub.calls = 0
+    warm = timed(lambda: app.lambda_handler(event, None), args.iterations)
+    warm_calls = stub.calls
+
+    def cold():
+        app._secret_cache["value"] = None
+        app.lambda_handler(event, None)
+
+    stub.calls = 0
+    cold_samples = timed(cold, args.iterations)
+    cold_calls = stub.calls
+
+    print(f"Secrets Manager stub latency: {args.latency_ms} ms")
+    report(f"warm cache ({warm_calls} secret fetches)", warm)
+    report(f"cold cache ({cold_calls} secret fetches)", cold_samples)
+
+    bench_tokens(app, args)
+
+
+if __name__ == "__main__":
+    main()
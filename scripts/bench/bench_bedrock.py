@@ -0,0 +1,178 @@
+"""
+lambda_bedrock latency for cached plans, blocking generation and streaming.
+
+Bedrock and the plans table are replaced by in-process stubs. The model
+stub emits a fixed completion one token at a time with a configurable
+delay, so the numbers show what the plan cache saves and how soon a
+streamed plan starts to arrive. A model call that fails is checked too:
+a request that finds the plan claimed but empty gets a 202, and the
+failed claim is released for the next request.
+
+    python scripts/bench/bench_bedrock.py --iterations 20 --tokens 300 --token-ms 2
+"""
+import argparse
+import io
+import json
+import logging
+import time
+
+from bench_utils import load_handler, quiet, report, timed
+
+
+class StubBedrockClient:
+    def __init__(self, tokens, token_ms):
+        self.tokens = [f"word{i} " for i in range(tokens)]
+        self.delay = token_ms / 1000
+        self.calls = 0
+        self.fail = False
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("ThrottlingException")
+        time.sleep(self.delay * len(self.tokens))
+        body = {"content": [{"type": "text", "text": "".join(self.tokens)}]}
+        return {"body": io.BytesIO(json.dumps(body).encode("utf-8"))}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.calls += 1
+
+        def events():
+            yield {"chunk": {"bytes": json.dumps({"type": "message_start"}).encode("utf-8")}}
+            for token in self.tokens:
+                time.sleep(self.delay)
+                delta = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": token}}
+                yield {"chunk": {"bytes": json.dumps(delta).encode("utf-8")}}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_stop"}).encode("utf-8")}}
+
+        return {"body": events()}
+
+
+class StubPlansTable:
+    name = "bench_workout_plans"
+
+    def __init__(self, conditional_check_failed):
+        self.items = {}
+        self.writes = 0
+        self.conditional_check_failed = conditional_check_failed
+
+    def get_item(self, Key):
+        item = self.items.get(Key["cache_key"])
+        return {"Item": dict(item)} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        # Only the condition claim_generation uses is modelled
+        existing = self.items.get(Item["cache_key"])
+        if existing and (existing["status"] == "complete" or existing["updated_at"] >= ExpressionAttributeValues[":stale"]):
+            raise self.conditional_check_failed({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+        self.writes += 1
+        self.items[Item["cache_key"]] = dict(Item)
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                    ConditionExpression=None):
+        self.writes += 1
+        if ConditionExpression:
+            # release_claim: keep a plan that completed meanwhile
+            item = self.items.get(Key["cache_key"])
+            if not item or item["status"] == "complete":
+                raise self.conditional_check_failed({"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem")
+            item.update(status=ExpressionAttributeValues[":failed"], updated_at=ExpressionAttributeValues[":zero"])
+            return
+        item = self.items.setdefault(Key["cache_key"], {"cache_key": Key["cache_key"]})
+        item.update({
+            "text": ExpressionAttributeValues[":text"],
+            "status": ExpressionAttributeValues[":status"],
+            "updated_at": ExpressionAttributeValues[":now"],
+            "expires_at": ExpressionAttributeValues[":expires_at"],
+        })
+
+
+class StubContext:
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--token-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    app = load_handler("lambda_bedrock", {
+        "AGGREGATES_TABLE": "bench_aggregated",
+        "PLANS_TABLE": StubPlansTable.name,
+        "ROLLUPS_TABLE": "bench_rollups",
+    })
+    logging.getLogger().setLevel(logging.WARNING)
+    bedrock = StubBedrockClient(args.tokens, args.token_ms)
+    table = StubPlansTable(app.dynamodb_client.exceptions.ConditionalCheckFailedException)
+    app.bedrock_client = bedrock
+    app.plans_table = table
+    context = StubContext()
+    expected = "".join(bedrock.tokens)
+
+    def miss(stream):
+        table.items.clear()
+        response = app.lambda_handler({"queryStringParameters": {"stream": "1"} if stream else None}, context)
+        body = json.loads(response["body"])
+        assert body["workout_plan"][0]["text"] == expected and body["complete"] and not body["cached"]
+
+    first_chunk = []
+    stream_plan_chunks = app.stream_plan_chunks
+
+    def timed_chunks(request_body):
+        start = time.perf_counter()
+        for i, text in enumerate(stream_plan_chunks(request_body)):
+            if i == 0:
+                first_chunk.append((time.perf_counter() - start) * 1000)
+            yield text
+
+    app.stream_plan_chunks = timed_chunks
+
+    bedrock.calls = 0
+    blocking = timed(lambda: miss(False), args.iterations)
+    blocking_calls = bedrock.calls
+
+    table.writes = 0
+    streamed = timed(lambda: miss(True), args.iterations)
+    writes_per_plan = table.writes / args.iterations
+
+    hits = timed(lambda: app.lambda_handler({}, context), args.iterations * 10)
+    with quiet():
+        hit_body = json.loads(app.lambda_handler({}, context)["body"])
+    assert hit_body["cached"] and hit_body["workout_plan"][0]["text"] == expected
+
+    # While a claim has no text yet, other requests wait instead of getting an empty plan
+    table.items.clear()
+    cache_key = app.plan_cache_key(app.build_request_body(app.build_messages()))
+    assert app.claim_generation(cache_key)
+    with quiet():
+        waiting = app.lambda_handler({}, context)
+    assert waiting["statusCode"] == 202 and waiting["headers"]["Retry-After"], waiting
+
+    # A failed model call releases its claim, so the next request generates the plan at once
+    table.items.clear()
+    bedrock.fail = True
+    logging.getLogger().setLevel(logging.CRITICAL)
+    with quiet():
+        failed = app.lambda_handler({}, context)
+    logging.getLogger().setLevel(logging.WARNING)
+    assert failed["statusCode"] == 500 and table.items[cache_key]["status"] == "failed"
+    bedrock.fail = False
+    with quiet():
+        retried = json.loads(app.lambda_handler({}, context)["body"])
+    assert retried["workout_plan"][0]["text"] == expected and not retried["cached"]
+
+    print(f"Model stub: {args.tokens} tokens at {args.token_ms} ms/token, {len(expected)} chars")
+    report(f"cache miss, blocking ({blocking_calls} model calls)", blocking)
+    report("cache miss, streamed (total)", streamed)
+    report("cache miss, streamed (first chunk)", first_chunk)
+    report("cache hit", hits)
+    print(f"plan table writes per streamed plan: {writes_per_plan:.1f} "
+          f"(flush every {app.STREAM_FLUSH_CHARS} chars)")
+    print("an empty claim answers 202, and a failed generation is retried by the next request")
+
+
+if __name__ == "__main__":
+    main()
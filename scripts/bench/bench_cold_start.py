@@ -0,0 +1,208 @@
+"""
+Cold start of every terraform/lambda_* handler: import, then first invocations.
+
+Each sample is a fresh interpreter that imports one handler and calls it
+twice with a representative event. AWS is a local HTTP stub reached
+through AWS_ENDPOINT_URL, so the client code runs unchanged, nothing is
+imported ahead of the handler, and the numbers leave out network latency.
+
+    python scripts/bench/bench_cold_start.py --samples 10
+    python scripts/bench/bench_cold_start.py --save before.json
+    python scripts/bench/bench_cold_start.py --baseline before.json
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench_utils import TERRAFORM_DIR, load_handler, percentile, report
+
+USER = "bench@example.com"
+API_KEY = "bench-api-key"
+TABLES = {
+    "AGGREGATES_TABLE": "bench_aggregates",
+    "ALIASES_TABLE": "bench_aliases",
+    "PLANS_TABLE": "bench_workout_plans",
+    "RAW_DATA_TABLE": "bench_raw_data",
+    "ROLLUPS_TABLE": "bench_rollups",
+}
+PHASES = ("import", "first_invoke", "second_invoke")
+
+SUMMARY_ITEM = {
+    "user": {"S": USER},
+    "exercise_name": {"S": "total_lifted"},
+    "total_volume": {"N": "52500"},
+    "version": {"N": "3"},
+    "last_sequence": {"S": "1".zfill(40)},
+    "exercise_data": {"M": {
+        f"exercise {i}": {"M": {"total_volume": {"N": str(1000 + i)}, "total_reps": {"N": str(10 * i)}}}
+        for i in range(50)
+    }},
+}
+
+
+def dynamodb_response(operation, request):
+    """Just enough of each DynamoDB operation for the handlers to succeed"""
+    if operation == "GetItem":
+        if request["TableName"] == TABLES["AGGREGATES_TABLE"]:
+            return {"Item": SUMMARY_ITEM}
+        return {}
+    if operation in ("Query", "Scan"):
+        return {"Items": [], "Count": 0, "ScannedCount": 0}
+    if operation == "BatchGetItem":
+        return {"Responses": {}, "UnprocessedKeys": {}}
+    if operation == "BatchWriteItem":
+        return {"UnprocessedItems": {}}
+    return {}
+
+
+class StubAWSHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        target = self.headers.get("X-Amz-Target", "")
+        if self.path.startswith("/model/"):
+            response = {"content": [{"type": "text", "text": "Bench workout plan"}]}
+        elif target == "secretsmanager.GetSecretValue":
+            response = {"Name": "bench", "SecretString": json.dumps({"API_KEY": API_KEY})}
+        else:
+            response = dynamodb_response(target.rpartition(".")[2], json.loads(request or b"{}"))
+
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubContext:
+    function_name = "bench"
+
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+
+def handler_event(name):
+    today = date.today().isoformat()
+    headers = {"x-api-key": API_KEY, "x-user-email": USER}
+    if name == "lambda_aggregate":
+        new_image = {
+            "user": {"S": USER},
+            "date": {"S": today},
+            "total_volume": {"N": "1000"},
+            "exercise_volumes": {"M": {"bench press": {"N": "1000"}}},
+            "exercise_reps": {"M": {"bench press": {"N": "10"}}},
+        }
+        return {"Records": [{
+            "eventName": "INSERT",
+            "dynamodb": {
+                "Keys": {"user": {"S": USER}, "date": {"S": today}},
+                "NewImage": new_image,
+                "SequenceNumber": "100",
+            },
+        }]}
+    if name == "lambda_post":
+        body = {"user": USER, "date": today, "exercises": [
+            {"name": f"exercise {i}", "weight": 100 + i, "reps": 10} for i in range(10)
+        ]}
+        return {"headers": headers, "body": json.dumps(body)}
+    if name == "lambda_get":
+        return {"headers": headers, "body": json.dumps({"user": USER})}
+    return {"headers": headers}
+
+
+def run_child(name):
+    """Time one handler in this (fresh) interpreter and print the phases as JSON"""
+    event = handler_event(name)
+    context = StubContext()
+
+    start = time.perf_counter()
+    app = load_handler(name)
+    imported = time.perf_counter()
+    app.lambda_handler(event, context)
+    first = time.perf_counter()
+    app.lambda_handler(event, context)
+    second = time.perf_counter()
+
+    print(json.dumps({
+        "import": (imported - start) * 1000,
+        "first_invoke": (first - imported) * 1000,
+        "second_invoke": (second - first) * 1000,
+    }))
+
+
+def sample(name, endpoint):
+    env = dict(
+        os.environ,
+        AWS_ENDPOINT_URL=endpoint,
+        AWS_DEFAULT_REGION="us-east-1",
+        AWS_REGION="us-east-1",
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        API_KEY_SECRET="bench_api_key",
+        **TABLES,
+    )
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", name],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--handler", action="append", help="only these handlers (default: every lambda_*)")
+    parser.add_argument("--save", help="write p50s per handler and phase to this JSON file")
+    parser.add_argument("--baseline", help="JSON file from --save to compare p50s against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    names = args.handler or sorted(
+        os.path.basename(path) for path in glob.glob(os.path.join(TERRAFORM_DIR, "lambda_*")) if os.path.isdir(path)
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAWSHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for name in names:
+        samples = [sample(name, endpoint) for _ in range(args.samples)]
+        results[name] = {}
+        for phase in PHASES:
+            values = [s[phase] for s in samples]
+            results[name][phase] = percentile(values, 50)
+            label = f"{name} {phase}"
+            previous = baseline.get(name, {}).get(phase)
+            if previous:
+                label += f" ({(results[name][phase] - previous) / previous:+.0%})"
+            report(label, values)
+        totals = [s["import"] + s["first_invoke"] for s in samples]
+        results[name]["cold_total"] = percentile(totals, 50)
+        report(f"{name} import + first invoke", totals)
+
+    server.shutdown()
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
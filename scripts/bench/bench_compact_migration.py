@@ -0,0 +1,165 @@
+"""
+scripts/migrate_compact_sets.py against moto: legacy days end up packed, with the same sets.
+
+Users import days through lambda_post with COMPACT_SETS off, the way days
+were written before raw_sets, and with it on; sets are appended to both,
+a few legacy days lose their version as days written before versioning
+have none, and one gets a set attribute raw_sets can't hold. The stream is
+fed to lambda_aggregate throughout.
+
+The migration then runs while lambda_post appends a set to one of the days
+it has just scanned. Every other day with sets in raw_exercises must come
+out packed, with the same sets in the same order, the same version and
+room for the same appends; the raced day keeps its new set and is packed by
+the next run, and the day that can't be packed exactly is left alone. The
+MODIFY records the migration causes must leave the aggregates without drift.
+
+    pip install moto boto3
+    python scripts/bench/bench_compact_migration.py --users 10 --days 30
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from argparse import Namespace
+from collections import Counter
+from datetime import date, timedelta
+
+from bench_load import TABLES, StreamConsumer, check_drift, create_tables, instrument, scan
+from bench_utils import load_handler, quiet
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+EXERCISES = ("bench press", "squat", "deadlift", "overhead press")
+
+
+def random_set(rng):
+    return {"name": rng.choice(EXERCISES), "weight": 2.5 * rng.randint(20, 120), "reps": rng.randint(1, 12)}
+
+
+def post(post_app, body):
+    with quiet():
+        response = post_app.lambda_handler({"body": json.dumps(body)}, None)
+    assert response["statusCode"] == 200, response
+
+
+def snapshot():
+    """(user, date) -> (sets, version, room left for appended sets) of every raw day"""
+    from fitness_common import MAX_EXERCISES
+    from fitness_sets import day_sets
+
+    days = {}
+    for item in scan(TABLES["RAW_DATA_TABLE"]):
+        sets = list(day_sets(item))
+        limit = item.get("append_limit", MAX_EXERCISES)
+        days[item["user"], item["date"]] = (sets, item.get("version"), limit - len(item["raw_exercises"]))
+    return days
+
+
+def migration_args(dry_run=False):
+    return Namespace(raw_table=TABLES["RAW_DATA_TABLE"], dry_run=dry_run, segments=4, page_size=25,
+                     max_read_units=0, max_write_units=0)
+
+
+def run_migration(dry_run=False, hook=None):
+    from migrate_compact_sets import Migration
+
+    migration = Migration(migration_args(dry_run))
+    instrument(migration.dynamodb_client, Counter())
+    if hook:
+        scan_page = migration.raw_data_table.scan
+        migration.raw_data_table.scan = lambda **kwargs: hook(kwargs, scan_page(**kwargs))
+    with quiet():
+        migration.run()
+    return migration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--days", type=int, default=30, help="legacy and packed days per user, each")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        post_app = load_handler("lambda_post", TABLES)
+        aggregate_app = load_handler("lambda_aggregate", TABLES)
+        consumer = StreamConsumer(create_tables(), aggregate_app)
+        instrument(post_app.dynamodb_client, Counter())
+        instrument(aggregate_app.dynamodb_client, Counter())
+        raw_data = boto3.resource("dynamodb").Table(TABLES["RAW_DATA_TABLE"])
+
+        rng = random.Random(args.seed)
+        today = date.today()
+        users = [f"compact{i}@example.com" for i in range(args.users)]
+        for user in users:
+            for compact, offsets in ((False, range(args.days, 2 * args.days)), (True, range(args.days))):
+                post_app.COMPACT_SETS = compact
+                days = [{"date": (today - timedelta(days=offset)).isoformat(),
+                         "exercises": [random_set(rng) for _ in range(rng.randint(1, 8))]} for offset in offsets]
+                post(post_app, {"action": "import_days", "user": user, "days": days})
+            post_app.COMPACT_SETS = True
+            for offset in rng.sample(range(2 * args.days), args.days // 2):
+                workout_date = (today - timedelta(days=offset)).isoformat()
+                post(post_app, {"action": "append_set", "user": user, "date": workout_date, "set": random_set(rng)})
+            for offset in rng.sample(range(args.days, 2 * args.days), 3):
+                raw_data.update_item(Key={"user": user, "date": (today - timedelta(days=offset)).isoformat()},
+                                     UpdateExpression="REMOVE version")
+        lossy = (users[0], (today - timedelta(days=2 * args.days - 1)).isoformat())
+        raw_data.update_item(Key={"user": lossy[0], "date": lossy[1]},
+                             UpdateExpression="SET raw_exercises[0].rpe = :rpe", ExpressionAttributeValues={":rpe": 8})
+        with quiet():
+            consumer.drain()
+
+        before = snapshot()
+        legacy = sum(1 for item in scan(TABLES["RAW_DATA_TABLE"]) if item["raw_exercises"])
+        dry_run = run_migration(dry_run=True)
+        assert (dry_run.found, dry_run.kept, dry_run.packed) == (legacy, 1, 0), (dry_run.found, dry_run.kept)
+        assert snapshot() == before
+        print(f"{len(before)} days, {legacy} with sets in raw_exercises; a dry run changes nothing")
+
+        # lambda_post appends to the first day one segment scans, before it is packed
+        raced = []
+
+        def scan_and_append(kwargs, response):
+            days = [day for day in response["Items"] if (day["user"], day["date"]) != lossy]
+            if kwargs["Segment"] == 0 and days and not raced:
+                raced.append((days[0]["user"], days[0]["date"]))
+                post(post_app, {"action": "append_set", "user": raced[0][0], "date": raced[0][1],
+                                "set": random_set(rng)})
+            return response
+
+        migration = run_migration(hook=scan_and_append)
+        assert (migration.found, migration.packed, migration.skipped, migration.kept) == (legacy, legacy - 2, 1, 1), \
+            (migration.found, migration.packed, migration.skipped, migration.kept)
+        after = snapshot()
+        sets, version, room = after[raced[0]]
+        assert version == (before[raced[0]][1] or 0) + 1 and sets[:-1] == before[raced[0]][0], raced[0]
+        after[raced[0]] = before[raced[0]]
+        assert after == before, [key for key in before if after[key] != before[key]][:5]
+        left = {(item["user"], item["date"]) for item in scan(TABLES["RAW_DATA_TABLE"]) if item["raw_exercises"]}
+        assert left == {lossy, raced[0]}, left
+        print(f"migration: {migration.packed} days packed with the same sets, versions and room to append, "
+              f"{migration.skipped} appended to by lambda_post during the run, {migration.kept} left as it is")
+
+        again = run_migration()
+        assert (again.found, again.packed, again.kept) == (2, 1, 1), (again.found, again.packed, again.kept)
+        last = run_migration()
+        assert (last.found, last.packed, last.kept) == (1, 0, 1), (last.found, last.packed, last.kept)
+        with quiet():
+            consumer.drain()
+        _, drift = check_drift(aggregate_app)
+        if drift:
+            print(f"FAILED: {len(drift)} problems")
+            for problem in drift[:20]:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("running it again packs the raced day, then finds only the one it can't pack; no drift")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Size and cost of a raw day with its sets in raw_exercises versus packed in raw_sets.
+
+Item sizes follow DynamoDB's documented sizing rules (attribute names
+plus values, 3 bytes per list or map and 1 per element, numbers at about
+one byte per two digits), and write units are whole KB of item. A stream
+record carries the item twice on a MODIFY, so the stream saving doubles.
+Encode and decode are timed through fitness_sets and the layer's
+serializer, the way lambda_post and lambda_aggregate call them.
+
+    python scripts/bench/bench_compact_sets.py --iterations 2000 --sets 10 30 50
+"""
+import argparse
+import math
+import random
+from decimal import Decimal
+
+from bench_utils import load_handler, report, timed
+
+USER = "bench.user+lifts@example.com"
+EXERCISES = ("bench press", "squat", "deadlift", "overhead press", "barbell row", "romanian deadlift")
+
+
+def attribute_size(value):
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, Decimal)):
+        digits = len(Decimal(value).normalize().as_tuple().digits)
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return 3 + sum(len(key.encode("utf-8")) + attribute_size(item) + 1 for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(attribute_size(item) + 1 for item in value)
+    raise TypeError(type(value).__name__)
+
+
+def item_size(item):
+    return sum(len(name.encode("utf-8")) + attribute_size(value) for name, value in item.items())
+
+
+def workout(rng, count):
+    names = rng.sample(EXERCISES, k=min(len(EXERCISES), max(1, count // 5)))
+    return [
+        {"name": rng.choice(names), "weight": 2.5 * rng.randint(20, 160), "reps": rng.randint(3, 12)}
+        for _ in range(count)
+    ]
+
+
+def day_item(post_app, sets, compact):
+    post_app.COMPACT_SETS = compact
+    total_volume, exercise_volumes, exercise_reps = post_app.calculate_volume(sets, {})
+    return {
+        "user": USER,
+        "date": "2025-06-01",
+        "exercise": "DAILY_SUMMARY#7",
+        **post_app.day_sets_attributes(sets),
+        "total_volume": total_volume,
+        "exercise_volumes": exercise_volumes,
+        "exercise_reps": exercise_reps,
+        "version": 3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--sets", type=int, nargs="+", default=[10, 30, 50])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tables = ("RAW_DATA_TABLE", "AGGREGATES_TABLE", "ROLLUPS_TABLE", "ALIASES_TABLE")
+    post_app = load_handler("lambda_post", {name: f"bench_{name.lower()}" for name in tables})
+    from fitness_data import deserialize_item, serialize_item
+    from fitness_records import day_bests
+    from fitness_sets import day_sets, decode_sets, encode_sets
+
+    rng = random.Random(args.seed)
+    print(f"{'sets':>5} {'list bytes':>11} {'packed bytes':>13} {'raw_sets':>9} {'saved':>6} {'WCU list':>9} {'WCU packed':>11}")
+    timings = []
+    for count in args.sets:
+        sets = post_app.validate_exercises(workout(rng, count))
+        legacy = day_item(post_app, sets, False)
+        compact = day_item(post_app, sets, True)
+        assert decode_sets(compact["raw_sets"]) == sets
+        assert list(day_sets(deserialize_item(serialize_item(compact)))) == sets
+
+        legacy_size, compact_size = item_size(legacy), item_size(compact)
+        print(f"{count:>5} {legacy_size:>11} {compact_size:>13} {len(compact['raw_sets']):>9} "
+              f"{1 - compact_size / legacy_size:>6.0%} {math.ceil(legacy_size / 1024):>9} "
+              f"{math.ceil(compact_size / 1024):>11}")
+
+        legacy_wire, compact_wire = serialize_item(legacy), serialize_item(compact)
+        timings += [
+            (f"{count} sets: build + serialize list", lambda sets=sets: serialize_item(day_item(post_app, sets, False))),
+            (f"{count} sets: build + serialize packed", lambda sets=sets: serialize_item(day_item(post_app, sets, True))),
+            (f"{count} sets: deserialize list + bests", lambda wire=legacy_wire: day_bests(
+                day_sets(deserialize_item(wire)))),
+            (f"{count} sets: deserialize packed + bests", lambda wire=compact_wire: day_bests(
+                day_sets(deserialize_item(wire)))),
+            (f"{count} sets: encode_sets", lambda sets=sets: encode_sets(sets)),
+            (f"{count} sets: decode_sets", lambda data=compact["raw_sets"]: decode_sets(data)),
+        ]
+
+    print()
+    for label, func in timings:
+        report(label, timed(func, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
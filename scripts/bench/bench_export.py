@@ -0,0 +1,203 @@
+"""
+lambda_get's history export end to end against moto's S3 and DynamoDB, and its memory use.
+
+--days days of history are written to raw_data: packed days, legacy
+raw_exercises days and packed days with appended sets. The export mode
+runs for both formats with small upload parts, so the multipart path is
+exercised, and the object behind the returned link is downloaded,
+decompressed and compared set by set with what was written.
+
+Then the pipeline runs alone, against stub Query pages and an S3 stub that
+drops the parts, for a history and one ten times longer. tracemalloc's
+peak has to stay flat.
+
+    pip install moto boto3
+    python scripts/bench/bench_export.py --days 400
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+from urllib.parse import unquote, urlparse
+
+from bench_load import TABLES, create_tables
+from bench_utils import load_handler, quiet
+
+USER = "export@example.com"
+BUCKET = "bench-exports"
+EXERCISES = ("bench press", "squat", "deadlift", "overhead press", "barbell row", "pull up, weighted")
+PART_SIZE = 64 * 1024
+
+
+def random_sets(rng, count):
+    return [
+        {"name": rng.choice(EXERCISES), "weight": Decimal(str(2.5 * rng.randint(20, 160))), "reps": rng.randint(1, 12)}
+        for _ in range(count)
+    ]
+
+
+def history(rng, days):
+    """raw_data items of the user and the sets each one holds, in order"""
+    from fitness_sets import encode_sets
+
+    first = date.today() - timedelta(days=days - 1)
+    for offset in range(days):
+        workout_date = (first + timedelta(days=offset)).isoformat()
+        packed, appended = random_sets(rng, rng.randint(5, 30)), []
+        item = {"user": USER, "date": workout_date, "version": 1}
+        kind = offset % 3
+        if kind == 0:
+            item["raw_exercises"] = packed
+        else:
+            if kind == 2:
+                appended = random_sets(rng, rng.randint(1, 5))
+            item.update(raw_sets=encode_sets(packed), raw_exercises=appended)
+        yield item, packed + appended
+
+
+def expected_rows(days):
+    return [
+        (workout_date, number, exercise_set["name"], exercise_set["weight"], exercise_set["reps"])
+        for workout_date, sets in days
+        for number, exercise_set in enumerate(sets, 1)
+    ]
+
+
+def download(s3, url):
+    """The object behind a presigned link, decompressed"""
+    link = urlparse(url)
+    key = unquote(link.path).lstrip("/")
+    if not link.netloc.startswith(BUCKET):
+        key = key.split("/", 1)[1]
+    body = s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+    return gzip.decompress(body).decode("utf-8")
+
+
+def parse(export_format, text):
+    if export_format == "ndjson":
+        rows = [json.loads(line) for line in text.splitlines()]
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    return [
+        (row["date"], int(row["set"]), row["name"], Decimal(str(row["weight"])), int(row["reps"]))
+        for row in rows
+    ]
+
+
+class StubRawData:
+    """Query pages of generated days, created as they are read"""
+
+    def __init__(self, days, page_days=100, sets_per_day=20):
+        self.days = days
+        self.page_days = page_days
+        self.sets_per_day = sets_per_day
+        self.rng = random.Random(1)
+
+    def query(self, **params):
+        start = params.get("ExclusiveStartKey", {}).get("day", 0)
+        end = min(start + self.page_days, self.days)
+        items = [
+            {"date": f"day-{day:06d}", "raw_exercises": random_sets(self.rng, self.sets_per_day)}
+            for day in range(start, end)
+        ]
+        response = {"Items": items}
+        if end < self.days:
+            response["LastEvaluatedKey"] = {"day": end}
+        return response
+
+
+class DiscardingS3:
+    def __init__(self):
+        self.bytes = 0
+
+    def create_multipart_upload(self, **params):
+        return {"UploadId": "stub"}
+
+    def upload_part(self, Body, **params):
+        self.bytes += len(Body)
+        return {"ETag": str(params["PartNumber"])}
+
+    def complete_multipart_upload(self, **params):
+        pass
+
+    def abort_multipart_upload(self, **params):
+        pass
+
+
+def peak_memory(days, export_format):
+    """(tracemalloc peak in bytes, sets, gzip bytes, seconds) of exporting days of stub history"""
+    from fitness_export import export_history
+
+    s3 = DiscardingS3()
+    tracemalloc.start()
+    start = time.perf_counter()
+    sets, _ = export_history(StubRawData(days), s3, BUCKET, "stub", USER, export_format, PART_SIZE)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, sets, s3.bytes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=400)
+    parser.add_argument("--memory-days", type=int, default=2000, help="stub history for the memory check")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # moto rejects parts under 5 MiB unless told otherwise
+    os.environ["S3_UPLOAD_PART_MIN_SIZE"] = str(PART_SIZE)
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        get_app = load_handler("lambda_get", {**TABLES, "EXPORT_BUCKET": BUCKET, "EXPORT_PART_SIZE": str(PART_SIZE)})
+        create_tables()
+        logging.getLogger().setLevel(logging.WARNING)
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=BUCKET)
+
+        days = []
+        with boto3.resource("dynamodb").Table(TABLES["RAW_DATA_TABLE"]).batch_writer() as batch:
+            for item, sets in history(random.Random(args.seed), args.days):
+                batch.put_item(Item=item)
+                days.append((item["date"], sets))
+        expected = expected_rows(days)
+
+        for export_format in ("csv", "ndjson"):
+            event = {"body": json.dumps({"user": USER, "mode": "export", "format": export_format}),
+                     "headers": {"x-user-email": USER}}
+            start = time.perf_counter()
+            with quiet():
+                response = get_app.lambda_handler(event, None)
+            elapsed = time.perf_counter() - start
+            assert response["statusCode"] == 200, response
+            result = json.loads(response["body"])
+            text = download(s3, result["url"])
+            rows = parse(export_format, text)
+            assert rows == expected, f"{export_format}: {len(rows)} rows, expected {len(expected)}"
+            assert result["sets"] == len(expected)
+            print(f"{export_format:<7} {args.days} days, {len(rows)} sets: {len(text)} bytes, "
+                  f"{elapsed * 1000:.0f} ms through moto, rows match raw_data")
+
+    for export_format in ("csv", "ndjson"):
+        peaks = []
+        for days in (args.memory_days, args.memory_days * 10):
+            peak, sets, size, elapsed = peak_memory(days, export_format)
+            peaks.append(peak)
+            print(f"{export_format:<7} {days} stub days, {sets} sets -> {size / 1024:.0f} KiB gzip: "
+                  f"peak {peak / 1024:.0f} KiB traced, {sets / elapsed:,.0f} sets/s")
+        assert peaks[1] < peaks[0] * 1.5, f"{export_format}: peak memory grew with the history"
+    print("memory stays flat as the history grows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+lambda_get latency and DynamoDB reads for a client polling unchanged data.
+
+The aggregates table is replaced by an in-process stub that sleeps for a
+configurable round trip per call, so the numbers show what the version
+check, the warm response cache and 304 answers save per poll.
+
+    python scripts/bench/bench_get_polling.py --iterations 500 --exercises 50 --latency-ms 8
+"""
+import argparse
+import json
+import logging
+import time
+from decimal import Decimal
+
+from bench_utils import load_handler, quiet, report, timed
+
+USER = "bench@example.com"
+
+
+class StubAggregatesTable:
+    name = "bench_aggregated"
+
+    def __init__(self, exercises, latency_ms):
+        self.latency = latency_ms / 1000
+        self.calls = 0
+        exercise_data = {
+            f"exercise {i}": {"total_volume": Decimal(str(1000 * i + 0.5)), "total_reps": Decimal(10 * i)}
+            for i in range(exercises)
+        }
+        self.items = {
+            "total_lifted": {
+                "total_volume": sum(e["total_volume"] for e in exercise_data.values()),
+                "exercise_data": exercise_data,
+                "last_sequence": "1".zfill(40),
+                "version": Decimal(7),
+            },
+            "#version": {"version": Decimal(7)},
+        }
+
+    def get_item(self, Key, ProjectionExpression=None, ConsistentRead=False):
+        self.calls += 1
+        time.sleep(self.latency)
+        item = self.items.get(Key["exercise_name"])
+        return {"Item": dict(item)} if item else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--exercises", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=8.0)
+    args = parser.parse_args()
+
+    app = load_handler("lambda_get", {
+        "AGGREGATES_TABLE": StubAggregatesTable.name, "RAW_DATA_TABLE": "bench_raw_data", "ROLLUPS_TABLE": "bench_rollups",
+        "ALIASES_TABLE": "bench_aliases",
+    })
+    logging.getLogger().setLevel(logging.WARNING)
+    stub = StubAggregatesTable(args.exercises, args.latency_ms)
+    app.aggregates_table = stub
+
+    event = {"headers": {"x-user-email": USER}, "body": json.dumps({"user": USER})}
+    with quiet():
+        first = app.lambda_handler(event, None)
+        assert first["statusCode"] == 200
+        conditional_event = {
+            "headers": {"x-user-email": USER, "if-none-match": first["headers"]["ETag"]},
+            "body": event["body"],
+        }
+        assert app.lambda_handler(conditional_event, None)["statusCode"] == 304
+
+    def cold():
+        app._response_cache.clear()
+        app.lambda_handler(event, None)
+
+    scenarios = [
+        ("full read (cold response cache)", cold),
+        ("warm response cache", lambda: app.lambda_handler(event, None)),
+        ("If-None-Match (304)", lambda: app.lambda_handler(conditional_event, None)),
+    ]
+
+    print(f"DynamoDB stub latency: {args.latency_ms} ms, {args.exercises} exercises")
+    for label, func in scenarios:
+        stub.calls = 0
+        samples = timed(func, args.iterations)
+        report(f"{label} ({stub.calls / args.iterations:.1f} reads/poll)", samples)
+
+
+if __name__ == "__main__":
+    main()
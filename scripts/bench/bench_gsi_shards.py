@@ -0,0 +1,182 @@
+"""
+Write-sharded exercise-date-index against moto, before and after scripts/migrate_gsi_shards.py.
+
+Users import days through lambda_post, which keys them on their shard,
+next to days written the old way under the single legacy "DAILY_SUMMARY"
+key. Reading the index back from all DAILY_SUMMARY_SHARDS shards plus the
+legacy key and merging the date-sorted results has to give every raw day
+exactly once, in date order, under the key its item holds.
+
+The migration then runs while lambda_post rewrites one of the days it has
+just scanned: it must move every other legacy day to its shard and leave
+the rewritten one alone. A second run must find nothing to move and change
+nothing, and the index must still give every day once.
+
+    pip install moto boto3
+    python scripts/bench/bench_gsi_shards.py --users 20 --days 30
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+from argparse import Namespace
+from collections import Counter
+from datetime import date, timedelta
+
+from bench_load import TABLES, create_tables, instrument, scan
+from bench_utils import load_handler, quiet
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+EXERCISES = ("bench press", "squat", "deadlift", "overhead press")
+
+
+def random_day(rng):
+    return [{"name": rng.choice(EXERCISES), "weight": 5 * rng.randint(10, 60), "reps": rng.randint(3, 12)}
+            for _ in range(rng.randint(1, 5))]
+
+
+def index_partitions():
+    from fitness_common import DAILY_SUMMARY, DAILY_SUMMARY_SHARDS
+
+    return [f"{DAILY_SUMMARY}#{shard}" for shard in range(DAILY_SUMMARY_SHARDS)] + [DAILY_SUMMARY]
+
+
+def query_partition(table, partition):
+    """One partition's days in date order, as a reader of the index gets them"""
+    items = []
+    kwargs = {
+        "IndexName": "exercise-date-index",
+        "KeyConditionExpression": "#exercise = :exercise",
+        "ExpressionAttributeNames": {"#exercise": "exercise"},
+        "ExpressionAttributeValues": {":exercise": partition},
+    }
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return items
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def check_index(label):
+    """Every raw day comes back once from the merged partitions; returns days per partition"""
+    import boto3
+
+    table = boto3.resource("dynamodb").Table(TABLES["RAW_DATA_TABLE"])
+    results = {partition: query_partition(table, partition) for partition in index_partitions()}
+    merged = list(heapq.merge(*results.values(), key=lambda item: item["date"]))
+    days = {(item["user"], item["date"]): item["exercise"] for item in scan(TABLES["RAW_DATA_TABLE"])}
+
+    problems = []
+    found = Counter((item["user"], item["date"]) for item in merged)
+    if [item["date"] for item in merged] != sorted(item["date"] for item in merged):
+        problems.append("merged days are not in date order")
+    problems += [f"{day} found {count} times" for day, count in found.items() if count != 1]
+    problems += [f"{day} missing" for day in days.keys() - found.keys()]
+    problems += [
+        f"{(item['user'], item['date'])} under {partition}, item holds {days.get((item['user'], item['date']))}"
+        for partition, items in results.items() for item in items
+        if days.get((item["user"], item["date"])) != partition
+    ]
+    if problems:
+        print(f"FAILED ({label}): {len(problems)} problems")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        sys.exit(1)
+    return {partition: len(items) for partition, items in results.items()}
+
+
+def migration_args(dry_run=False):
+    return Namespace(raw_table=TABLES["RAW_DATA_TABLE"], dry_run=dry_run, segments=4, page_size=25,
+                     max_read_units=0, max_write_units=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30, help="sharded and legacy days per user, each")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        post_app = load_handler("lambda_post", TABLES)
+        create_tables()
+        # The migration scans on several threads; calls into moto are serialized
+        instrument(post_app.dynamodb_client, Counter())
+        from fitness_common import DAILY_SUMMARY, daily_summary_key
+        from migrate_gsi_shards import Migration
+
+        rng = random.Random(args.seed)
+        raw_data = boto3.resource("dynamodb").Table(TABLES["RAW_DATA_TABLE"])
+        today = date.today()
+        users = [f"shard{i}@example.com" for i in range(args.users)]
+        legacy = set()
+        for user in users:
+            days = [{"date": (today - timedelta(days=offset)).isoformat(), "exercises": random_day(rng)}
+                    for offset in range(args.days)]
+            with quiet():
+                response = post_app.lambda_handler(
+                    {"body": json.dumps({"action": "import_days", "user": user, "days": days})}, None
+                )
+            assert response["statusCode"] == 200, response
+            # Older days as lambda_post wrote them before the index was sharded
+            for offset in range(args.days, 2 * args.days):
+                workout_date = (today - timedelta(days=offset)).isoformat()
+                raw_data.put_item(Item={"user": user, "date": workout_date, "exercise": DAILY_SUMMARY,
+                                        "raw_exercises": random_day(rng), "version": 1})
+                legacy.add((user, workout_date))
+
+        before = check_index("before the migration")
+        shards = [count for partition, count in before.items() if partition != DAILY_SUMMARY]
+        print(f"{sum(before.values())} days: {before[DAILY_SUMMARY]} under {DAILY_SUMMARY}, "
+              f"{min(shards)} to {max(shards)} under each of {len(shards)} shards; "
+              "merged partitions give every day once, in date order")
+
+        # lambda_post rewrites the first legacy day one segment scans, before it is moved
+        migration = Migration(migration_args())
+        instrument(migration.dynamodb_client, Counter())
+        scan_page = migration.raw_data_table.scan
+        rewritten = []
+
+        def scan_and_rewrite(**kwargs):
+            response = scan_page(**kwargs)
+            if kwargs["Segment"] == 0 and response["Items"] and not rewritten:
+                user, workout_date = response["Items"][0]["user"], response["Items"][0]["date"]
+                body = {"user": user, "date": workout_date, "exercises": random_day(rng)}
+                assert post_app.lambda_handler({"body": json.dumps(body)}, None)["statusCode"] == 200
+                rewritten.append((user, workout_date))
+            return response
+
+        migration.raw_data_table.scan = scan_and_rewrite
+        with quiet():
+            migration.run()
+        assert (migration.found, migration.moved, migration.skipped) == (len(legacy), len(legacy) - 1, 1), \
+            (migration.found, migration.moved, migration.skipped)
+        user, workout_date = rewritten[0]
+        day = raw_data.get_item(Key={"user": user, "date": workout_date})["Item"]
+        assert day["exercise"] == daily_summary_key(user, workout_date) and day["version"] == 2, day
+        after = check_index("after the migration")
+        assert after[DAILY_SUMMARY] == 0, after
+        print(f"migration: {migration.found} legacy days found, {migration.moved} moved, "
+              f"{migration.skipped} rewritten by lambda_post during the run and left alone")
+
+        items = {(item["user"], item["date"]): item for item in scan(TABLES["RAW_DATA_TABLE"])}
+        for dry_run in (True, False):
+            again = Migration(migration_args(dry_run))
+            instrument(again.dynamodb_client, Counter())
+            with quiet():
+                again.run()
+            assert (again.found, again.moved, again.skipped) == (0, 0, 0), (again.found, again.moved)
+        assert {(item["user"], item["date"]): item for item in scan(TABLES["RAW_DATA_TABLE"])} == items
+        assert check_index("after running the migration again") == after
+        print("running it again finds nothing to move and changes nothing")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Load test lambda_post and lambda_get against moto, then check for drift.
+
+Synthetic users post workouts, re-post days with changed sets, append sets
+and read their summary and ranges from a pool of worker threads, while a
+background consumer feeds the raw_data stream to lambda_aggregate the way
+the event source mapping does. When the load stops the stream is drained
+and the aggregates, the exercise_data summaries and the rollups are
+compared with a recomputation from raw_data; any difference fails the run.
+
+moto's backends aren't thread-safe, so DynamoDB calls are serialized behind
+one lock. Latencies include waiting for it, which makes the numbers a
+relative measure of handler cost and calls per request, not of DynamoDB.
+moto also slows down as the tables grow, so runs of a few hundred to a
+couple of thousand requests are the useful range.
+
+    pip install moto boto3
+    python scripts/bench/bench_load.py --users 20 --requests 500 --concurrency 8
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+from bench_utils import load_handler, report
+
+TABLES = {
+    "RAW_DATA_TABLE": "load_raw_data",
+    "AGGREGATES_TABLE": "load_aggregated",
+    "ROLLUPS_TABLE": "load_rollups",
+    "ALIASES_TABLE": "load_aliases",
+}
+# Exercise name -> typical working weight in lbs
+EXERCISES = {
+    "bench press": 185, "squat": 245, "deadlift": 315, "overhead press": 115,
+    "barbell row": 155, "pull up": 0, "dip": 0, "incline bench press": 155,
+    "romanian deadlift": 225, "front squat": 185, "leg press": 360, "lat pulldown": 140,
+    "seated cable row": 140, "dumbbell curl": 35, "tricep pushdown": 60, "lateral raise": 20,
+    "hip thrust": 225, "lunge": 95, "calf raise": 180, "face pull": 50,
+}
+# Relative frequency of each request type
+MIX = {"record_workout": 35, "repost_workout": 15, "append_set": 20, "get_summary": 25, "get_range": 5}
+STREAM_BATCH_SIZE = 100
+STREAM_POLL_SECONDS = 0.05
+
+backend_lock = threading.Lock()
+request_calls = threading.local()
+
+
+def instrument(dynamodb_client, calls):
+    """Count a handler's DynamoDB calls per operation and serialize them into moto"""
+    client = dynamodb_client.client
+    make_api_call = client._make_api_call
+
+    def counted(operation_name, params):
+        calls[operation_name] += 1
+        request_calls.count = getattr(request_calls, "count", 0) + 1
+        with backend_lock:
+            return make_api_call(operation_name, params)
+
+    client._make_api_call = counted
+
+
+def create_tables():
+    import boto3
+
+    client = boto3.client("dynamodb")
+
+    def create(name, hash_key, range_key, **kwargs):
+        attributes = [(attribute, "S") for attribute in (hash_key, range_key, *kwargs.pop("extra_attributes", ()))]
+        attributes += [(attribute, "N") for attribute in kwargs.pop("number_attributes", ())]
+        client.create_table(
+            TableName=name,
+            BillingMode="PAY_PER_REQUEST",
+            AttributeDefinitions=[
+                {"AttributeName": attribute, "AttributeType": attribute_type} for attribute, attribute_type in attributes
+            ],
+            KeySchema=[{"AttributeName": hash_key, "KeyType": "HASH"}, {"AttributeName": range_key, "KeyType": "RANGE"}],
+            **kwargs,
+        )
+
+    def change_index(*attributes):
+        return {
+            "IndexName": "user-change-index",
+            "KeySchema": [{"AttributeName": "user", "KeyType": "HASH"}, {"AttributeName": "change_seq", "KeyType": "RANGE"}],
+            "Projection": {"ProjectionType": "INCLUDE", "NonKeyAttributes": list(attributes)},
+        }
+
+    # Mirrors terraform/dynamo.tf
+    create(
+        TABLES["RAW_DATA_TABLE"], "user", "date",
+        extra_attributes=("exercise",),
+        number_attributes=("change_seq",),
+        GlobalSecondaryIndexes=[{
+            "IndexName": "exercise-date-index",
+            "KeySchema": [{"AttributeName": "exercise", "KeyType": "HASH"}, {"AttributeName": "date", "KeyType": "RANGE"}],
+            "Projection": {"ProjectionType": "ALL"},
+        }, change_index("exercise_reps", "exercise_volumes", "total_volume", "version")],
+        StreamSpecification={"StreamEnabled": True, "StreamViewType": "NEW_AND_OLD_IMAGES"},
+    )
+    create(
+        TABLES["AGGREGATES_TABLE"], "user", "exercise_name",
+        number_attributes=("change_seq",),
+        GlobalSecondaryIndexes=[change_index(
+            "best_e1rm", "best_e1rm_date", "best_set_volume", "best_set_volume_date",
+            "max_weight", "max_weight_date", "total_reps", "total_volume",
+        )],
+    )
+    create(TABLES["ROLLUPS_TABLE"], "user", "bucket")
+    create(TABLES["ALIASES_TABLE"], "user", "alias")
+    return client.describe_table(TableName=TABLES["RAW_DATA_TABLE"])["Table"]["LatestStreamArn"]
+
+
+class StreamConsumer:
+    """Feeds raw_data stream records to lambda_aggregate in order, retrying reported failures"""
+
+    def __init__(self, stream_arn, aggregate_app):
+        import boto3
+
+        self.streams = boto3.client("dynamodbstreams")
+        self.aggregate_app = aggregate_app
+        with backend_lock:
+            shard = self.streams.describe_stream(StreamArn=stream_arn)["StreamDescription"]["Shards"][0]
+            self.iterator = self.streams.get_shard_iterator(
+                StreamArn=stream_arn, ShardId=shard["ShardId"], ShardIteratorType="TRIM_HORIZON",
+            )["ShardIterator"]
+        self.pending = []
+        self.records = 0
+        self.batches = 0
+        self.retries = 0
+        self.stopping = threading.Event()
+
+    def poll(self):
+        with backend_lock:
+            response = self.streams.get_records(ShardIterator=self.iterator)
+        self.iterator = response["NextShardIterator"]
+        self.pending.extend(response["Records"])
+        while self.pending:
+            batch = self.pending[:STREAM_BATCH_SIZE]
+            self.batches += 1
+            failures = self.aggregate_app.lambda_handler({"Records": batch}, None)["batchItemFailures"]
+            if not failures:
+                self.records += len(batch)
+                del self.pending[:len(batch)]
+                continue
+            # Lambda retries the shard from the lowest failed sequence number
+            failed = {failure["itemIdentifier"] for failure in failures}
+            first = next(i for i, record in enumerate(batch) if record["dynamodb"]["SequenceNumber"] in failed)
+            self.records += first
+            del self.pending[:first]
+            self.retries += 1
+            if self.retries > 100:
+                raise RuntimeError("lambda_aggregate keeps failing the same records")
+        return len(response["Records"])
+
+    def run(self):
+        while not self.stopping.is_set():
+            if not self.poll():
+                time.sleep(STREAM_POLL_SECONDS)
+
+    def drain(self):
+        while self.poll():
+            pass
+
+
+class Workload:
+    """Seeded stream of requests with realistic users, days and sets"""
+
+    def __init__(self, users, days, seed):
+        self.random = random.Random(seed)
+        self.today = date.today()
+        self.days = days
+        self.users = [f"lifter{i}@example.com" for i in range(users)]
+        self.favourites = {
+            user: self.random.sample(sorted(EXERCISES), self.random.randint(4, 8)) for user in self.users
+        }
+        self.posted = defaultdict(list)
+
+    def random_date(self):
+        return (self.today - timedelta(days=self.random.randrange(self.days))).isoformat()
+
+    def random_set(self, user):
+        name = self.random.choice(self.favourites[user])
+        base = EXERCISES[name]
+        weight = max(0, base + 5 * self.random.randint(-6, 4))
+        if self.random.random() < 0.2:
+            weight += 2.5
+        # Users don't always type names the same way
+        if self.random.random() < 0.1:
+            name = name.title()
+        return {"name": name, "weight": weight, "reps": self.random.randint(3, 12)}
+
+    def workout(self, user):
+        return [self.random_set(user) for _ in range(self.random.randint(6, 20))]
+
+    def request(self):
+        kind = self.random.choices(list(MIX), weights=list(MIX.values()))[0]
+        user = self.random.choice(self.users)
+        if kind == "repost_workout" and not self.posted[user]:
+            kind = "record_workout"
+
+        if kind in ("record_workout", "repost_workout"):
+            workout_date = self.random.choice(self.posted[user]) if kind == "repost_workout" else self.random_date()
+            self.posted[user].append(workout_date)
+            body = {"user": user, "date": workout_date, "exercises": self.workout(user)}
+            return kind, "post", {"body": json.dumps(body)}
+        if kind == "append_set":
+            workout_date = self.random.choice(self.posted[user] or [self.today.isoformat()])
+            body = {"action": "append_set", "user": user, "date": workout_date, "set": self.random_set(user)}
+            return kind, "post", {"body": json.dumps(body)}
+
+        headers = {"x-user-email": user}
+        if kind == "get_summary":
+            return kind, "get", {"headers": headers, "body": json.dumps({"user": user})}
+        start = self.today - timedelta(days=self.random.randrange(self.days))
+        body = {
+            "user": user, "mode": "range", "granularity": self.random.choice(["day", "week", "month"]),
+            "start": start.isoformat(), "end": self.today.isoformat(),
+        }
+        return kind, "get", {"headers": headers, "body": json.dumps(body)}
+
+
+def scan(table_name):
+    import boto3
+
+    table = boto3.resource("dynamodb").Table(table_name)
+    items = []
+    kwargs = {}
+    while True:
+        response = table.scan(**kwargs)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return items
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def nonzero(totals):
+    return {key: value for key, value in totals.items() if value != 0}
+
+
+def differences(actual, expected):
+    """The first few keys whose totals differ, as 'key: actual != expected'"""
+    actual, expected = nonzero(actual), nonzero(expected)
+    keys = sorted(key for key in set(actual) | set(expected) if actual.get(key) != expected.get(key))
+    return "; ".join(f"{key}: {actual.get(key, 0)} != {expected.get(key, 0)}" for key in keys[:3])
+
+
+def check_drift(aggregate_app):
+    """Compare aggregates, summaries and rollups with a recomputation from raw_data"""
+    aliases = defaultdict(dict)
+    for item in scan(TABLES["ALIASES_TABLE"]):
+        aliases[item["user"]][item["alias"]] = item["canonical"]
+
+    expected_rows = defaultdict(Counter)
+    expected_totals = Counter()
+    expected_rollups = defaultdict(Counter)
+    for day in scan(TABLES["RAW_DATA_TABLE"]):
+        user = day["user"]
+        user_aliases = aliases[user]
+        expected_totals[user] += day.get("total_volume", Decimal("0"))
+        buckets = aggregate_app.rollup_buckets(day["date"])
+        for bucket in buckets:
+            expected_rollups[(user, bucket)]["total_volume"] += day.get("total_volume", Decimal("0"))
+        for attribute, field in (("total_volume", "exercise_volumes"), ("total_reps", "exercise_reps")):
+            prefix = "volume:" if attribute == "total_volume" else "reps:"
+            for name, value in day.get(field, {}).items():
+                name = user_aliases.get(name, name)
+                expected_rows[user][(name, attribute)] += value
+                for bucket in buckets:
+                    expected_rollups[(user, bucket)][prefix + name] += value
+
+    problems = []
+    actual_rows = defaultdict(Counter)
+    actual_totals = Counter()
+    for item in scan(TABLES["AGGREGATES_TABLE"]):
+        user, name = item["user"], item["exercise_name"]
+        if name == "total_lifted":
+            actual_totals[user] = item.get("total_volume", Decimal("0"))
+            if "exercise_data" not in item:
+                # lambda_get builds the summary the first time the user reads it
+                continue
+            summary = Counter()
+            for exercise_name, totals in item["exercise_data"].items():
+                for attribute, value in totals.items():
+                    summary[(exercise_name, attribute)] += value
+            if nonzero(summary) != nonzero(expected_rows[user]):
+                problems.append(f"{user}: exercise_data summary {differences(summary, expected_rows[user])}")
+        elif not name.startswith("#"):
+            for attribute in ("total_volume", "total_reps"):
+                actual_rows[user][(name, attribute)] += item.get(attribute, Decimal("0"))
+
+    for user in set(expected_totals) | set(actual_totals):
+        if actual_totals[user] != expected_totals[user]:
+            problems.append(f"{user}: total_lifted {actual_totals[user]} != {expected_totals[user]}")
+    for user in set(expected_rows) | set(actual_rows):
+        if nonzero(actual_rows[user]) != nonzero(expected_rows[user]):
+            problems.append(f"{user}: exercise rows {differences(actual_rows[user], expected_rows[user])}")
+
+    actual_rollups = {
+        (item["user"], item["bucket"]): Counter({
+            key: value for key, value in item.items() if key not in ("user", "bucket")
+        })
+        for item in scan(TABLES["ROLLUPS_TABLE"])
+    }
+    for key in set(expected_rollups) | set(actual_rollups):
+        actual, expected = actual_rollups.get(key, Counter()), expected_rollups.get(key, Counter())
+        if nonzero(actual) != nonzero(expected):
+            problems.append(f"{key[0]}: rollup {key[1]} {differences(actual, expected)}")
+
+    return len(expected_rows), problems
+
+
+def report_emf(output):
+    """Mean of every metric in the handlers' EMF lines, per function"""
+    metrics = defaultdict(lambda: defaultdict(list))
+    for line in output.splitlines():
+        if not line.startswith('{"_aws"'):
+            continue
+        record = json.loads(line)
+        names = [metric["Name"] for metric in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]]
+        for name in names:
+            metrics[record["Function"]][name].append(record[name])
+
+    for function, values in sorted(metrics.items()):
+        invocations = len(values["Time.Duration"])
+        means = ", ".join(
+            f"{name.removeprefix('Time.')} {sum(samples) / invocations:.2f}"
+            for name, samples in values.items() if name != "Time.Duration"
+        )
+        print(f"{function} EMF, mean per invocation over {invocations}: {means}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--days", type=int, default=90, help="how far back workouts are dated")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from moto import mock_aws
+
+    with mock_aws():
+        post_app = load_handler("lambda_post", TABLES)
+        get_app = load_handler("lambda_get", TABLES)
+        aggregate_app = load_handler("lambda_aggregate", TABLES)
+        stream_arn = create_tables()
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+        calls = {name: Counter() for name in ("post", "get", "aggregate")}
+        instrument(post_app.dynamodb_client, calls["post"])
+        instrument(get_app.dynamodb_client, calls["get"])
+        instrument(aggregate_app.dynamodb_client, calls["aggregate"])
+        handlers = {"post": post_app.lambda_handler, "get": get_app.lambda_handler}
+
+        workload = Workload(args.users, args.days, args.seed)
+        requests = [workload.request() for _ in range(args.requests)]
+        latencies = defaultdict(list)
+        request_counts = defaultdict(list)
+        statuses = defaultdict(Counter)
+
+        def send(request):
+            kind, handler, event = request
+            request_calls.count = 0
+            start = time.perf_counter()
+            response = handlers[handler](event, None)
+            latencies[kind].append((time.perf_counter() - start) * 1000)
+            request_counts[kind].append(request_calls.count)
+            statuses[kind][response["statusCode"]] += 1
+
+        consumer = StreamConsumer(stream_arn, aggregate_app)
+        consumer_thread = threading.Thread(target=consumer.run, daemon=True)
+        consumer_thread.start()
+
+        # The handlers print one EMF metrics line per invocation
+        emf_output = io.StringIO()
+        with contextlib.redirect_stdout(emf_output):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(send, requests))
+            elapsed = time.perf_counter() - start
+
+            consumer.stopping.set()
+            consumer_thread.join()
+            consumer.drain()
+
+        print(f"{args.requests} requests from {args.users} users, {args.concurrency} workers: "
+              f"{elapsed:.2f} s, {args.requests / elapsed:.0f} requests/s")
+        for kind in MIX:
+            if not latencies[kind]:
+                continue
+            samples = latencies[kind]
+            per_request = sum(request_counts[kind]) / len(samples)
+            codes = ", ".join(f"{code}: {count}" for code, count in sorted(statuses[kind].items()))
+            report(f"{kind} ({per_request:.1f} DynamoDB calls)", samples)
+            print(f"{'':<40} status {codes}")
+        for name, counter in calls.items():
+            print(f"{name} DynamoDB calls: " + ", ".join(f"{op} {n}" for op, n in counter.most_common()))
+        report_emf(emf_output.getvalue())
+        print(f"stream: {consumer.records} records in {consumer.batches} lambda_aggregate batches, "
+              f"{consumer.retries} retried, "
+              f"{sum(calls['aggregate'].values()) / max(consumer.records, 1):.2f} DynamoDB calls per record")
+
+        users, problems = check_drift(aggregate_app)
+        if problems:
+            print(f"DRIFT: {len(problems)} differences between aggregates and raw_data")
+            for problem in problems[:20]:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"no drift: aggregates, summaries and rollups of {users} users match raw_data")
+
+
+if __name__ == "__main__":
+    main()
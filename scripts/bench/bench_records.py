@@ -0,0 +1,271 @@
+"""
+Personal records against moto: record rows match the raw days after re-posts, appends and merges.
+
+First a fixed story for one user, fed to lambda_aggregate after every step:
+a record is set, its day is re-posted lower so the record falls back to the
+next best day, an appended set beats it, and a merge folds an alias's
+records into the canonical exercise, which a lower re-post then takes back
+out again. Two races are then forced: a day raised and put back while a
+batch that reads the history is being handled, and an alias day lowered
+while a merge is under way.
+
+Then worker threads record, re-post lower and append to a handful of hot
+days of several users while lambda_aggregate consumes the stream, as in
+bench_same_day; half way through every user merges two exercises into a
+third. After each step and at the end, every user's record rows must hold
+the best value of each metric over their raw days, with a date that
+reaches it, and no record rows for merged aliases.
+
+    pip install moto boto3
+    python scripts/bench/bench_records.py --users 4 --requests 300 --concurrency 8
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import random
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+from bench_load import TABLES, StreamConsumer, check_drift, create_tables, instrument, scan
+from bench_utils import load_handler, quiet
+
+STORY_USER = "records@example.com"
+# Exercise name -> typical working weight in lbs; the aliases are merged into "bench press"
+EXERCISES = {"bench press": 185, "db bench": 160, "dumbbell bench": 150, "squat": 245, "deadlift": 315}
+MERGE = {"canonical": "bench press", "aliases": ["db bench", "dumbbell bench"]}
+MIX = {"record_workout": 35, "lower_repost": 25, "append_set": 40}
+
+
+def expected_records(user):
+    """exercise -> metric -> (best value, dates that reach it), from the user's raw days and aliases"""
+    from fitness_records import day_bests
+    from fitness_sets import day_sets
+
+    aliases = {item["alias"]: item["canonical"] for item in scan(TABLES["ALIASES_TABLE"]) if item["user"] == user}
+    best = {}
+    for day in scan(TABLES["RAW_DATA_TABLE"]):
+        if day["user"] != user:
+            continue
+        for exercise_name, metrics in day_bests(day_sets(day), aliases).items():
+            for metric, value in metrics.items():
+                held = best.setdefault(exercise_name, {}).get(metric)
+                if held is None or value > held[0]:
+                    best[exercise_name][metric] = (value, {day["date"]})
+                elif value == held[0]:
+                    held[1].add(day["date"])
+    return best
+
+
+def check_records(user, label):
+    from fitness_records import RECORD_PREFIX, records_from_items
+
+    rows = [item for item in scan(TABLES["AGGREGATES_TABLE"])
+            if item["user"] == user and item["exercise_name"].startswith(RECORD_PREFIX)]
+    records = records_from_items(rows)
+    expected = expected_records(user)
+    problems = []
+    for exercise_name in sorted(set(records) | set(expected)):
+        for metric in sorted(set(records.get(exercise_name, {})) | set(expected.get(exercise_name, {}))):
+            held = records.get(exercise_name, {}).get(metric)
+            best = expected.get(exercise_name, {}).get(metric)
+            if held is None or best is None or held["value"] != best[0] or held["date"] not in best[1]:
+                problems.append(f"{user} {exercise_name} {metric}: record {held}, best over raw days {best}")
+    return [f"{label}: {problem}" for problem in problems]
+
+
+def record_of(user, exercise_name, metric="max_weight"):
+    from fitness_records import record_row
+
+    for item in scan(TABLES["AGGREGATES_TABLE"]):
+        if item["user"] == user and item["exercise_name"] == record_row(exercise_name):
+            return (item[metric], item[f"{metric}_date"]) if metric in item else None
+    return None
+
+
+def run_story(post_app, consumer):
+    """A fixed sequence of writes whose records are known; returns problems"""
+    day1, day2, day3 = ((date.today() - timedelta(days=offset)).isoformat() for offset in (3, 2, 1))
+    steps = [
+        ("a record is set", {"user": STORY_USER, "date": day1, "exercises": [
+            {"name": "squat", "weight": 300, "reps": 3}, {"name": "db bench", "weight": 100, "reps": 10},
+            {"name": "bench press", "weight": 90, "reps": 10}]}, ("squat", Decimal(300), day1)),
+        ("a lower day doesn't take it", {"user": STORY_USER, "date": day2, "exercises": [
+            {"name": "squat", "weight": 280, "reps": 5}, {"name": "bench press", "weight": 95, "reps": 8}]},
+         ("squat", Decimal(300), day1)),
+        ("re-posting the record day lower falls back to the next best", {"user": STORY_USER, "date": day1, "exercises": [
+            {"name": "squat", "weight": 200, "reps": 3}, {"name": "db bench", "weight": 100, "reps": 10},
+            {"name": "bench press", "weight": 90, "reps": 10}]}, ("squat", Decimal(280), day2)),
+        ("an appended set beats it", {"action": "append_set", "user": STORY_USER, "date": day3,
+                                      "set": {"name": "squat", "weight": 310, "reps": 1}},
+         ("squat", Decimal(310), day3)),
+        ("a merge folds the alias's record into the canonical one", dict(MERGE, action="merge_exercises",
+                                                                         user=STORY_USER),
+         ("bench press", Decimal(100), day1)),
+        ("re-posting the day of the merged record lower takes it back out", {
+            "user": STORY_USER, "date": day1, "exercises": [{"name": "squat", "weight": 200, "reps": 3}]},
+         ("bench press", Decimal(95), day2)),
+    ]
+    problems = []
+    for label, body, (exercise_name, value, workout_date) in steps:
+        with quiet():
+            response = post_app.lambda_handler({"body": json.dumps(body)}, None)
+            consumer.drain()
+        assert response["statusCode"] == 200, response
+        if record_of(STORY_USER, exercise_name) != (value, workout_date):
+            problems.append(f"{label}: {exercise_name} max_weight is {record_of(STORY_USER, exercise_name)}, "
+                            f"expected {(value, workout_date)}")
+        problems += check_records(STORY_USER, label)
+    for alias in MERGE["aliases"]:
+        if record_of(STORY_USER, alias) is not None:
+            problems.append(f"merged alias {alias} still has a record row")
+    return problems + run_races(post_app, consumer, day2, day3)
+
+
+def run_races(post_app, consumer, day2, day3):
+    """Writes that land while a batch or a merge is half done; returns problems"""
+    aggregate_app = consumer.aggregate_app
+    handle_batch, build_record_update = aggregate_app.lambda_handler, post_app.build_record_update
+    today = date.today().isoformat()
+
+    def post(body):
+        response = post_app.lambda_handler({"body": json.dumps(body)}, None)
+        assert response["statusCode"] == 200, response
+
+    def raised_ahead_of_the_batch(event, context):
+        # The history read for the lowered day3 sees day2 raised before its stream record arrives,
+        # and day2 is back where it was by the next batch, which starts and ends with the same day
+        aggregate_app.lambda_handler = handle_batch
+        post({"user": STORY_USER, "date": day2, "exercises": [{"name": "squat", "weight": 400, "reps": 1}]})
+        response = handle_batch(event, context)
+        post({"user": STORY_USER, "date": day2, "exercises": [{"name": "squat", "weight": 280, "reps": 5}]})
+        return response
+
+    def lowered_during_the_merge(*args, **kwargs):
+        # The alias day is lowered, and its stream record applied, after the merge read the records
+        post_app.build_record_update = build_record_update
+        post({"user": STORY_USER, "date": today, "exercises": [{"name": "front squat", "weight": 100, "reps": 1}]})
+        consumer.drain()
+        return build_record_update(*args, **kwargs)
+
+    problems = []
+    with quiet():
+        aggregate_app.lambda_handler = raised_ahead_of_the_batch
+        post({"user": STORY_USER, "date": day3, "exercises": [{"name": "squat", "weight": 100, "reps": 1}]})
+        consumer.drain()
+    if record_of(STORY_USER, "squat") != (Decimal(280), day2):
+        problems.append(f"a record read ahead of the stream stayed: squat max_weight is {record_of(STORY_USER, 'squat')}")
+    problems += check_records(STORY_USER, "a record read ahead of the stream")
+
+    with quiet():
+        post({"user": STORY_USER, "date": today, "exercises": [{"name": "front squat", "weight": 350, "reps": 1}]})
+        consumer.drain()
+        post_app.build_record_update = lowered_during_the_merge
+        post({"action": "merge_exercises", "user": STORY_USER, "canonical": "squat", "aliases": ["front squat"]})
+        consumer.drain()
+    if record_of(STORY_USER, "squat") != (Decimal(280), day2):
+        problems.append(f"an alias day lowered during a merge left squat max_weight at {record_of(STORY_USER, 'squat')}")
+    problems += check_records(STORY_USER, "an alias day lowered during a merge")
+    return problems
+
+
+def build_requests(rng, users, dates, count):
+    def random_set(scale=1.0):
+        name = rng.choice(list(EXERCISES))
+        weight = 5 * round(EXERCISES[name] * scale * rng.uniform(0.6, 1.2) / 5)
+        return {"name": name, "weight": weight, "reps": rng.randint(1, 12)}
+
+    requests = []
+    for _ in range(count):
+        kind = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+        body = {"user": rng.choice(users), "date": rng.choice(dates)}
+        if kind == "append_set":
+            body.update(action="append_set", set=random_set())
+        else:
+            # A lower re-post replaces a day, maybe one holding records, with light sets
+            scale = 0.3 if kind == "lower_repost" else 1.0
+            body["exercises"] = [random_set(scale) for _ in range(rng.randint(1, 6))]
+        requests.append((kind, {"body": json.dumps(body)}))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--days", type=int, default=4, help="hot dates per user")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from moto import mock_aws
+
+    with mock_aws():
+        post_app = load_handler("lambda_post", TABLES)
+        aggregate_app = load_handler("lambda_aggregate", TABLES)
+        stream_arn = create_tables()
+        logging.getLogger().setLevel(logging.CRITICAL)
+        instrument(post_app.dynamodb_client, Counter())
+        instrument(aggregate_app.dynamodb_client, Counter())
+        consumer = StreamConsumer(stream_arn, aggregate_app)
+
+        problems = run_story(post_app, consumer)
+        if not problems:
+            print("story: re-posts, appends, merges and writes racing a batch or a merge leave the records the raw days hold")
+
+        rng = random.Random(args.seed)
+        users = [f"records{i}@example.com" for i in range(args.users)]
+        dates = [(date.today() - timedelta(days=i)).isoformat() for i in range(args.days)]
+        requests = build_requests(rng, users, dates, args.requests)
+        statuses = Counter()
+        lock = threading.Lock()
+
+        def send(request):
+            kind, event = request
+            status = post_app.lambda_handler(event, None)["statusCode"]
+            with lock:
+                statuses[kind, status] += 1
+
+        consumer_thread = threading.Thread(target=consumer.run, daemon=True)
+        consumer_thread.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            half = len(requests) // 2
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(send, requests[:half]))
+                # Merges land while the stream still holds days written under the aliases
+                for user in users:
+                    executor.submit(send, ("merge_exercises", {"body": json.dumps(dict(
+                        MERGE, action="merge_exercises", user=user))}))
+                list(executor.map(send, requests[half:]))
+            consumer.stopping.set()
+            consumer_thread.join()
+            consumer.drain()
+
+        print(f"{args.requests} writes to {args.days} days of {args.users} users, {args.concurrency} workers: "
+              + ", ".join(f"{kind} {status}: {count}" for (kind, status), count in sorted(statuses.items())))
+        # A day that filled up to MAX_EXERCISES rejects appends with a 400
+        unexpected = {key: count for key, count in statuses.items() if key[1] not in (200, 400)}
+        if unexpected:
+            problems.append(f"unexpected statuses {unexpected}")
+        for user in users:
+            problems += check_records(user, "after the concurrent writes")
+            problems += [f"merged alias {alias} of {user} still has a record row"
+                         for alias in MERGE["aliases"] if record_of(user, alias) is not None]
+        _, drift = check_drift(aggregate_app)
+        problems += drift
+
+        if problems:
+            print(f"FAILED: {len(problems)} problems")
+            for problem in problems[:20]:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"records of {len(users) + 1} users match their raw days after re-posts, appends and merges")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Concurrent writes to the same days through lambda_post, checked against moto.
+
+Worker threads re-post, append to and (with a stale expected_version)
+overwrite a handful of hot user/date pairs at once, while lambda_aggregate
+consumes the stream as in bench_load. Afterwards every hot day must be at
+exactly the version its successful writes add up to, i.e. no write was
+lost, record_workout without expected_version must never have been
+turned away, stale expected_version writes must all have been rejected
+with a 409, and the aggregates must match raw_data.
+
+    pip install moto boto3
+    python scripts/bench/bench_same_day.py --days 2 --requests 200 --concurrency 16
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from bench_load import TABLES, StreamConsumer, check_drift, create_tables, instrument, report_emf, scan
+from bench_utils import load_handler, report
+
+USER = "hotday@example.com"
+MIX = {"record_workout": 45, "append_set": 45, "stale_record": 10}
+EXERCISES = ("bench press", "squat", "deadlift", "overhead press")
+
+
+def random_set(rng):
+    return {"name": rng.choice(EXERCISES), "weight": 5 * rng.randint(10, 60), "reps": rng.randint(3, 12)}
+
+
+def build_requests(rng, dates, count):
+    requests = []
+    for _ in range(count):
+        kind = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+        workout_date = rng.choice(dates)
+        body = {"user": USER, "date": workout_date}
+        if kind == "append_set":
+            body.update(action="append_set", set=random_set(rng))
+        else:
+            body["exercises"] = [random_set(rng) for _ in range(rng.randint(3, 10))]
+        if kind == "stale_record":
+            body["expected_version"] = 1
+        requests.append((kind, workout_date, {"body": json.dumps(body)}))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=2, help="hot dates every request writes to")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from moto import mock_aws
+
+    with mock_aws():
+        post_app = load_handler("lambda_post", TABLES)
+        aggregate_app = load_handler("lambda_aggregate", TABLES)
+        stream_arn = create_tables()
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+        calls = {"post": Counter(), "aggregate": Counter()}
+        instrument(post_app.dynamodb_client, calls["post"])
+        instrument(aggregate_app.dynamodb_client, calls["aggregate"])
+
+        rng = random.Random(args.seed)
+        dates = [(date.today() - timedelta(days=i)).isoformat() for i in range(args.days)]
+        # Every day starts at version 2, so expected_version 1 is always stale
+        for workout_date in [*dates, *dates]:
+            body = {"user": USER, "date": workout_date, "exercises": [random_set(rng)]}
+            with contextlib.redirect_stdout(io.StringIO()):
+                assert post_app.lambda_handler({"body": json.dumps(body)}, None)["statusCode"] == 200
+        requests = build_requests(rng, dates, args.requests)
+
+        latencies = defaultdict(list)
+        statuses = defaultdict(Counter)
+        writes = Counter({workout_date: 2 for workout_date in dates})
+        lock = threading.Lock()
+
+        def send(request):
+            kind, workout_date, event = request
+            start = time.perf_counter()
+            response = post_app.lambda_handler(event, None)
+            with lock:
+                latencies[kind].append((time.perf_counter() - start) * 1000)
+                statuses[kind][response["statusCode"]] += 1
+                if response["statusCode"] == 200:
+                    writes[workout_date] += 1
+
+        consumer = StreamConsumer(stream_arn, aggregate_app)
+        consumer_thread = threading.Thread(target=consumer.run, daemon=True)
+        consumer_thread.start()
+
+        emf_output = io.StringIO()
+        with contextlib.redirect_stdout(emf_output):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(send, requests))
+            elapsed = time.perf_counter() - start
+
+            consumer.stopping.set()
+            consumer_thread.join()
+            consumer.drain()
+
+        print(f"{args.requests} writes to {args.days} days, {args.concurrency} workers: {elapsed:.2f} s")
+        for kind in MIX:
+            if latencies[kind]:
+                codes = ", ".join(f"{code}: {count}" for code, count in sorted(statuses[kind].items()))
+                report(kind, latencies[kind])
+                print(f"{'':<40} status {codes}")
+        report_emf(emf_output.getvalue())
+
+        problems = []
+        versions = {day["date"]: int(day.get("version", 0)) for day in scan(TABLES["RAW_DATA_TABLE"])}
+        for workout_date in dates:
+            if versions.get(workout_date) != writes[workout_date]:
+                problems.append(f"{workout_date}: version {versions.get(workout_date)} "
+                                f"after {writes[workout_date]} successful writes")
+        if set(statuses["record_workout"]) - {200}:
+            problems.append(f"record_workout statuses {dict(statuses['record_workout'])}")
+        if statuses["stale_record"][200]:
+            problems.append(f"{statuses['stale_record'][200]} stale expected_version writes succeeded")
+        # A day that filled up to MAX_EXERCISES rejects appends with a 400
+        if set(statuses["append_set"]) - {200, 400}:
+            problems.append(f"append_set statuses {dict(statuses['append_set'])}")
+        users, drift = check_drift(aggregate_app)
+        problems += drift
+
+        if problems:
+            print(f"FAILED: {len(problems)} problems")
+            for problem in problems[:20]:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"no lost writes: {sum(writes.values())} writes, day versions and aggregates match raw_data")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Validation and response serialization, before and after the shared layer.
+
+The "before" path is what lambda_post and lambda_get did inline: re.match
+with the pattern string on every call, json.dumps with a DecimalEncoder
+class, and lambda_get serializing the summary twice to log it. Payloads
+are built the way DynamoDB returns them, with Decimal numbers.
+
+    python scripts/bench/bench_serialization.py --iterations 20000 --exercises 50
+"""
+import argparse
+import json
+import re
+from decimal import Decimal
+
+from bench_utils import load_handler, report, timed
+
+USER = "bench.user+lifts@example.com"
+EMAIL_PATTERN = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return super(DecimalEncoder, self).default(obj)
+
+
+def old_validate_user_email(email):
+    if not email or not isinstance(email, str):
+        raise ValueError("User email is required and must be a string")
+    if not re.match(EMAIL_PATTERN, email):
+        raise ValueError("Invalid email format")
+    if len(email) > 254:
+        raise ValueError("Email address too long")
+    return email.strip().lower()
+
+
+def summary_payload(exercises):
+    exercise_data = {
+        f"exercise {i}": {"total_volume": Decimal(str(1234.5 * i)), "total_reps": Decimal(12 * i)}
+        for i in range(exercises)
+    }
+    return {
+        "user": USER,
+        "exercise_data": exercise_data,
+        "total_lifted": sum(e["total_volume"] for e in exercise_data.values()),
+    }
+
+
+def rollup_payload(exercises, buckets=12):
+    return {
+        "user": USER,
+        "granularity": "month",
+        "rollups": [
+            {
+                "bucket": f"2025-{month:02d}",
+                "total_volume": Decimal(str(98765.25 + month)),
+                "exercise_volumes": {f"exercise {i}": Decimal(str(250.5 * i)) for i in range(exercises)},
+                "exercise_reps": {f"exercise {i}": Decimal(10 * i) for i in range(exercises)},
+            }
+            for month in range(1, buckets + 1)
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--exercises", type=int, default=50)
+    args = parser.parse_args()
+
+    load_handler("lambda_get", {
+        "AGGREGATES_TABLE": "bench_aggregated", "RAW_DATA_TABLE": "bench_raw_data", "ROLLUPS_TABLE": "bench_rollups",
+        "ALIASES_TABLE": "bench_aliases",
+    })
+    import fitness_common
+
+    summary = summary_payload(args.exercises)
+    rollups = rollup_payload(args.exercises)
+    for payload in (summary, rollups):
+        assert fitness_common.dumps(payload) == json.dumps(payload, cls=DecimalEncoder)
+    assert fitness_common.validate_user_email(USER) == old_validate_user_email(USER)
+
+    def old_summary():
+        json.dumps(summary, cls=DecimalEncoder)  # the log line
+        json.dumps(summary, cls=DecimalEncoder)
+
+    serialize_iterations = max(1, args.iterations // 10)
+    scenarios = [
+        ("validate_user_email, re.match", lambda: old_validate_user_email(USER), args.iterations),
+        ("validate_user_email, compiled", lambda: fitness_common.validate_user_email(USER), args.iterations),
+        ("summary, DecimalEncoder x2", old_summary, serialize_iterations),
+        ("summary, DecimalEncoder", lambda: json.dumps(summary, cls=DecimalEncoder), serialize_iterations),
+        ("summary, fitness_common.dumps", lambda: fitness_common.dumps(summary), serialize_iterations),
+        ("range, DecimalEncoder", lambda: json.dumps(rollups, cls=DecimalEncoder), serialize_iterations),
+        ("range, fitness_common.dumps", lambda: fitness_common.dumps(rollups), serialize_iterations),
+    ]
+
+    print(f"{args.exercises} exercises; summary {len(fitness_common.dumps(summary))} bytes, "
+          f"12-month range {len(fitness_common.dumps(rollups))} bytes")
+    for label, func, iterations in scenarios:
+        report(label, timed(func, iterations))
+
+
+if __name__ == "__main__":
+    main()
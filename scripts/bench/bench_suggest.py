@@ -0,0 +1,220 @@
+"""
+Exercise-name typeahead: top-k latency of fitness_suggest's index, and lambda_get's suggest mode against moto.
+
+The index is built for --names distinct exercise names with skewed use,
+and every prefix a user would type on the way to a name is looked up. The
+p99 has to stay under a millisecond. Building it and applying a changed
+row are timed too, next to filtering and sorting every name per keystroke,
+which is what a client does with the full aggregates payload.
+
+Then the suggest mode runs through moto: names are imported through
+lambda_post and aggregated from the stream. The warm index has to answer
+like one built from scratch after new names are posted and after a merge,
+and a keystroke with nothing new has to cost one GetItem.
+
+    pip install moto boto3
+    python scripts/bench/bench_suggest.py --names 1000 2000
+"""
+import argparse
+import itertools
+import json
+import logging
+import random
+import time
+from datetime import date, timedelta
+
+from bench_load import TABLES, StreamConsumer, create_tables, scan
+from bench_utils import load_handler, quiet
+
+USER = "suggest@example.com"
+MODIFIERS = ("", "incline", "decline", "seated", "standing", "single arm", "close grip", "wide grip", "paused",
+             "tempo", "deficit", "reverse grip", "kneeling", "lying", "half kneeling", "chest supported")
+EQUIPMENT = ("barbell", "dumbbell", "cable", "machine", "smith", "kettlebell", "band", "landmine", "ez bar")
+MOVEMENTS = ("bench press", "row", "curl", "squat", "deadlift", "overhead press", "lunge", "fly", "pulldown",
+             "extension", "raise", "shrug", "hip thrust", "good morning", "pullover", "split squat", "calf raise")
+
+
+def exercise_names(count, rng):
+    names = [" ".join(filter(None, parts)) for parts in itertools.product(MODIFIERS, EQUIPMENT, MOVEMENTS)]
+    assert count <= len(names), f"at most {len(names)} names"
+    return rng.sample(names, count)
+
+
+def aggregate_rows(names, rng):
+    """Rows as lambda_get reads them: a few names used a lot, most rarely, last changed over the past 90 days"""
+    now = int(time.time() * 1000)
+    return [
+        {"exercise_name": name, "total_reps": int(rng.paretovariate(1.2) * 20),
+         "change_seq": now - rng.randrange(90 * 24 * 3600 * 1000)}
+        for name in names
+    ]
+
+
+def keystrokes(names, rng, count):
+    """Prefixes typed on the way to random names, the empty one included"""
+    prefixes = []
+    while len(prefixes) < count:
+        name = rng.choice(names)
+        prefixes.extend(name[:length] for length in range(len(name) + 1))
+    return prefixes[:count]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {p: samples[min(len(samples) - 1, int(len(samples) * p / 100))] for p in (50, 99)} | {100: samples[-1]}
+
+
+def bench_index(count, rng, lookups, k):
+    from fitness_common import normalize_exercise_name
+    from fitness_suggest import ExerciseIndex, word_starts
+
+    names = exercise_names(count, rng)
+    rows = aggregate_rows(names, rng)
+    start = time.perf_counter()
+    index = ExerciseIndex(rows)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    index.ranked()
+    rank = time.perf_counter() - start
+
+    prefixes = keystrokes(names, rng, lookups)
+    top, scan_all = [], []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        suggestions = index.top(prefix, k)
+        top.append(time.perf_counter() - start)
+
+        # Every name filtered and sorted per keystroke, as a client does today
+        start = time.perf_counter()
+        typed = normalize_exercise_name(prefix)
+        matches = [name for name in index.usage if any(word.startswith(typed) for word in word_starts(name))]
+        expected = sorted(matches, key=index.rank_key)[:k]
+        scan_all.append(time.perf_counter() - start)
+        assert suggestions == expected, (prefix, suggestions, expected)
+
+    # Each changed row costs little, but the next short prefix ranks every name again
+    updates = []
+    for row in rng.sample(rows, min(len(rows), 500)):
+        changed = dict(row, total_reps=row["total_reps"] + 10, change_seq=index.latest + 1)
+        start = time.perf_counter()
+        index.update(changed)
+        updates.append(time.perf_counter() - start)
+
+    top, scan_all = percentiles(top), percentiles(scan_all)
+    print(f"{count} names, {len(index.prefixes)} prefixes: built in {build * 1000:.1f} ms, ranked in "
+          f"{rank * 1000:.1f} ms, applying a changed row {percentiles(updates)[50] * 1e6:.1f} us")
+    print(f"  top {k} of {len(prefixes)} keystrokes: p50 {top[50] * 1e6:.0f} us, p99 {top[99] * 1e6:.0f} us, "
+          f"max {top[100] * 1e6:.0f} us; filtering and sorting every name: p50 {scan_all[50] * 1e6:.0f} us, "
+          f"p99 {scan_all[99] * 1e6:.0f} us")
+    assert top[99] < 0.001, f"p99 of {top[99] * 1000:.2f} ms with {count} names"
+
+
+def suggest(get_app, k=8, prefix=""):
+    event = {"headers": {"x-user-email": USER},
+             "body": json.dumps({"user": USER, "mode": "suggest", "prefix": prefix, "limit": k})}
+    with quiet():
+        response = get_app.lambda_handler(event, None)
+    assert response["statusCode"] == 200, response
+    return json.loads(response["body"])["suggestions"]
+
+
+def post(post_app, body):
+    with quiet():
+        response = post_app.lambda_handler({"body": json.dumps(body)}, None)
+    assert response["statusCode"] == 200, response
+
+
+def check_fresh(get_app, prefixes, label):
+    """The warm index answers like one built from every row and alias now"""
+    from fitness_suggest import ExerciseIndex
+
+    rows = get_app.exercise_rows(item for item in scan(TABLES["AGGREGATES_TABLE"]) if item["user"] == USER)
+    aliases = {item["alias"]: item["canonical"] for item in scan(TABLES["ALIASES_TABLE"]) if item["user"] == USER}
+    fresh = ExerciseIndex(rows, aliases)
+    warm = get_app._suggest_cache[USER][-1]
+    assert len(warm) == len(fresh), f"{label}: {len(warm)} names, expected {len(fresh)}"
+    for prefix in prefixes:
+        assert suggest(get_app, prefix=prefix) == fresh.top(prefix, 8), f"{label}: {prefix!r}"
+
+
+def bench_handler(count, rng):
+    from moto import mock_aws
+
+    with mock_aws():
+        post_app = load_handler("lambda_post", TABLES)
+        aggregate_app = load_handler("lambda_aggregate", TABLES)
+        get_app = load_handler("lambda_get", TABLES)
+        consumer = StreamConsumer(create_tables(), aggregate_app)
+        logging.getLogger().setLevel(logging.CRITICAL)
+        get_app.SETTLE_SECONDS = 0
+        calls = []
+        make_api_call = get_app.dynamodb_client.client._make_api_call
+
+        def counted(operation_name, params):
+            calls.append(operation_name)
+            return make_api_call(operation_name, params)
+
+        get_app.dynamodb_client.client._make_api_call = counted
+
+        names = exercise_names(count, rng)
+        today = date.today()
+        days = [
+            {"date": (today - timedelta(days=offset)).isoformat(),
+             "exercises": [{"name": name, "weight": 100, "reps": rng.randint(1, 12)} for name in chunk]}
+            for offset, chunk in enumerate(names[i:i + 50] for i in range(0, len(names), 50))
+        ]
+        post(post_app, {"action": "import_days", "user": USER, "days": days})
+        with quiet():
+            consumer.drain()
+        prefixes = keystrokes(names, rng, 200)
+
+        calls.clear()
+        start = time.perf_counter()
+        suggest(get_app)
+        print(f"suggest mode, {count} names through moto: first request builds the index in "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms with {len(calls)} DynamoDB calls")
+        check_fresh(get_app, prefixes, "built")
+
+        calls.clear()
+        suggest(get_app, prefix="inc")
+        assert calls == ["GetItem"], f"a warm keystroke made {calls}"
+
+        # New names and more use of old ones reach the warm index as changed rows
+        new_names = ["zercher squat", "jefferson curl"]
+        post(post_app, {"user": USER, "date": today.isoformat(), "exercises": [
+            {"name": name, "weight": 100, "reps": 50} for name in new_names + names[:3]
+        ]})
+        with quiet():
+            consumer.drain()
+        calls.clear()
+        assert suggest(get_app, prefix="zer")[0] == "zercher squat"
+        print(f"after a post: {len(calls)} DynamoDB calls to apply the changed rows")
+        check_fresh(get_app, prefixes + ["zer", "jeff", "curl"], "after a post")
+
+        # A merge removes names, so the index is built again with the alias leading to the canonical name
+        post(post_app, {"action": "merge_exercises", "user": USER, "canonical": names[0], "aliases": ["jefferson curl"]})
+        with quiet():
+            consumer.drain()
+        assert names[0] in suggest(get_app, prefix="jeff")
+        check_fresh(get_app, prefixes + ["jeff"], "after a merge")
+        print("warm index matches one built from scratch after posts and a merge; a keystroke costs one GetItem")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--names", type=int, nargs="+", default=[1000, 2000])
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--handler-names", type=int, default=300, help="names imported for the moto run")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    load_handler("lambda_get", TABLES)
+    for count in args.names:
+        bench_index(count, rng, args.lookups, args.limit)
+    bench_handler(args.handler_names, rng)
+
+
+if __name__ == "__main__":
+    main()
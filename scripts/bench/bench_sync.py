@@ -0,0 +1,263 @@
+"""
+lambda_get's sync mode against moto: a client replica converges, and an
+incremental sync costs the same however long the history is.
+
+For each --history length a user imports that many days through lambda_post
+and the stream is fed to lambda_aggregate. A client replica is built with a
+full sync; the settle window is checked; then random record_workout,
+append_set and merge_exercises requests are made, every few of them
+followed by draining the stream and an incremental sync, after which the
+replica must equal the user's raw days and aggregate rows. Run with a small
+SYNC_MAX_ITEMS to make those syncs span several pages.
+
+Finally one more set is appended per user, and the sync that picks it up is
+compared across history lengths with a full sync and the summary mode: its
+DynamoDB calls, items read and response size should not grow with the
+history.
+
+    pip install moto boto3
+    python scripts/bench/bench_sync.py --history 30 360 --writes 40
+    SYNC_MAX_ITEMS=3 python scripts/bench/bench_sync.py --history 30
+"""
+import argparse
+import base64
+import gzip
+import json
+import logging
+import random
+import sys
+from collections import Counter
+from datetime import date, timedelta
+
+from bench_load import TABLES, StreamConsumer, create_tables, scan
+from bench_utils import load_handler, quiet
+
+EXERCISES = ("bench press", "squat", "deadlift", "overhead press", "barbell row", "db bench", "dumbbell bench")
+
+
+def random_set(rng):
+    return {"name": rng.choice(EXERCISES), "weight": 5 * rng.randint(10, 60), "reps": rng.randint(3, 12)}
+
+
+class Reads:
+    """DynamoDB calls a handler makes and the items they return"""
+
+    def __init__(self, dynamodb_client):
+        self.calls = 0
+        self.items = 0
+        client = dynamodb_client.client
+        make_api_call = client._make_api_call
+
+        def counted(operation_name, params):
+            response = make_api_call(operation_name, params)
+            self.calls += 1
+            self.items += response.get("Count", 1 if "Item" in response else 0)
+            return response
+
+        client._make_api_call = counted
+
+    def reset(self):
+        self.calls = self.items = 0
+
+
+def call(app, event):
+    with quiet():
+        response = app.lambda_handler(event, None)
+    assert response["statusCode"] == 200, response
+    return response
+
+
+def post(post_app, body):
+    return call(post_app, {"body": json.dumps(body)})
+
+
+def sync_once(get_app, user, cursor, accept_gzip=False):
+    """One sync call: (payload, bytes on the wire)"""
+    body = {"user": user, "mode": "sync"}
+    if cursor is not None:
+        body["cursor"] = cursor
+    headers = {"x-user-email": user}
+    if accept_gzip:
+        headers["Accept-Encoding"] = "gzip, deflate"
+    response = call(get_app, {"headers": headers, "body": json.dumps(body)})
+    if response.get("isBase64Encoded"):
+        raw = base64.b64decode(response["body"])
+        return json.loads(gzip.decompress(raw)), len(raw)
+    return json.loads(response["body"]), len(response["body"])
+
+
+def sync(get_app, user, replica, accept_gzip=False):
+    """Bring the replica up to date the way an app would; returns bytes received"""
+    received = 0
+    while True:
+        payload, size = sync_once(get_app, user, replica["cursor"], accept_gzip)
+        received += size
+        if payload.get("full"):
+            replica["days"].clear()
+        if payload.get("reset"):
+            replica["aggregates"].clear()
+        replica["aggregates"].update((row["exercise_name"], row) for row in payload.get("aggregates", []))
+        replica["days"].update((day["date"], day) for day in payload.get("days", []))
+        replica["cursor"] = payload["cursor"]
+        if not payload.get("more"):
+            return received
+
+
+def new_replica():
+    return {"cursor": None, "aggregates": {}, "days": {}}
+
+
+def server_state(get_app, user):
+    """What a converged replica must hold, as it would arrive in JSON"""
+    aggregates = {
+        item["exercise_name"]: {a: item[a] for a in get_app.SYNC_AGGREGATE_ATTRIBUTES if a in item}
+        for item in scan(TABLES["AGGREGATES_TABLE"]) if item["user"] == user and get_app.synced_row(item)
+    }
+    days = {
+        item["date"]: {a: item[a] for a in get_app.SYNC_DAY_ATTRIBUTES if a in item}
+        for item in scan(TABLES["RAW_DATA_TABLE"]) if item["user"] == user
+    }
+    return json.loads(get_app.dumps({"aggregates": aggregates, "days": days}))
+
+
+def check(get_app, user, replica, label):
+    expected = server_state(get_app, user)
+    for kind in ("aggregates", "days"):
+        if replica[kind] != expected[kind]:
+            keys = sorted(set(replica[kind]) ^ set(expected[kind]))[:3] or [
+                key for key in expected[kind] if replica[kind].get(key) != expected[kind][key]
+            ][:3]
+            print(f"FAILED ({label}): {user} replica {kind} differ at {keys}")
+            sys.exit(1)
+
+
+def check_etag(get_app, user, label):
+    """Polling the summary with the ETag it returned answers 304; merges bump the version only once"""
+    event = {"headers": {"x-user-email": user}, "body": json.dumps({"user": user})}
+    etag = call(get_app, event)["headers"]["ETag"]
+    with quiet():
+        response = get_app.lambda_handler(dict(event, headers={"x-user-email": user, "if-none-match": etag}), None)
+    versions = {item["exercise_name"]: item["version"] for item in scan(TABLES["AGGREGATES_TABLE"])
+                if item["user"] == user and item["exercise_name"] in ("#version", "total_lifted")}
+    if response["statusCode"] != 304 or len(set(versions.values())) != 1:
+        print(f"FAILED ({label}): {user} polled with {etag} got {response['statusCode']}, versions {versions}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--history", type=int, nargs="+", default=[30, 360], help="days of history per user")
+    parser.add_argument("--writes", type=int, default=40, help="random writes per user after the full sync")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from moto import mock_aws
+
+    with mock_aws():
+        post_app = load_handler("lambda_post", TABLES)
+        aggregate_app = load_handler("lambda_aggregate", TABLES)
+        get_app = load_handler("lambda_get", TABLES)
+        consumer = StreamConsumer(create_tables(), aggregate_app)
+        logging.getLogger().setLevel(logging.CRITICAL)
+        reads = Reads(get_app.dynamodb_client)
+        rng = random.Random(args.seed)
+        today = date.today()
+        settle_seconds = get_app.SETTLE_SECONDS
+        costs = {}
+
+        for history in args.history:
+            user = f"sync{history}@example.com"
+            days = [
+                {"date": (today - timedelta(days=offset)).isoformat(),
+                 "exercises": [random_set(rng) for _ in range(rng.randint(5, 15))]}
+                for offset in range(history)
+            ]
+            post(post_app, {"action": "import_days", "user": user, "days": days})
+            with quiet():
+                consumer.drain()
+
+            # Everything was just written, so the cursor of the first full sync stops short of it
+            # and the next sync sends it again
+            get_app.SETTLE_SECONDS = settle_seconds
+            replica = new_replica()
+            sync(get_app, user, replica)
+            payload, _ = sync_once(get_app, user, replica["cursor"])
+            assert payload["days"] and not payload["more"]
+            get_app.SETTLE_SECONDS = 0
+            sync(get_app, user, replica)
+            assert replica["cursor"] is not None
+            check(get_app, user, replica, "full sync")
+
+            # A fresh change is sent again until it settles; then the cursor moves past it
+            get_app.SETTLE_SECONDS = settle_seconds
+            cursor = replica["cursor"]
+            post(post_app, {"action": "append_set", "user": user, "date": today.isoformat(), "set": random_set(rng)})
+            for _ in range(2):
+                payload, _ = sync_once(get_app, user, cursor)
+                assert [day["date"] for day in payload["days"]] == [today.isoformat()]
+                cursor = payload["cursor"]
+            get_app.SETTLE_SECONDS = 0
+            with quiet():
+                consumer.drain()
+            sync(get_app, user, replica)
+            assert replica["cursor"] > cursor
+            reads.reset()
+            payload, _ = sync_once(get_app, user, replica["cursor"])
+            assert reads.calls == 3 and not payload["days"] and not payload["aggregates"], \
+                "a sync with nothing new should be one GetItem and two empty Queries"
+            check(get_app, user, replica, "after settling")
+
+            kinds = Counter()
+            merge_at = args.writes // 2
+            for write in range(args.writes):
+                if write == merge_at:
+                    kind = "merge_exercises"
+                    post(post_app, {"action": kind, "user": user, "canonical": "bench press",
+                                    "aliases": ["db bench", "dumbbell bench"]})
+                elif rng.random() < 0.5:
+                    kind = "append_set"
+                    workout_date = (today - timedelta(days=rng.randrange(min(history, 30)))).isoformat()
+                    post(post_app, {"action": kind, "user": user, "date": workout_date, "set": random_set(rng)})
+                else:
+                    kind = "record_workout"
+                    workout_date = (today - timedelta(days=rng.randrange(min(history, 30)))).isoformat()
+                    post(post_app, {"user": user, "date": workout_date,
+                                    "exercises": [random_set(rng) for _ in range(rng.randint(3, 10))]})
+                kinds[kind] += 1
+                # Some syncs pick up several writes, which makes them span pages
+                if rng.random() < 0.4 or write == args.writes - 1:
+                    with quiet():
+                        consumer.drain()
+                    sync(get_app, user, replica)
+                    check(get_app, user, replica, f"after {kind}")
+            check_etag(get_app, user, "after the writes and a merge")
+            print(f"{history} days: replica matches after a full sync and "
+                  + ", ".join(f"{count} {kind}" for kind, count in sorted(kinds.items())))
+
+            post(post_app, {"action": "append_set", "user": user, "date": today.isoformat(), "set": random_set(rng)})
+            with quiet():
+                consumer.drain()
+            row = {}
+            for label, func in (
+                ("sync after one set", lambda: sync(get_app, user, replica)),
+                ("full sync", lambda: sync(get_app, user, new_replica())),
+                ("full sync, gzip", lambda: sync(get_app, user, new_replica(), accept_gzip=True)),
+                ("summary mode", lambda: len(call(get_app, {
+                    "headers": {"x-user-email": user}, "body": json.dumps({"user": user})})["body"])),
+            ):
+                reads.reset()
+                size = func()
+                row[label] = (reads.calls, reads.items, size)
+            check(get_app, user, replica, "final set")
+            costs[history] = row
+
+        print(f"\n{'':<24}" + "".join(f"{f'{history} days: calls/items/bytes':>34}" for history in costs))
+        for label in next(iter(costs.values())):
+            print(f"{label:<24}" + "".join(f"{'%d / %d / %d' % costs[history][label]:>34}" for history in costs))
+        incremental = {costs[history]["sync after one set"][:2] for history in costs}
+        assert len(incremental) == 1, f"incremental sync cost grew with the history: {incremental}"
+        print("incremental sync reads the same however long the history is")
+
+
+if __name__ == "__main__":
+    main()
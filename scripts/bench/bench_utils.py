@@ -0,0 +1,70 @@
+"""Helpers shared by the local handler benchmarks"""
+import contextlib
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+TERRAFORM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "terraform"))
+# Lambda puts a layer's python/ directory on sys.path; the bench imports the sources
+LAYER_DIRS = [os.path.join(TERRAFORM_DIR, "layer_common")]
+
+
+def load_handler(name, env=None):
+    """
+    Import terraform/<name>/app.py as a fresh module.
+
+    Every handler is called app.py, so each one gets its own module name
+    instead of going through sys.path. The shared layers are importable
+    the way they are in Lambda.
+    """
+    for layer_dir in LAYER_DIRS:
+        if layer_dir not in sys.path:
+            sys.path.insert(0, layer_dir)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    for key, value in (env or {}).items():
+        os.environ[key] = value
+
+    path = os.path.join(TERRAFORM_DIR, name, "app.py")
+    module_name = f"{name}_app"
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard the EMF metric lines the handlers print to stdout"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def timed(func, iterations):
+    """Call func repeatedly and return the per-call latencies in milliseconds"""
+    samples = []
+    with quiet():
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    print(
+        f"{label:<40} n={len(samples):<6} "
+        f"p50={percentile(samples, 50):8.3f} ms  "
+        f"p99={percentile(samples, 99):8.3f} ms  "
+        f"mean={statistics.fmean(samples):8.3f} ms"
+    )
@@ -0,0 +1,151 @@
+"""
+Pack the sets of raw_data days still kept in the raw_exercises list into raw_sets.
+
+lambda_post writes whole days with their sets packed (fitness_sets) and
+only appends to the raw_exercises list. Days written before that, and sets
+appended since, stay in the list until the day is written whole again,
+which a day that is only read or appended to never is. This script finds
+every day with a non-empty raw_exercises list with a parallel segmented
+Scan, and rewrites its sets, packed and appended alike, into raw_sets.
+
+Each day is rewritten with a conditional UpdateItem that only touches
+raw_sets, raw_exercises and append_limit, and only if the day is still at
+the version and the number of appended sets that were read. A day
+lambda_post writes or appends to in the meantime is left as it is, and
+picked up by the next run. A day whose sets raw_sets can't hold exactly
+(a fractional rep count, an attribute besides name, weight and reps) is
+left in the list. The script only picks up days that still need packing,
+so an interrupted run is resumed by running it again. The day's version
+is not bumped and its totals don't change, so lambda_aggregate sees the
+updates as MODIFY records that change no totals or records.
+
+    python scripts/migrate_compact_sets.py --environment prod_2025_fitness --dry-run
+    python scripts/migrate_compact_sets.py --environment prod_2025_fitness --max-write-units 50
+"""
+import argparse
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "terraform", "layer_common"))
+
+from fitness_common import MAX_EXERCISES  # noqa: E402
+from fitness_data import DynamoDBClient  # noqa: E402
+from fitness_sets import decode_sets, day_sets, encode_sets  # noqa: E402
+from rebuild_aggregates import CapacityLimiter  # noqa: E402
+
+
+def pack_day(day):
+    """The day's sets as raw_sets bytes, or None if they don't come back out exactly"""
+    sets = list(day_sets(day))
+    try:
+        packed = encode_sets(sets)
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        return None
+    return packed if decode_sets(packed) == sets else None
+
+
+class Migration:
+    def __init__(self, args):
+        self.args = args
+        self.dynamodb_client = DynamoDBClient()
+        self.raw_data_table = self.dynamodb_client.Table(args.raw_table)
+        self.reads = CapacityLimiter(args.max_read_units)
+        self.writes = CapacityLimiter(args.max_write_units)
+        self.lock = threading.Lock()
+        self.found = 0
+        self.packed = 0
+        self.skipped = 0
+        self.kept = 0
+
+    def pack(self, day, packed):
+        """Returns False if the day changed since it was read"""
+        values = {
+            ":packed": packed,
+            ":empty": [],
+            ":limit": max(MAX_EXERCISES - len(day_sets(day)), 0),
+            ":appended": len(day["raw_exercises"]),
+        }
+        condition = "size(raw_exercises) = :appended"
+        if "version" in day:
+            condition += " AND version = :version"
+            values[":version"] = day["version"]
+        else:
+            condition += " AND attribute_not_exists(version)"
+
+        self.writes.wait()
+        try:
+            response = self.raw_data_table.update_item(
+                Key={"user": day["user"], "date": day["date"]},
+                UpdateExpression="SET raw_sets = :packed, raw_exercises = :empty, append_limit = :limit",
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return False
+        self.writes.consumed(response.get("ConsumedCapacity"))
+        return True
+
+    def migrate_segment(self, index):
+        params = {
+            "Segment": index,
+            "TotalSegments": self.args.segments,
+            "FilterExpression": "size(raw_exercises) > :zero",
+            "ProjectionExpression": "#user, #date, raw_exercises, raw_sets, version",
+            "ExpressionAttributeNames": {"#user": "user", "#date": "date"},
+            "ExpressionAttributeValues": {":zero": 0},
+            "Limit": self.args.page_size,
+        }
+        while True:
+            self.reads.wait()
+            response = self.raw_data_table.scan(**params)
+            self.reads.consumed(response.get("ConsumedCapacity"))
+            days = response.get("Items", [])
+            packed = kept = 0
+            for day in days:
+                packed_sets = pack_day(day)
+                if packed_sets is None:
+                    kept += 1
+                elif not self.args.dry_run:
+                    packed += self.pack(day, packed_sets)
+            with self.lock:
+                self.found += len(days)
+                self.kept += kept
+                self.packed += packed
+                self.skipped += 0 if self.args.dry_run else len(days) - kept - packed
+            if "LastEvaluatedKey" not in response:
+                return
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.args.segments) as executor:
+            list(executor.map(self.migrate_segment, range(self.args.segments)))
+        if self.args.dry_run:
+            print(f"{self.found} days with sets in raw_exercises, {self.kept} of them can't be packed exactly")
+        else:
+            print(f"{self.found} days found, {self.packed} packed, {self.skipped} changed by lambda_post "
+                  f"during the run, {self.kept} can't be packed exactly")
+        print(f"consumed {self.reads.total:.1f} read and {self.writes.total:.1f} write capacity units")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--environment", help="terraform environment; sets the table name")
+    parser.add_argument("--raw-table", default=os.environ.get("RAW_DATA_TABLE"))
+    parser.add_argument("--dry-run", action="store_true", help="count the days to pack without writing")
+    parser.add_argument("--segments", type=int, default=4, help="parallel Scan segments, one thread each")
+    parser.add_argument("--page-size", type=int, default=100, help="items per Scan page")
+    parser.add_argument("--max-read-units", type=float, default=100, help="read capacity per second; 0 = unlimited")
+    parser.add_argument("--max-write-units", type=float, default=25, help="write capacity per second; 0 = unlimited")
+    args = parser.parse_args()
+
+    if args.environment:
+        args.raw_table = args.raw_table or f"{args.environment}_raw_data"
+    if not args.raw_table:
+        parser.error("pass --environment or --raw-table")
+    Migration(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Move raw_data days from the single "DAILY_SUMMARY" index partition to their shard.
+
+lambda_post writes new days with exercise = "DAILY_SUMMARY#<shard>"
+(fitness_common.daily_summary_key). Days written before that still sit under
+one exercise-date-index key. This script finds them with a parallel segmented
+Scan and moves them page by page.
+
+Each day is moved with a conditional UpdateItem that only rewrites
+`exercise`, and only if it still holds the legacy value. A day lambda_post
+rewrites in the meantime is left as it is. BatchWriteItem would have to
+put back whole items, unconditionally, and could undo such a write.
+The script only picks up days that still need moving, so an interrupted run
+is resumed by running it again. The day's version is not bumped.
+lambda_aggregate sees the updates as MODIFY records that change no totals.
+
+    python scripts/migrate_gsi_shards.py --environment prod_2025_fitness --dry-run
+    python scripts/migrate_gsi_shards.py --environment prod_2025_fitness --max-write-units 50
+"""
+import argparse
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "terraform", "layer_common"))
+
+from fitness_common import DAILY_SUMMARY, daily_summary_key  # noqa: E402
+from fitness_data import DynamoDBClient  # noqa: E402
+from rebuild_aggregates import CapacityLimiter  # noqa: E402
+
+
+class Migration:
+    def __init__(self, args):
+        self.args = args
+        self.dynamodb_client = DynamoDBClient()
+        self.raw_data_table = self.dynamodb_client.Table(args.raw_table)
+        self.reads = CapacityLimiter(args.max_read_units)
+        self.writes = CapacityLimiter(args.max_write_units)
+        self.lock = threading.Lock()
+        self.found = 0
+        self.moved = 0
+        self.skipped = 0
+
+    def move_day(self, user, date):
+        """Returns False if the day no longer holds the legacy key"""
+        self.writes.wait()
+        try:
+            response = self.raw_data_table.update_item(
+                Key={"user": user, "date": date},
+                UpdateExpression="SET #exercise = :shard",
+                ConditionExpression="#exercise = :legacy",
+                ExpressionAttributeNames={"#exercise": "exercise"},
+                ExpressionAttributeValues={":shard": daily_summary_key(user, date), ":legacy": DAILY_SUMMARY},
+            )
+        except self.dynamodb_client.exceptions.ConditionalCheckFailedException:
+            return False
+        self.writes.consumed(response.get("ConsumedCapacity"))
+        return True
+
+    def migrate_segment(self, index):
+        params = {
+            "Segment": index,
+            "TotalSegments": self.args.segments,
+            "FilterExpression": "#exercise = :legacy",
+            "ProjectionExpression": "#user, #date",
+            "ExpressionAttributeNames": {"#exercise": "exercise", "#user": "user", "#date": "date"},
+            "ExpressionAttributeValues": {":legacy": DAILY_SUMMARY},
+            "Limit": self.args.page_size,
+        }
+        while True:
+            self.reads.wait()
+            response = self.raw_data_table.scan(**params)
+            self.reads.consumed(response.get("ConsumedCapacity"))
+            days = response.get("Items", [])
+            moved = 0 if self.args.dry_run else sum(self.move_day(day["user"], day["date"]) for day in days)
+            with self.lock:
+                self.found += len(days)
+                self.moved += moved
+                self.skipped += 0 if self.args.dry_run else len(days) - moved
+            if "LastEvaluatedKey" not in response:
+                return
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.args.segments) as executor:
+            list(executor.map(self.migrate_segment, range(self.args.segments)))
+        if self.args.dry_run:
+            print(f"{self.found} days still under {DAILY_SUMMARY}")
+        else:
+            print(f"{self.found} days found, {self.moved} moved, {self.skipped} already rewritten by lambda_post")
+        print(f"consumed {self.reads.total:.1f} read and {self.writes.total:.1f} write capacity units")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--environment", help="terraform environment; sets the table name")
+    parser.add_argument("--raw-table", default=os.environ.get("RAW_DATA_TABLE"))
+    parser.add_argument("--dry-run", action="store_true", help="count the days to move without writing")
+    parser.add_argument("--segments", type=int, default=4, help="parallel Scan segments, one thread each")
+    parser.add_argument("--page-size", type=int, default=100, help="items per Scan page")
+    parser.add_argument("--max-read-units", type=float, default=100, help="read capacity per second; 0 = unlimited")
+    parser.add_argument("--max-write-units", type=float, default=25, help="write capacity per second; 0 = unlimited")
+    args = parser.parse_args()
+
+    if args.environment:
+        args.raw_table = args.raw_table or f"{args.environment}_raw_data"
+    if not args.raw_table:
+        parser.error("pass --environment or --raw-table")
+    Migration(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Recompute the aggregates table from raw_data and repair the rows that drifted.
+
+Users are found with a parallel segmented Scan of raw_data. Each user's days
+are then read with a consistent Query, mapped through their aliases the way
+lambda_aggregate maps them, and compared with their per-exercise rows and
+total_lifted. Only rows that differ are written.
+
+lambda_aggregate keeps writing while this runs, so a difference is only
+repaired if it is still there, unchanged, after --settle seconds. That rules
+out stream records that were merely in flight. The repair is one transaction
+per user, and it only succeeds if the summary row's version hasn't moved
+since the aggregates were read. Like lambda_aggregate, it bumps that version
+and the #version row by one each, which invalidates lambda_get's ETags. The
+exercise_data summary is rewritten along with it, and the same #version
+update stamps reset_sequence, which tells clients of lambda_get's sync mode
+to fetch the user's aggregate rows again. A user who keeps changing is
+retried, and reported as busy if they never settle. Rollups are not checked.
+
+Run it while lambda_aggregate keeps up with the stream (IteratorAge near
+zero): a record stuck in a failing batch for longer than --settle would be
+counted twice, once by the repair and once when it is finally applied.
+
+    python scripts/rebuild_aggregates.py --environment prod_2025_fitness --dry-run
+    python scripts/rebuild_aggregates.py --environment prod_2025_fitness \\
+        --checkpoint rebuild.json --max-read-units 200 --max-write-units 50
+    python scripts/rebuild_aggregates.py --environment prod_2025_fitness --user someone@example.com
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "terraform", "layer_common"))
+
+from fitness_data import DynamoDBClient  # noqa: E402
+from fitness_sync import change_sequence  # noqa: E402
+
+# Aggregate rows lambda_aggregate maintains besides the per-exercise ones
+SUMMARY_ROW = "total_lifted"
+VERSION_ROW = "#version"
+# DynamoDB limit on actions in a single TransactWriteItems call
+TRANSACT_MAX_ITEMS = 100
+ZERO = Decimal("0")
+
+
+class CapacityLimiter:
+    """Spaces out requests so the capacity they consume averages at most rate units per second"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+        self.total = 0.0
+
+    def wait(self):
+        if not self.rate:
+            return
+        with self.lock:
+            delay = self.next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def consumed(self, consumed_capacity):
+        if isinstance(consumed_capacity, dict):
+            consumed_capacity = [consumed_capacity]
+        units = sum(entry.get("CapacityUnits", 0) for entry in consumed_capacity or [])
+        with self.lock:
+            self.total += units
+            if self.rate:
+                self.next_time = max(self.next_time, time.monotonic()) + units / self.rate
+
+
+class Checkpoint:
+    """Scan progress and finished users, saved to a JSON file so a run can resume"""
+
+    def __init__(self, path, raw_table, segments):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {"raw_table": raw_table, "segments": {}, "users": [], "done": {}}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+            if self.state["raw_table"] != raw_table:
+                raise SystemExit(f"{path} is a checkpoint for {self.state['raw_table']}, not {raw_table}")
+            if self.state["segments"] and len(self.state["segments"]) != segments:
+                raise SystemExit(f"{path} was scanned with {len(self.state['segments'])} segments")
+
+    def save(self):
+        if not self.path:
+            return
+        # Write and rename, so an interrupted run never leaves half a file
+        with self.lock:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.state, f, default=str)
+            os.replace(self.path + ".tmp", self.path)
+
+    def segment(self, index):
+        with self.lock:
+            return self.state["segments"].setdefault(str(index), {"users": [], "last_key": None, "done": False})
+
+    def update_segment(self, index, users, last_key):
+        with self.lock:
+            segment = self.state["segments"][str(index)]
+            segment["users"] = sorted(set(segment["users"]) | users)
+            segment["last_key"] = last_key
+            segment["done"] = last_key is None
+
+    def finish_user(self, user, outcome):
+        with self.lock:
+            self.state["done"][user] = outcome
+
+
+class Rebuilder:
+    def __init__(self, args):
+        self.args = args
+        self.dynamodb_client = DynamoDBClient()
+        self.raw_data_table = self.dynamodb_client.Table(args.raw_table)
+        self.aggregates_table = self.dynamodb_client.Table(args.aggregates_table)
+        self.aliases_table = self.dynamodb_client.Table(args.aliases_table)
+        self.reads = CapacityLimiter(args.max_read_units)
+        self.writes = CapacityLimiter(args.max_write_units)
+        self.print_lock = threading.Lock()
+
+    def read(self, operation, **params):
+        self.reads.wait()
+        response = operation(**params)
+        self.reads.consumed(response.get("ConsumedCapacity"))
+        return response
+
+    def query_all(self, table, user, **params):
+        params.update(
+            KeyConditionExpression="#user = :user",
+            ExpressionAttributeNames=dict(params.get("ExpressionAttributeNames", {}), **{"#user": "user"}),
+            ExpressionAttributeValues={":user": user},
+            ConsistentRead=True,
+        )
+        items = []
+        while True:
+            response = self.read(table.query, **params)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def scan_segment(self, index, checkpoint):
+        """Collect the users of one Scan segment, resuming where the checkpoint left off"""
+        segment = checkpoint.segment(index)
+        if segment["done"]:
+            return
+        params = {
+            "Segment": index,
+            "TotalSegments": self.args.segments,
+            "ProjectionExpression": "#user",
+            "ExpressionAttributeNames": {"#user": "user"},
+            "Limit": self.args.page_size,
+        }
+        last_key = segment["last_key"]
+        while True:
+            if last_key:
+                params["ExclusiveStartKey"] = last_key
+            response = self.read(self.raw_data_table.scan, **params)
+            last_key = response.get("LastEvaluatedKey")
+            checkpoint.update_segment(index, {item["user"] for item in response.get("Items", [])}, last_key)
+            checkpoint.save()
+            if last_key is None:
+                return
+
+    def expected_totals(self, user):
+        """Per-exercise totals and total_lifted recomputed from the user's raw days"""
+        aliases = {item["alias"]: item["canonical"] for item in self.query_all(self.aliases_table, user)}
+        days = self.query_all(self.raw_data_table, user)
+        rows = defaultdict(lambda: {"total_volume": ZERO, "total_reps": ZERO})
+        total = ZERO
+        for day in days:
+            total += day.get("total_volume", ZERO)
+            for attribute, field in (("total_volume", "exercise_volumes"), ("total_reps", "exercise_reps")):
+                for name, value in day.get(field, {}).items():
+                    rows[aliases.get(name, name)][attribute] += value
+        return dict(rows), total
+
+    def snapshot(self, user):
+        """Everything a repair depends on: (differences, summary version, new exercise_data, new total)"""
+        expected_rows, expected_total = self.expected_totals(user)
+        summary = {}
+        actual_rows = {}
+        for item in self.query_all(self.aggregates_table, user):
+            name = item["exercise_name"]
+            if name == SUMMARY_ROW:
+                summary = item
+            elif not name.startswith("#"):
+                actual_rows[name] = {attribute: item.get(attribute, ZERO) for attribute in ("total_volume", "total_reps")}
+
+        differences = {}
+        exercise_data = {}
+        for name in set(expected_rows) | set(actual_rows):
+            expected = expected_rows.get(name, {"total_volume": ZERO, "total_reps": ZERO})
+            actual = actual_rows.get(name)
+            exercise_data[name] = expected
+            if actual is None and not any(expected.values()):
+                continue
+            if actual != expected:
+                differences[name] = (actual, expected)
+        actual_total = summary.get("total_volume", ZERO)
+        if actual_total != expected_total or (not summary and expected_rows):
+            differences[SUMMARY_ROW] = ({"total_volume": actual_total}, {"total_volume": expected_total})
+        elif "exercise_data" in summary and summary["exercise_data"] != exercise_data:
+            differences[SUMMARY_ROW] = ({"exercise_data": "stale"}, {"exercise_data": "rebuilt"})
+        return differences, summary.get("version"), exercise_data, expected_total
+
+    def build_repair(self, user, differences, version, exercise_data, total):
+        """Transactions that write the differing rows, the first one guarded by the summary version"""
+        rows = [
+            {
+                "Update": {
+                    "TableName": self.aggregates_table.name,
+                    "Key": {"user": user, "exercise_name": name},
+                    "UpdateExpression": "SET total_volume = :v, total_reps = :r",
+                    "ExpressionAttributeValues": {":v": expected["total_volume"], ":r": expected["total_reps"]},
+                }
+            }
+            for name, (_, expected) in sorted(differences.items()) if name != SUMMARY_ROW
+        ]
+        transactions = []
+        chunk_size = TRANSACT_MAX_ITEMS - 2
+        for start in range(0, max(len(rows), 1), chunk_size):
+            values = {":one": 1, ":total": total, ":exercise_data": exercise_data}
+            if version is None:
+                condition = "attribute_not_exists(version)"
+            else:
+                condition = "version = :version"
+                values[":version"] = version
+            summary_update = {
+                "Update": {
+                    "TableName": self.aggregates_table.name,
+                    "Key": {"user": user, "exercise_name": SUMMARY_ROW},
+                    "UpdateExpression": "SET total_volume = :total, exercise_data = :exercise_data ADD version :one",
+                    "ConditionExpression": condition,
+                    "ExpressionAttributeValues": values,
+                }
+            }
+            version_update = {
+                "Update": {
+                    "TableName": self.aggregates_table.name,
+                    "Key": {"user": user, "exercise_name": VERSION_ROW},
+                    # The repaired rows aren't stamped; synced clients get every row again
+                    "UpdateExpression": "SET reset_sequence = :now ADD version :one",
+                    "ExpressionAttributeValues": {":now": change_sequence(), ":one": 1},
+                }
+            }
+            transactions.append([summary_update, version_update] + rows[start:start + chunk_size])
+            version = (version or 0) + 1
+        return transactions
+
+    def describe(self, user, differences):
+        lines = []
+        for name, (actual, expected) in sorted(differences.items()):
+            for attribute, value in expected.items():
+                before = (actual or {}).get(attribute, "missing")
+                if before != value:
+                    lines.append(f"{user}: {name} {attribute} {before} -> {value}")
+        with self.print_lock:
+            print("\n".join(lines), flush=True)
+
+    def check_user(self, user):
+        """Compare one user and repair them; returns ok, drift (dry run), repaired or busy"""
+        differences, version, _, _ = self.snapshot(user)
+        if not differences:
+            return "ok"
+
+        for _ in range(self.args.attempts):
+            time.sleep(self.args.settle)
+            confirmed, confirmed_version, exercise_data, total = self.snapshot(user)
+            if not confirmed:
+                return "ok"
+            if confirmed != differences or confirmed_version != version:
+                # Still catching up with the stream; look again after another settle
+                differences, version = confirmed, confirmed_version
+                continue
+
+            self.describe(user, differences)
+            if self.args.dry_run:
+                return "drift"
+            try:
+                for transaction in self.build_repair(user, differences, version, exercise_data, total):
+                    self.writes.wait()
+                    response = self.dynamodb_client.transact_write_items(TransactItems=transaction)
+                    self.writes.consumed(response.get("ConsumedCapacity"))
+                return "repaired"
+            except self.dynamodb_client.exceptions.TransactionCanceledException:
+                differences, version, _, _ = self.snapshot(user)
+                if not differences:
+                    return "ok"
+        return "busy"
+
+    def run(self, checkpoint):
+        if self.args.user:
+            users = sorted(set(self.args.user))
+        else:
+            with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+                list(executor.map(lambda index: self.scan_segment(index, checkpoint), range(self.args.segments)))
+            users = sorted({user for segment in checkpoint.state["segments"].values() for user in segment["users"]})
+        done = checkpoint.state["done"]
+        finished = ("ok", "drift") if self.args.dry_run else ("ok", "repaired")
+        pending = [user for user in users if done.get(user) not in finished]
+        print(f"{len(users)} users, {len(users) - len(pending)} already checked", flush=True)
+
+        def check(user):
+            outcome = self.check_user(user)
+            checkpoint.finish_user(user, outcome)
+            checkpoint.save()
+            return outcome
+
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            outcomes = list(executor.map(check, pending))
+
+        counts = defaultdict(int)
+        for outcome in list(done.values()):
+            counts[outcome] += 1
+        print(", ".join(f"{outcome}: {count}" for outcome, count in sorted(counts.items())) or "nothing to check")
+        print(f"consumed {self.reads.total:.1f} read and {self.writes.total:.1f} write capacity units")
+        return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--environment", help="terraform environment; sets the table names")
+    parser.add_argument("--raw-table", default=os.environ.get("RAW_DATA_TABLE"))
+    parser.add_argument("--aggregates-table", default=os.environ.get("AGGREGATES_TABLE"))
+    parser.add_argument("--aliases-table", default=os.environ.get("ALIASES_TABLE"))
+    parser.add_argument("--user", action="append", help="only these users; skips the scan")
+    parser.add_argument("--dry-run", action="store_true", help="print the differences without writing")
+    parser.add_argument("--checkpoint", help="JSON file to resume from and record progress in")
+    parser.add_argument("--segments", type=int, default=8, help="parallel Scan segments")
+    parser.add_argument("--concurrency", type=int, default=4, help="worker threads")
+    parser.add_argument("--page-size", type=int, default=200, help="items per Scan page")
+    parser.add_argument("--max-read-units", type=float, default=100, help="read capacity per second; 0 = unlimited")
+    parser.add_argument("--max-write-units", type=float, default=25, help="write capacity per second; 0 = unlimited")
+    parser.add_argument("--settle", type=float, default=5.0, help="seconds a difference must persist before it is repaired")
+    parser.add_argument("--attempts", type=int, default=3, help="settle rounds before a changing user is reported busy")
+    args = parser.parse_args()
+
+    if args.environment:
+        args.raw_table = args.raw_table or f"{args.environment}_raw_data"
+        args.aggregates_table = args.aggregates_table or f"{args.environment}_aggregated"
+        args.aliases_table = args.aliases_table or f"{args.environment}_aliases"
+    if not (args.raw_table and args.aggregates_table and args.aliases_table):
+        parser.error("pass --environment or all three table names")
+
+    checkpoint = Checkpoint(args.checkpoint, args.raw_table, args.segments)
+    outcomes = Rebuilder(args).run(checkpoint)
+    if "busy" in outcomes:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
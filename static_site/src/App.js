@@ -46,7 +46,7 @@ function App() {
             return <InsertScreen setCurrentScreen={setCurrentScreen} user={user} />;
         }
         if (currentScreen === 'generate-workout') {
-            return <GenerateWorkoutScreen />;
+            return <GenerateWorkoutScreen user={user} />;
         }
         return <Home user={user} />;
     };
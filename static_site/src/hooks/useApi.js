@@ -26,8 +26,8 @@ export const useApi = () => {
         return executeApiCall(fetchFitnessData, userEmail);
     }, [executeApiCall]);
 
-    const getWorkoutPlan = useCallback(async () => {
-        return executeApiCall(fetchWorkoutPlan);
+    const getWorkoutPlan = useCallback(async (userEmail, onPartial = null) => {
+        return executeApiCall(fetchWorkoutPlan, userEmail, onPartial);
     }, [executeApiCall]);
 
     return {
@@ -2,12 +2,13 @@ import React, { useState } from 'react';
 import ErrorDisplay from '../components/ErrorDisplay';
 import { useApi } from '../hooks/useApi';
 
-const GenerateWorkoutScreen = () => {
+const GenerateWorkoutScreen = ({ user }) => {
     const [workoutPlan, setWorkoutPlan] = useState(null);
     const { loading, error, getWorkoutPlan, clearError } = useApi();
 
     const handleGenerateWorkout = async () => {
-        const plan = await getWorkoutPlan();
+        // The plan shows up part by part while it is generated
+        const plan = await getWorkoutPlan(user?.email, setWorkoutPlan);
         if (plan) {
             setWorkoutPlan(plan);
         }
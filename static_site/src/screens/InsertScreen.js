@@ -1,13 +1,29 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
 import { API_ENDPOINTS, FITNESS_CONSTANTS } from '../utils/constants';
 import { validateExerciseData, validateDate } from '../utils/validation';
+import { fetchExerciseSuggestions, getApiHeaders } from '../utils/api';
 import { logError, logUserAction } from '../utils/errorTracking';
 
 const InsertScreen = ({ setCurrentScreen, user }) => {
     const [date, setDate] = useState(new Date().toISOString().split('T')[0]);
     const [rows, setRows] = useState([{ ...FITNESS_CONSTANTS.DEFAULT_EXERCISE_ROW, id: Date.now() }]);
     const [expandedIndex, setExpandedIndex] = useState(null);
+    const [suggestions, setSuggestions] = useState([]);
+    const suggestTimer = useRef(null);
+
+    useEffect(() => () => clearTimeout(suggestTimer.current), []);
+
+    // Ask for the user's own exercise names as they type, so the same exercise keeps one name
+    const updateSuggestions = (prefix) => {
+        clearTimeout(suggestTimer.current);
+        if (!user || !user.email) {
+            return;
+        }
+        suggestTimer.current = setTimeout(async () => {
+            setSuggestions(await fetchExerciseSuggestions(user.email, prefix));
+        }, 150);
+    };
 
     const handleDateChange = (e) => {
         setDate(e.target.value);
@@ -17,6 +33,9 @@ const InsertScreen = ({ setCurrentScreen, user }) => {
         const updatedRows = [...rows];
         updatedRows[index][field] = value;
         setRows(updatedRows);
+        if (field === 'exercise') {
+            updateSuggestions(value);
+        }
     };
 
     const handleAddRow = () => {
@@ -73,12 +92,7 @@ const InsertScreen = ({ setCurrentScreen, user }) => {
             await axios.post(
                 API_ENDPOINTS.POST,
                 formattedData,
-                {
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'x-api-key': process.env.REACT_APP_API_KEY,
-                    },
-                }
+                { headers: await getApiHeaders() }
             );
 
             // Calculate the total lbs lifted for the day
@@ -134,7 +148,9 @@ const InsertScreen = ({ setCurrentScreen, user }) => {
                                 >
                                     <input
                                         type="text"
+                                        list="exercise-suggestions"
                                         value={row.exercise}
+                                        onFocus={() => updateSuggestions(row.exercise)}
                                         onChange={(e) =>
                                             handleChange(index, 'exercise', e.target.value)
                                         }
@@ -168,6 +184,11 @@ const InsertScreen = ({ setCurrentScreen, user }) => {
                             )}
                         </div>
                     ))}
+                    <datalist id="exercise-suggestions">
+                        {suggestions.map((name) => (
+                            <option key={name} value={name} />
+                        ))}
+                    </datalist>
                     <button type="button" className="add-button" onClick={handleAddRow}>
                         Add Exercise
                     </button>
@@ -1,8 +1,9 @@
 import axios from 'axios';
 import { API_ENDPOINTS } from './constants';
 import { logError, logUserAction } from './errorTracking';
+import { auth } from './firebase';
 
-const getApiHeaders = (userEmail = null) => {
+export const getApiHeaders = async (userEmail = null) => {
     const headers = {
         'x-api-key': process.env.REACT_APP_API_KEY,
         'Content-Type': 'application/json',
@@ -11,6 +12,12 @@ const getApiHeaders = (userEmail = null) => {
     if (userEmail) {
         headers['x-user-email'] = userEmail;
     }
+
+    // The API takes the user from the Firebase ID token when it can verify one;
+    // the SDK caches the token and refreshes it before it expires
+    if (auth.currentUser) {
+        headers['Authorization'] = `Bearer ${await auth.currentUser.getIdToken()}`;
+    }
     
     return headers;
 };
@@ -23,7 +30,7 @@ export const fetchFitnessData = async (userEmail) => {
         const response = await axios.post(
             API_ENDPOINTS.GET,
             { user: userEmail },
-            { headers: getApiHeaders(userEmail) }
+            { headers: await getApiHeaders(userEmail) }
         );
         console.log("Response from API:", response.data);
         return response.data;
@@ -37,14 +44,66 @@ export const fetchFitnessData = async (userEmail) => {
     }
 };
 
-export const fetchWorkoutPlan = async () => {
+export const fetchExerciseSuggestions = async (userEmail, prefix, limit = 8) => {
     try {
-        logUserAction('fetch_workout_plan');
-        
-        const response = await axios.get(API_ENDPOINTS.WORKOUT, {
-            headers: getApiHeaders(),
+        const response = await axios.post(
+            API_ENDPOINTS.GET,
+            { user: userEmail, mode: 'suggest', prefix, limit },
+            { headers: await getApiHeaders(userEmail) }
+        );
+        return response.data.suggestions;
+    } catch (error) {
+        // Suggestions are a convenience; typing goes on without them
+        logError(error, {
+            action: 'fetch_exercise_suggestions'
         });
-        return response.data.workout_plan;
+        return [];
+    }
+};
+
+// Seconds between polls for the plan while it is generated, and how many polls at most
+const WORKOUT_PLAN_POLL_SECONDS = 2;
+const WORKOUT_PLAN_MAX_POLLS = 45;
+
+const sleep = (seconds) => new Promise((resolve) => setTimeout(resolve, seconds * 1000));
+
+// The plan is asked for in stream mode, which answers once the model is done.
+// Meanwhile polls read the partial plan it writes back and hand it to onPartial.
+export const fetchWorkoutPlan = async (userEmail = null, onPartial = null) => {
+    try {
+        logUserAction('fetch_workout_plan');
+        const headers = await getApiHeaders(userEmail);
+
+        let generated = null;
+        let generating = true;
+        const generation = axios.get(API_ENDPOINTS.WORKOUT, { headers, params: { stream: 1 } })
+            .then((response) => { generated = response; })
+            .catch((error) => {
+                // API Gateway gives up on a long generation before the Lambda does; the polls carry on
+                if (error.response?.status !== 504) {
+                    throw error;
+                }
+            })
+            .finally(() => { generating = false; });
+
+        for (let poll = 0; poll < WORKOUT_PLAN_MAX_POLLS; poll++) {
+            const wait = sleep(WORKOUT_PLAN_POLL_SECONDS);
+            await (generating ? Promise.race([generation, wait]) : wait);
+            // A 202 means another request is generating the plan; keep polling for it
+            if (generated?.status === 200) {
+                return generated.data.workout_plan;
+            }
+            const response = await axios.get(API_ENDPOINTS.WORKOUT, { headers });
+            if (response.status === 200) {
+                if (response.data.complete) {
+                    return response.data.workout_plan;
+                }
+                if (onPartial) {
+                    onPartial(response.data.workout_plan);
+                }
+            }
+        }
+        throw new Error('The workout plan is still being generated. Please try again.');
     } catch (error) {
         logError(error, { 
             action: 'fetch_workout_plan' 
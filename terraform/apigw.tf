@@ -7,9 +7,10 @@ module "api_gateway" {
   protocol_type = "HTTP"
 
   cors_configuration = {
-    allow_headers = ["content-type", "x-amz-date", "authorization", "x-api-key", "x-amz-security-token", "x-amz-user-agent", "x-user-email"]
-    allow_methods = ["GET", "POST", "OPTIONS"]
-    allow_origins = ["https://${local.domain_name}"]
+    allow_headers  = ["content-type", "x-amz-date", "authorization", "x-api-key", "x-amz-security-token", "x-amz-user-agent", "x-user-email", "if-none-match"]
+    allow_methods  = ["GET", "POST", "OPTIONS"]
+    expose_headers = ["etag"]
+    allow_origins  = ["https://${local.domain_name}"]
   }
 
   create_certificate = false
@@ -32,8 +33,12 @@ module "api_gateway" {
   }
 
   authorizers = {
+    # Not cached by API Gateway: results would be keyed on the shared API key
+    # while the context carries the user. lambda_authorizer caches verified
+    # ID tokens itself.
     lambda = {
       authorizer_payload_format_version = "2.0"
+      authorizer_result_ttl_in_seconds  = 0
       authorizer_type                   = "REQUEST"
       authorizer_uri                    = module.lambda_authorizer.lambda_function_invoke_arn
       enable_simple_responses           = true
@@ -0,0 +1,57 @@
+resource "aws_sns_topic" "alarms" {
+  name = "${var.environment}_alarms"
+
+  tags = var.tags
+}
+
+resource "aws_sns_topic_subscription" "alarms_email" {
+  count = var.alarm_email == "" ? 0 : 1
+
+  topic_arn = aws_sns_topic.alarms.arn
+  protocol  = "email"
+  endpoint  = var.alarm_email
+}
+
+resource "aws_cloudwatch_metric_alarm" "aggregate_iterator_age" {
+  alarm_name        = "${var.environment}_aggregate_iterator_age"
+  alarm_description = "lambda_aggregate is falling behind the raw_data stream; records older than 24 hours are lost"
+
+  namespace   = "AWS/Lambda"
+  metric_name = "IteratorAge"
+  dimensions = {
+    FunctionName = module.lambda_aggregate.lambda_function_name
+  }
+  statistic           = "Maximum"
+  period              = 300
+  evaluation_periods  = 3
+  threshold           = 3600000
+  comparison_operator = "GreaterThanThreshold"
+  treat_missing_data  = "notBreaching"
+
+  alarm_actions = [aws_sns_topic.alarms.arn]
+  ok_actions    = [aws_sns_topic.alarms.arn]
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_metric_alarm" "aggregate_failures" {
+  alarm_name        = "${var.environment}_aggregate_failures"
+  alarm_description = "raw_data stream records failed lambda_aggregate; aggregates drift until they are replayed or rebuilt"
+
+  namespace   = "AWS/SQS"
+  metric_name = "ApproximateNumberOfMessagesVisible"
+  dimensions = {
+    QueueName = aws_sqs_queue.aggregate_failures.name
+  }
+  statistic           = "Maximum"
+  period              = 300
+  evaluation_periods  = 1
+  threshold           = 0
+  comparison_operator = "GreaterThanThreshold"
+  treat_missing_data  = "notBreaching"
+
+  alarm_actions = [aws_sns_topic.alarms.arn]
+  ok_actions    = [aws_sns_topic.alarms.arn]
+
+  tags = var.tags
+}
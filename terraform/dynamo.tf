@@ -19,9 +19,16 @@ resource "aws_dynamodb_table" "raw_data" {
     type = "S"
   }
 
+  attribute {
+    name = "change_seq"
+    type = "N"
+  }
+
   hash_key  = "user"
   range_key = "date"
 
+  # Days are keyed "DAILY_SUMMARY#<shard>" (fitness_common.daily_summary_key)
+  # so writes spread over several index partitions
   global_secondary_index {
     name            = "exercise-date-index"
     hash_key        = "exercise"
@@ -29,6 +36,16 @@ resource "aws_dynamodb_table" "raw_data" {
     projection_type = "ALL"
   }
 
+  # Sparse: only days stamped with a change_seq (fitness_sync) are in it.
+  # lambda_get's sync mode reads a user's changed days from it.
+  global_secondary_index {
+    name               = "user-change-index"
+    hash_key           = "user"
+    range_key          = "change_seq"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["exercise_reps", "exercise_volumes", "total_volume", "version"]
+  }
+
   stream_enabled   = true
   stream_view_type = "NEW_AND_OLD_IMAGES"
 
@@ -51,8 +68,93 @@ resource "aws_dynamodb_table" "aggregates" {
     type = "S"
   }
 
+  attribute {
+    name = "change_seq"
+    type = "N"
+  }
+
   hash_key = "user"
   range_key = "exercise_name"
 
+  # Sparse like raw_data's: aggregate and record rows changed by lambda_aggregate
+  global_secondary_index {
+    name            = "user-change-index"
+    hash_key        = "user"
+    range_key       = "change_seq"
+    projection_type = "INCLUDE"
+    non_key_attributes = [
+      "best_e1rm",
+      "best_e1rm_date",
+      "best_set_volume",
+      "best_set_volume_date",
+      "max_weight",
+      "max_weight_date",
+      "total_reps",
+      "total_volume",
+    ]
+  }
+
+  tags = var.tags
+}
+resource "aws_dynamodb_table" "rollups" {
+  name         = "${var.environment}_rollups"
+  billing_mode = "PAY_PER_REQUEST"
+
+  deletion_protection_enabled = true
+
+  attribute {
+    name = "user"
+    type = "S"
+  }
+
+  attribute {
+    name = "bucket"
+    type = "S"
+  }
+
+  hash_key  = "user"
+  range_key = "bucket"
+
+  tags = var.tags
+}
+
+resource "aws_dynamodb_table" "aliases" {
+  name         = "${var.environment}_aliases"
+  billing_mode = "PAY_PER_REQUEST"
+
+  deletion_protection_enabled = true
+
+  attribute {
+    name = "user"
+    type = "S"
+  }
+
+  attribute {
+    name = "alias"
+    type = "S"
+  }
+
+  hash_key  = "user"
+  range_key = "alias"
+
   tags = var.tags
-}
\ No newline at end of file
+}
+
+resource "aws_dynamodb_table" "workout_plans" {
+  name         = "${var.environment}_workout_plans"
+  billing_mode = "PAY_PER_REQUEST"
+
+  attribute {
+    name = "cache_key"
+    type = "S"
+  }
+
+  hash_key = "cache_key"
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = var.tags
+}
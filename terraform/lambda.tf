@@ -11,6 +11,9 @@ module "lambda_aggregate" {
 
   environment_variables = {
     AGGREGATES_TABLE = aws_dynamodb_table.aggregates.id
+    ALIASES_TABLE    = aws_dynamodb_table.aliases.id
+    RAW_DATA_TABLE   = aws_dynamodb_table.raw_data.id
+    ROLLUPS_TABLE    = aws_dynamodb_table.rollups.id
   }
 
   source_path = [
@@ -20,6 +23,8 @@ module "lambda_aggregate" {
     }
   ]
 
+  layers = [module.lambda_layer_common.lambda_layer_arn]
+
   attach_policies = true
   policies        = ["arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"]
 
@@ -28,10 +33,46 @@ module "lambda_aggregate" {
     dynamodb = {
       effect = "Allow",
       actions = [
-        "dynamodb:PutItem",
+        "dynamodb:BatchGetItem",
+        "dynamodb:GetItem",
+        "dynamodb:Query",
         "dynamodb:UpdateItem",
       ],
-      resources = [aws_dynamodb_table.aggregates.arn]
+      resources = [
+        aws_dynamodb_table.aggregates.arn,
+        aws_dynamodb_table.aliases.arn,
+        aws_dynamodb_table.raw_data.arn,
+        aws_dynamodb_table.rollups.arn
+      ]
+    }
+    stream = {
+      effect = "Allow",
+      actions = [
+        "dynamodb:DescribeStream",
+        "dynamodb:GetRecords",
+        "dynamodb:GetShardIterator",
+        "dynamodb:ListStreams",
+      ],
+      resources = [aws_dynamodb_table.raw_data.stream_arn]
+    }
+    failures = {
+      effect    = "Allow",
+      actions   = ["sqs:SendMessage"],
+      resources = [aws_sqs_queue.aggregate_failures.arn]
+    }
+  }
+
+  event_source_mapping = {
+    raw_data = {
+      event_source_arn                   = aws_dynamodb_table.raw_data.stream_arn
+      starting_position                  = "LATEST"
+      batch_size                         = 100
+      maximum_batching_window_in_seconds = 1
+      bisect_batch_on_function_error     = true
+      maximum_retry_attempts             = 10
+      function_response_types            = ["ReportBatchItemFailures"]
+      # Records that still fail are described here instead of being dropped
+      destination_arn_on_failure = aws_sqs_queue.aggregate_failures.arn
     }
   }
 
@@ -59,7 +100,11 @@ module "lambda_authorizer" {
   timeout       = 30
 
   environment_variables = {
-    API_KEY_SECRET = aws_secretsmanager_secret.api_key.name
+    API_KEY_SECRET      = aws_secretsmanager_secret.api_key.name
+    API_KEY_CACHE_TTL   = 300
+    FIREBASE_PROJECT_ID = var.firebase_project_id
+    REQUIRE_ID_TOKEN    = var.require_id_token
+    TOKEN_CACHE_SIZE    = 1024
   }
 
   source_path = [
@@ -69,6 +114,11 @@ module "lambda_authorizer" {
     }
   ]
 
+  layers = [
+    module.lambda_layer_common.lambda_layer_arn,
+    module.lambda_layer_crypto.lambda_layer_arn
+  ]
+
   attach_policies = true
   policies        = ["arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"]
 
@@ -104,6 +154,14 @@ module "lambda_bedrock" {
   runtime       = "python3.13"
   timeout       = 60
 
+  environment_variables = {
+    AGGREGATES_TABLE     = aws_dynamodb_table.aggregates.id
+    CONTEXT_TOKEN_BUDGET = 300
+    PLANS_TABLE          = aws_dynamodb_table.workout_plans.id
+    PLAN_CACHE_TTL       = 86400
+    ROLLUPS_TABLE        = aws_dynamodb_table.rollups.id
+  }
+
   source_path = [
     {
       path             = "${path.module}/lambda_bedrock"
@@ -111,6 +169,8 @@ module "lambda_bedrock" {
     }
   ]
 
+  layers = [module.lambda_layer_common.lambda_layer_arn]
+
   attach_policies = true
   policies        = ["arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"]
 
@@ -118,9 +178,32 @@ module "lambda_bedrock" {
   policy_statements = {
     bedrock = {
       effect = "Allow",
-      actions = ["bedrock:InvokeModel"],
+      actions = [
+        "bedrock:InvokeModel",
+        "bedrock:InvokeModelWithResponseStream",
+      ],
       resources = ["*"]
     }
+    dynamodb = {
+      effect = "Allow",
+      actions = [
+        "dynamodb:GetItem",
+        "dynamodb:PutItem",
+        "dynamodb:UpdateItem",
+      ],
+      resources = [aws_dynamodb_table.workout_plans.arn]
+    }
+    context = {
+      effect = "Allow",
+      actions = [
+        "dynamodb:GetItem",
+        "dynamodb:Query",
+      ],
+      resources = [
+        aws_dynamodb_table.aggregates.arn,
+        aws_dynamodb_table.rollups.arn
+      ]
+    }
   }
 
   allowed_triggers = {
@@ -148,6 +231,11 @@ module "lambda_get" {
 
   environment_variables = {
     AGGREGATES_TABLE = aws_dynamodb_table.aggregates.id
+    ALIASES_TABLE    = aws_dynamodb_table.aliases.id
+    EXPORT_BUCKET    = module.exports_s3_bucket.s3_bucket_id
+    EXPORT_LINK_TTL  = 3600
+    RAW_DATA_TABLE   = aws_dynamodb_table.raw_data.id
+    ROLLUPS_TABLE    = aws_dynamodb_table.rollups.id
   }
 
   source_path = [
@@ -157,15 +245,54 @@ module "lambda_get" {
     }
   ]
 
+  layers = [
+    module.lambda_layer_common.lambda_layer_arn,
+    module.lambda_layer_numpy.lambda_layer_arn
+  ]
+
   attach_policies = true
   policies        = ["arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"]
 
   attach_policy_statements = true
   policy_statements = {
     dynamodb = {
+      effect    = "Allow",
+      actions = [
+        "dynamodb:GetItem",
+        "dynamodb:Query",
+        "dynamodb:UpdateItem",
+      ],
+      resources = [
+        aws_dynamodb_table.aggregates.arn,
+        aws_dynamodb_table.rollups.arn
+      ]
+    }
+    raw_data = {
       effect    = "Allow",
       actions   = ["dynamodb:Query"],
-      resources = [aws_dynamodb_table.aggregates.arn]
+      resources = [aws_dynamodb_table.raw_data.arn]
+    }
+    aliases = {
+      effect    = "Allow",
+      actions   = ["dynamodb:Query"],
+      resources = [aws_dynamodb_table.aliases.arn]
+    }
+    sync = {
+      effect  = "Allow",
+      actions = ["dynamodb:Query"],
+      resources = [
+        "${aws_dynamodb_table.aggregates.arn}/index/user-change-index",
+        "${aws_dynamodb_table.raw_data.arn}/index/user-change-index"
+      ]
+    }
+    exports = {
+      effect = "Allow",
+      actions = [
+        "s3:AbortMultipartUpload",
+        "s3:GetObject",
+        "s3:PutObject",
+      ],
+      resources = ["${module.exports_s3_bucket.s3_bucket_arn}/exports/*"]
     }
   }
 
@@ -181,6 +308,79 @@ module "lambda_get" {
   tags = var.tags
 }
 
+module "lambda_layer_common" {
+  source  = "terraform-aws-modules/lambda/aws"
+  version = "7.17.0"
+
+  create_layer = true
+
+  layer_name          = "${var.environment}_common"
+  description         = "Validation, JSON and DynamoDB helpers shared by the functions"
+  compatible_runtimes = ["python3.13"]
+
+  source_path = [
+    {
+      path             = "${path.module}/layer_common"
+      pip_requirements = false
+      prefix_in_zip    = "python"
+    }
+  ]
+
+  tags = var.tags
+}
+
+# Only lambda_get's analytics mode uses NumPy. Wheels are built in the
+# python3.13 build image so they match the Lambda platform.
+module "lambda_layer_numpy" {
+  source  = "terraform-aws-modules/lambda/aws"
+  version = "7.17.0"
+
+  create_layer = true
+
+  layer_name          = "${var.environment}_numpy"
+  description         = "NumPy for the analytics mode of the get function"
+  compatible_runtimes = ["python3.13"]
+  runtime             = "python3.13"
+  build_in_docker     = true
+
+  source_path = [
+    {
+      path             = "${path.module}/layer_numpy"
+      pip_requirements = true
+      prefix_in_zip    = "python"
+      patterns         = ["!requirements.txt"]
+    }
+  ]
+
+  tags = var.tags
+}
+
+# Only the authorizer uses cryptography, to check ID token signatures.
+# Wheels are built in the python3.13 build image so they match the Lambda platform.
+module "lambda_layer_crypto" {
+  source  = "terraform-aws-modules/lambda/aws"
+  version = "7.17.0"
+
+  create_layer = true
+
+  layer_name          = "${var.environment}_crypto"
+  description         = "cryptography for the authorizer function"
+  compatible_runtimes = ["python3.13"]
+  runtime             = "python3.13"
+  build_in_docker     = true
+
+  source_path = [
+    {
+      path             = "${path.module}/layer_crypto"
+      pip_requirements = true
+      prefix_in_zip    = "python"
+      patterns         = ["!requirements.txt"]
+    }
+  ]
+
+  tags = var.tags
+}
+
 module "lambda_post" {
   source  = "terraform-aws-modules/lambda/aws"
   version = "7.17.0"
@@ -194,7 +394,10 @@ module "lambda_post" {
 
   environment_variables = {
     AGGREGATES_TABLE = aws_dynamodb_table.aggregates.id
+    ALIASES_TABLE    = aws_dynamodb_table.aliases.id
+    COMPACT_SETS     = true
     RAW_DATA_TABLE   = aws_dynamodb_table.raw_data.id
+    ROLLUPS_TABLE    = aws_dynamodb_table.rollups.id
   }
 
   source_path = [
@@ -204,6 +407,8 @@ module "lambda_post" {
     }
   ]
 
+  layers = [module.lambda_layer_common.lambda_layer_arn]
+
   attach_policies = true
   policies        = ["arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"]
 
@@ -212,13 +417,19 @@ module "lambda_post" {
     dynamodb = {
       effect = "Allow",
       actions = [
+        "dynamodb:BatchGetItem",
+        "dynamodb:BatchWriteItem",
+        "dynamodb:DeleteItem",
         "dynamodb:GetItem",
         "dynamodb:PutItem",
+        "dynamodb:Query",
         "dynamodb:UpdateItem",
       ],
       resources = [
         aws_dynamodb_table.aggregates.arn,
-        aws_dynamodb_table.raw_data.arn
+        aws_dynamodb_table.aliases.arn,
+        aws_dynamodb_table.raw_data.arn,
+        aws_dynamodb_table.rollups.arn
       ]
     }
   }
@@ -245,7 +456,7 @@ resource "aws_secretsmanager_secret" "api_key" {
 resource "aws_secretsmanager_secret_version" "api_key_version" {
   secret_id = aws_secretsmanager_secret.api_key.id
 
-  secret_string = jsonencode({ "API_KEY" : "" })
+  secret_string = jsonencode({ "API_KEY" : "", "MOBILE_API_KEY" : "" })
 
   lifecycle {
     ignore_changes = [secret_string]
@@ -1,97 +1,489 @@
 import logging
 import os
+import time
+from datetime import datetime
 from decimal import Decimal
 
-import boto3
+from fitness_data import DynamoDBClient, deserialize_item
+from fitness_metrics import add_count, instrument_handler
+from fitness_records import RECORD_METRICS, RECORD_PREFIX, build_record_update, day_bests, query_history_bests, record_row
+from fitness_sets import day_sets
+from fitness_sync import CHANGE_SEQUENCE, change_sequence
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource("dynamodb")
-aggregates_table = dynamodb.Table(os.environ["AGGREGATES_TABLE"])
+# Takes and returns plain Python values; the botocore client is created on first use
+dynamodb_client = DynamoDBClient()
+aggregates_table = dynamodb_client.Table(os.environ["AGGREGATES_TABLE"])
+rollups_table = dynamodb_client.Table(os.environ["ROLLUPS_TABLE"])
+aliases_table = dynamodb_client.Table(os.environ["ALIASES_TABLE"])
+raw_data_table = dynamodb_client.Table(os.environ["RAW_DATA_TABLE"])
 
+# DynamoDB limits on actions per TransactWriteItems and keys per BatchGetItem
+TRANSACT_MAX_ITEMS = 100
+BATCH_GET_MAX_KEYS = 100
+BATCH_MAX_RETRIES = 8
+BATCH_BACKOFF_BASE = 0.05
+RECORD_MAX_ATTEMPTS = 5
 
-def consolidate_aggregate(user, stream_records):
+# The total_lifted row also holds the last stream sequence number applied for
+# the user, so a retried batch can skip the records it already counted, and
+# the exercise_data summary lambda_get serves with a single GetItem
+CHECKPOINT_ROW = "total_lifted"
+# Sequence numbers are decimal strings of up to 40 digits; zero-padding them
+# keeps DynamoDB's string comparison in numeric order
+SEQUENCE_WIDTH = 40
+# Small row whose version counter goes up with every change to the user's
+# aggregates; lambda_get reads it to answer conditional requests cheaply
+VERSION_ROW = "#version"
+
+# Rollup items are keyed by "<granularity>#<bucket>" and hold total_volume
+# plus one "volume:<exercise>" and "reps:<exercise>" counter per exercise, so
+# every counter is a top-level attribute that ADD can create on first use
+VOLUME_PREFIX = "volume:"
+REPS_PREFIX = "reps:"
+
+# Alias maps per user, reused until the summary row's aliases_version moves
+_alias_cache = {}
+
+
+def sequence_number(record):
+    return record["dynamodb"]["SequenceNumber"].zfill(SEQUENCE_WIDTH)
+
+
+def deserialize_image(image):
+    return deserialize_item(image or {})
+
+
+def get_aliases(user, aliases_version):
+    """Return the user's alias -> canonical name map for the given aliases_version"""
+    if not aliases_version:
+        return {}
+    cached = _alias_cache.get(user)
+    if cached and cached[0] == aliases_version:
+        return cached[1]
+
+    aliases = {}
+    query_kwargs = {
+        "KeyConditionExpression": "#user = :user",
+        "ExpressionAttributeNames": {"#user": "user"},
+        "ExpressionAttributeValues": {":user": user},
+        "ConsistentRead": True
+    }
+    while True:
+        response = aliases_table.query(**query_kwargs)
+        for item in response.get("Items", []):
+            aliases[item["alias"]] = item["canonical"]
+        if "LastEvaluatedKey" not in response:
+            break
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    _alias_cache[user] = (aliases_version, aliases)
+    return aliases
+
+
+def canonical_totals(totals, aliases):
+    """Re-key per-exercise totals by canonical name, summing merged aliases"""
+    canonical = {}
+    for exercise_name, value in totals.items():
+        exercise_name = aliases.get(exercise_name, exercise_name)
+        canonical[exercise_name] = canonical.get(exercise_name, Decimal("0")) + value
+    return canonical
+
+
+def record_deltas(record, aliases):
     """
-    Consolidate all updates from the stream into a single JSON object for the user.
+    Net change one stream record makes to the aggregates: NewImage minus OldImage.
+
+    INSERT has no OldImage and REMOVE has no NewImage, so both fall out of
+    the same subtraction. Exercise names are mapped through the user's
+    aliases, so days stored before a merge count towards the canonical name.
+    Returns exercise_name -> {'total_volume', 'total_reps'} (and
+    'total_lifted' -> {'total_volume'}) holding only the rows that change.
     """
-    consolidated_data = {
-        "exercise_data": {},
-        "yearly_total": 0
+    old_image = deserialize_image(record["dynamodb"].get("OldImage"))
+    new_image = deserialize_image(record["dynamodb"].get("NewImage"))
+
+    old_volumes = canonical_totals(old_image.get("exercise_volumes", {}), aliases)
+    old_reps = canonical_totals(old_image.get("exercise_reps", {}), aliases)
+    new_volumes = canonical_totals(new_image.get("exercise_volumes", {}), aliases)
+    new_reps = canonical_totals(new_image.get("exercise_reps", {}), aliases)
+
+    deltas = {}
+    for exercise_name in set(old_volumes) | set(new_volumes):
+        volume_delta = new_volumes.get(exercise_name, Decimal("0")) - old_volumes.get(exercise_name, Decimal("0"))
+        reps_delta = new_reps.get(exercise_name, Decimal("0")) - old_reps.get(exercise_name, Decimal("0"))
+        if volume_delta == 0 and reps_delta == 0:
+            continue
+        deltas[exercise_name] = {
+            "total_volume": volume_delta,
+            "total_reps": reps_delta
+        }
+
+    total_delta = new_image.get("total_volume", Decimal("0")) - old_image.get("total_volume", Decimal("0"))
+    if total_delta != 0:
+        deltas[CHECKPOINT_ROW] = {"total_volume": total_delta}
+
+    return deltas
+
+
+def merge_deltas(combined, deltas):
+    for exercise_name, delta in deltas.items():
+        row = combined.setdefault(exercise_name, {})
+        for attribute, value in delta.items():
+            row[attribute] = row.get(attribute, Decimal("0")) + value
+
+
+def apply_to_summary(exercise_data, deltas):
+    """Apply merged deltas to a copy of the user's exercise_data summary"""
+    exercise_data = {name: dict(totals) for name, totals in exercise_data.items()}
+    for exercise_name, delta in deltas.items():
+        if exercise_name == CHECKPOINT_ROW:
+            continue
+        totals = exercise_data.setdefault(exercise_name, {"total_volume": Decimal("0"), "total_reps": Decimal("0")})
+        for attribute, value in delta.items():
+            totals[attribute] = totals.get(attribute, Decimal("0")) + value
+    return exercise_data
+
+
+def rollup_buckets(date):
+    """Day, ISO week, month and year buckets a raw_data date rolls up into"""
+    iso_year, iso_week, _ = datetime.strptime(date, "%Y-%m-%d").date().isocalendar()
+    return [
+        f"day#{date}",
+        f"week#{iso_year}-W{iso_week:02d}",
+        f"month#{date[:7]}",
+        f"year#{date[:4]}",
+    ]
+
+
+def batch_get_rows(keys, projection=None):
+    """Strongly consistent read of many aggregate rows with BatchGetItem"""
+    items = []
+    for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request = {"Keys": keys[start:start + BATCH_GET_MAX_KEYS], "ConsistentRead": True}
+        if projection:
+            request.update(projection)
+        request_items = {aggregates_table.name: request}
+        for attempt in range(BATCH_MAX_RETRIES + 1):
+            response = dynamodb_client.batch_get_item(RequestItems=request_items)
+            items.extend(response.get("Responses", {}).get(aggregates_table.name, []))
+            request_items = response.get("UnprocessedKeys") or {}
+            if not request_items:
+                break
+            time.sleep(BATCH_BACKOFF_BASE * (2 ** attempt))
+        else:
+            raise RuntimeError(f"UnprocessedKeys still pending after {BATCH_MAX_RETRIES} retries")
+    return items
+
+
+def get_checkpoints(users):
+    """
+    Read every user's total_lifted row with BatchGetItem.
+
+    Returns user -> {'last_sequence', 'exercise_data', 'version',
+    'aliases_version'}; any of them may be missing.
+    """
+    keys = [{"user": user, "exercise_name": CHECKPOINT_ROW} for user in sorted(users)]
+    projection = {
+        "ProjectionExpression": "#user, last_sequence, exercise_data, version, aliases_version",
+        "ExpressionAttributeNames": {"#user": "user"},
     }
+    return {item["user"]: item for item in batch_get_rows(keys, projection)}
 
-    for record in stream_records:
-        new_image = record["dynamodb"]["NewImage"]
-        exercise_volumes = new_image["exercise_volumes"]["M"]
-        exercise_reps = new_image["exercise_reps"]["M"]
 
-        for exercise, volume_data in exercise_volumes.items():
-            volume = float(volume_data["N"])
-            reps = int(exercise_reps[exercise]["N"])
+def build_aggregate_update(user, exercise_name, delta, change_seq):
+    """Transaction item that ADDs one delta to one aggregate row and stamps it with change_seq"""
+    update_expression = ", ".join(f"{attribute} :{attribute}" for attribute in delta)
+    return {
+        "Update": {
+            "TableName": aggregates_table.name,
+            "Key": {"user": user, "exercise_name": exercise_name},
+            "UpdateExpression": f"SET {CHANGE_SEQUENCE} = :change_seq ADD {update_expression}",
+            "ExpressionAttributeValues": {":change_seq": change_seq, **{f":{k}": v for k, v in delta.items()}}
+        }
+    }
 
-            if exercise not in consolidated_data["exercise_data"]:
-                consolidated_data["exercise_data"][exercise] = {
-                    "total_volume": 0,
-                    "total_reps": 0
-                }
 
-            consolidated_data["exercise_data"][exercise]["total_volume"] += volume
-            consolidated_data["exercise_data"][exercise]["total_reps"] += reps
-            consolidated_data["yearly_total"] += volume
+def build_checkpoint_update(user, delta, previous_sequence, previous_version, sequence, exercise_data, change_seq):
+    """
+    Transaction item that moves the user's checkpoint forward.
 
-    logger.info(
-        f"Consolidated data for user: {user}, Exercises: {consolidated_data['exercise_data']}, "
-        f"Yearly Total: {consolidated_data['yearly_total']}"
-    )
-    return consolidated_data
+    The condition fails if another invocation applied records for this user
+    since the checkpoint was read, so nothing is ever counted twice, or if
+    lambda_post merged exercises and bumped the version in between. The
+    exercise_data summary is rewritten with it when the user has one; until
+    lambda_get has built it, the condition also makes sure it still is absent.
+    Its version goes up in step with the VERSION_ROW counter.
+    """
+    update_expression = f"SET last_sequence = :sequence, {CHANGE_SEQUENCE} = :change_seq"
+    values = {":sequence": sequence, ":change_seq": change_seq, ":one": 1}
+    if exercise_data is not None:
+        update_expression += ", exercise_data = :exercise_data"
+        values[":exercise_data"] = exercise_data
+    update_expression += " ADD " + ", ".join(["version :one"] + [f"{attribute} :{attribute}" for attribute in delta or {}])
+    values.update({f":{k}": v for k, v in (delta or {}).items()})
+
+    if previous_sequence is None:
+        condition = "attribute_not_exists(last_sequence)"
+    else:
+        condition = "last_sequence = :previous"
+        values[":previous"] = previous_sequence
+    if previous_version is None:
+        condition += " AND attribute_not_exists(version)"
+    else:
+        condition += " AND version = :version"
+        values[":version"] = previous_version
+    if exercise_data is None:
+        condition = f"({condition}) AND attribute_not_exists(exercise_data)"
+
+    return {
+        "Update": {
+            "TableName": aggregates_table.name,
+            "Key": {"user": user, "exercise_name": CHECKPOINT_ROW},
+            "UpdateExpression": update_expression,
+            "ConditionExpression": condition,
+            "ExpressionAttributeValues": values
+        }
+    }
+
+
+def build_rollup_update(user, bucket, deltas):
+    """Transaction item that ADDs a bucket's merged deltas, or None if they cancel out"""
+    additions = []
+    names = {}
+    values = {}
+    for i, (exercise_name, delta) in enumerate(sorted(deltas.items())):
+        if exercise_name == CHECKPOINT_ROW:
+            if delta["total_volume"] != 0:
+                additions.append("total_volume :total")
+                values[":total"] = delta["total_volume"]
+            continue
+        for prefix, placeholder, attribute in ((VOLUME_PREFIX, "v", "total_volume"), (REPS_PREFIX, "r", "total_reps")):
+            if delta.get(attribute, 0) != 0:
+                additions.append(f"#{placeholder}{i} :{placeholder}{i}")
+                names[f"#{placeholder}{i}"] = f"{prefix}{exercise_name}"
+                values[f":{placeholder}{i}"] = delta[attribute]
+
+    if not additions:
+        return None
+    update = {
+        "TableName": rollups_table.name,
+        "Key": {"user": user, "bucket": bucket},
+        "UpdateExpression": "ADD " + ", ".join(additions),
+        "ExpressionAttributeValues": values
+    }
+    if names:
+        update["ExpressionAttributeNames"] = names
+    return {"Update": update}
 
 
-def update_aggregate(user, consolidated_data):
+def build_version_update(user):
+    """Transaction item that bumps the user's data version"""
+    return {
+        "Update": {
+            "TableName": aggregates_table.name,
+            "Key": {"user": user, "exercise_name": VERSION_ROW},
+            "UpdateExpression": "ADD version :one",
+            "ExpressionAttributeValues": {":one": 1}
+        }
+    }
+
+
+def apply_user_records(user, records, checkpoint_item):
     """
-    Write the consolidated data to a single row in the aggregates table.
+    Apply one user's records on top of their checkpoint.
+
+    All records are merged into one write per exercise and one per rollup
+    bucket. A user whose changes touch more items than one transaction
+    allows is applied in several, each one advancing the checkpoint to the
+    last record it covers.
     """
-    try:
-        logger.info(f"Updating single row for user: {user}")
-        aggregates_table.put_item(
-            Item={
-                "user": user,
-                "exercise_data": consolidated_data["exercise_data"],
-                "yearly_total": Decimal(str(consolidated_data["yearly_total"]))
-            }
+    checkpoint = checkpoint_item.get("last_sequence")
+    version = checkpoint_item.get("version")
+    exercise_data = checkpoint_item.get("exercise_data")
+    aliases = get_aliases(user, checkpoint_item.get("aliases_version"))
+    pending = {}
+    pending_rollups = {}
+    pending_sequence = None
+    applied = 0
+
+    def flush():
+        nonlocal checkpoint, version, exercise_data, pending, pending_rollups, pending_sequence
+        if exercise_data is not None:
+            exercise_data = apply_to_summary(exercise_data, pending)
+        # Every row this transaction writes shares one change stamp
+        change_seq = change_sequence()
+        transact_items = [
+            build_checkpoint_update(
+                user, pending.get(CHECKPOINT_ROW), checkpoint, version, pending_sequence, exercise_data, change_seq
+            ),
+            build_version_update(user)
+        ]
+        transact_items.extend(
+            build_aggregate_update(user, exercise_name, delta, change_seq)
+            for exercise_name, delta in pending.items()
+            if exercise_name != CHECKPOINT_ROW and any(value != 0 for value in delta.values())
         )
-    except Exception as e:
-        logger.error(f"Failed to update aggregate for user {user}: {e}", exc_info=True)
+        for bucket, deltas in pending_rollups.items():
+            rollup_update = build_rollup_update(user, bucket, deltas)
+            if rollup_update:
+                transact_items.append(rollup_update)
+        dynamodb_client.transact_write_items(TransactItems=transact_items)
+        checkpoint = pending_sequence
+        version = (version or 0) + 1
+        pending = {}
+        pending_rollups = {}
+        pending_sequence = None
+
+    for record in records:
+        sequence = sequence_number(record)
+        if checkpoint is not None and sequence <= checkpoint:
+            continue
+
+        deltas = record_deltas(record, aliases)
+        buckets = rollup_buckets(record["dynamodb"]["Keys"]["date"]["S"])
+        items_needed = len(set(pending) | set(deltas) | {CHECKPOINT_ROW, VERSION_ROW}) + len(set(pending_rollups) | set(buckets))
+        if pending_sequence is not None and items_needed > TRANSACT_MAX_ITEMS:
+            flush()
+        merge_deltas(pending, deltas)
+        for bucket in buckets:
+            merge_deltas(pending_rollups.setdefault(bucket, {}), deltas)
+        pending_sequence = sequence
+        applied += 1
+
+    if pending_sequence is not None:
+        flush()
+    return applied
 
 
+def record_changes(records, aliases):
+    """
+    What the records mean for the user's personal records.
+
+    Returns (best, final, touched): per exercise, the best (value, date) of
+    each metric in the days as they are now; per date, the day's bests as
+    the batch leaves it; and every exercise named in any image of the batch.
+    A record can have been read from a day state between two images, by a
+    history query that ran ahead of the stream, so the stored records are
+    checked against where each day ends up, not against what it was before.
+    """
+    final = {}
+    touched = set()
+    for record in records:
+        date = record["dynamodb"]["Keys"]["date"]["S"]
+        old_bests = day_bests(day_sets(deserialize_image(record["dynamodb"].get("OldImage"))), aliases)
+        final[date] = day_bests(day_sets(deserialize_image(record["dynamodb"].get("NewImage"))), aliases)
+        touched.update(old_bests, final[date])
+
+    best = {}
+    for date, bests in sorted(final.items()):
+        for exercise_name, metrics in bests.items():
+            for metric, value in metrics.items():
+                current = best.setdefault(exercise_name, {}).get(metric)
+                if current is None or value > current[0]:
+                    best[exercise_name][metric] = (value, date)
+    return best, final, touched
+
+
+def update_personal_records(user, best, final, touched, rows, aliases):
+    """
+    Bring the user's record rows in line with the changed days.
+
+    A record is only written when it is beaten, or when it is higher than
+    what the batch leaves on its date; then the user's history is read,
+    once, for the next best.
+    Writes are conditioned on what was read and retried after a re-read.
+    Every step can be repeated, so a retried batch is harmless. Change
+    stamps for the rows are taken, one per exercise, on the first write.
+    """
+    history = None
+    exercise_names = sorted(touched)
+    first_change = None
+    for index, exercise_name in enumerate(exercise_names):
+        row = rows.get(exercise_name, {})
+        for attempt in range(RECORD_MAX_ATTEMPTS):
+            raised = {}
+            replaced = {}
+            for metric in RECORD_METRICS:
+                held = row.get(metric)
+                held_date = row.get(f"{metric}_date")
+                candidate = best.get(exercise_name, {}).get(metric)
+                if held is not None and held_date in final \
+                        and held > final[held_date].get(exercise_name, {}).get(metric, 0):
+                    if history is None:
+                        history = query_history_bests(raw_data_table, user, aliases)
+                    replacement = history.get(exercise_name, {}).get(metric)
+                    if replacement != (held, held_date):
+                        replaced[metric] = replacement
+                elif candidate is not None and (held is None or candidate[0] > held):
+                    raised[metric] = candidate
+            if not raised and not replaced:
+                break
+            if first_change is None:
+                first_change = change_sequence(len(exercise_names))
+            try:
+                aggregates_table.update_item(
+                    **build_record_update(user, exercise_name, raised, replaced, row, first_change + index)
+                )
+                add_count("RecordUpdates")
+                break
+            except dynamodb_client.exceptions.ConditionalCheckFailedException:
+                row = aggregates_table.get_item(
+                    Key={"user": user, "exercise_name": record_row(exercise_name)},
+                    ConsistentRead=True
+                ).get("Item", {})
+        else:
+            raise RuntimeError(f"Records of {exercise_name} kept changing after {RECORD_MAX_ATTEMPTS} attempts")
+
+
+@instrument_handler("lambda_aggregate")
 def lambda_handler(event, context):
     """
-    Handle DynamoDB stream events and consolidate updates into a single row per user.
+    Apply DynamoDB stream records from raw_data to the aggregates and rollups tables.
+
+    Failures are reported per user through batchItemFailures. Lambda resumes
+    from the lowest failed sequence number, and records that were already
+    applied before it are skipped by the per-user checkpoint.
     """
-    try:
-        logger.info("Received DynamoDB stream event: %s", event)
-
-        # Group records by user
-        user_records = {}
-        for record in event["Records"]:
-            if record["eventName"] in ["INSERT", "MODIFY"]:
-                user = record["dynamodb"]["NewImage"]["user"]["S"]
-                if user not in user_records:
-                    user_records[user] = []
-                user_records[user].append(record)
-
-        # Process each user and update their row
-        for user, records in user_records.items():
-            consolidated_data = consolidate_aggregate(user, records)
-            update_aggregate(user, consolidated_data)
-
-        return {
-            "statusCode": 200,
-            "body": "Aggregates updated successfully",
-        }
+    records = event.get("Records", [])
+    logger.info(f"Received {len(records)} stream records")
+    add_count("StreamRecords", len(records))
 
-    except Exception as e:
-        logger.error("Error processing stream event: %s", e, exc_info=True)
-        return {
-            "statusCode": 500,
-            "body": f"Error: {str(e)}",
-        }
+    # Group records by user, keeping shard order within each user
+    user_records = {}
+    for record in records:
+        user = record["dynamodb"]["Keys"]["user"]["S"]
+        user_records.setdefault(user, []).append(record)
+
+    checkpoints = get_checkpoints(user_records)
+
+    # Personal records are rebuilt from every record in the batch, including
+    # ones the checkpoint skips, so a batch retried after a failure finishes them
+    changes = {}
+    for user, records in user_records.items():
+        aliases = get_aliases(user, checkpoints.get(user, {}).get("aliases_version"))
+        changes[user] = (aliases, *record_changes(records, aliases))
+    record_keys = [
+        {"user": user, "exercise_name": record_row(exercise_name)}
+        for user, (_, _, _, touched) in changes.items()
+        for exercise_name in sorted(touched)
+    ]
+    record_rows = {}
+    for item in batch_get_rows(record_keys):
+        record_rows.setdefault(item["user"], {})[item["exercise_name"][len(RECORD_PREFIX):]] = item
+
+    failures = []
+    for user, records in user_records.items():
+        try:
+            applied = apply_user_records(user, records, checkpoints.get(user, {}))
+            logger.info(f"Applied {applied} of {len(records)} records for user: {user}")
+            aliases, best, final, touched = changes[user]
+            update_personal_records(user, best, final, touched, record_rows.get(user, {}), aliases)
+        except Exception as e:
+            logger.error(f"Failed to apply records for user {user}: {e}", exc_info=True)
+            failures.append({"itemIdentifier": records[0]["dynamodb"]["SequenceNumber"]})
+
+    add_count("FailedUsers", len(failures))
+    return {"batchItemFailures": failures}
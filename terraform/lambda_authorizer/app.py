@@ -1,54 +1,289 @@
+import base64
+import hmac
 import json
 import logging
 import os
+import re
+import time
+import urllib.request
+from collections import OrderedDict
 
-import boto3
+from fitness_common import validate_user_email
+from fitness_data import LazyClient
+from fitness_metrics import add_count, instrument_handler, phase, set_property
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-secrets_manager = boto3.client("secretsmanager")
+secrets_manager = LazyClient("secretsmanager")
+
+# Seconds a fetched API key is trusted before Secrets Manager is consulted again
+SECRET_CACHE_TTL = int(os.environ.get("API_KEY_CACHE_TTL", "300"))
+# Minimum seconds between forced refreshes triggered by a mismatched key, so
+# a stream of bad keys can't turn into a stream of Secrets Manager calls
+SECRET_MIN_REFRESH_INTERVAL = int(os.environ.get("API_KEY_MIN_REFRESH_INTERVAL", "30"))
+
+# Firebase ID tokens are verified when a project is configured, and then
+# requests with the web key must carry one: that key ships in the site's
+# JavaScript. Only the mobile apps' key, MOBILE_API_KEY in the secret, still
+# identifies the user with x-user-email, until the apps send tokens too.
+FIREBASE_PROJECT_ID = os.environ.get("FIREBASE_PROJECT_ID", "")
+REQUIRE_ID_TOKEN = bool(FIREBASE_PROJECT_ID) and os.environ.get("REQUIRE_ID_TOKEN", "true").lower() == "true"
+FIREBASE_JWKS_URL = os.environ.get(
+    "FIREBASE_JWKS_URL", "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+)
+# Used when the key response has no Cache-Control max-age
+SIGNING_KEYS_DEFAULT_TTL = 3600
+# Minimum seconds between refreshes triggered by an unknown key id
+SIGNING_KEYS_MIN_REFRESH_INTERVAL = int(os.environ.get("SIGNING_KEYS_MIN_REFRESH_INTERVAL", "60"))
+SIGNING_KEYS_FETCH_TIMEOUT = 3
+# Verified tokens kept per container, each until it expires
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "1024"))
+# Seconds of clock skew allowed on iat and auth_time
+TOKEN_CLOCK_SKEW = 60
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+_secret_cache = {"value": None, "fetched_at": 0.0}
+_signing_keys = {"keys": {}, "expires_at": 0.0, "fetched_at": 0.0}
+_token_cache = OrderedDict()
+
+
+class AuthenticationError(Exception):
+    """The request has a valid API key but no acceptable user identity"""
 
 
 def get_secret(secret_name):
+    """The API keys in the secret, as client -> key; the mobile one is optional"""
     try:
         response = secrets_manager.get_secret_value(SecretId=secret_name)
         secret = json.loads(response["SecretString"])
-        return secret["API_KEY"]
+        keys = {"web": secret["API_KEY"], "mobile": secret.get("MOBILE_API_KEY", "")}
+        return {client: key for client, key in keys.items() if key.strip()}
     except Exception as e:
         logger.error(f"Error fetching secret: {e}")
         raise ValueError("Failed to retrieve API key secret")
 
 
-def lambda_handler(event, context):
-    logger.info("Received event: %s", json.dumps(event))
+def get_cached_secret(secret_name, force_refresh=False):
+    """Return the API keys, fetching them only when the cached copy is missing or stale"""
+    now = time.monotonic()
+    age = now - _secret_cache["fetched_at"]
+
+    if _secret_cache["value"] is not None:
+        if not force_refresh and age < SECRET_CACHE_TTL:
+            return _secret_cache["value"]
+        if force_refresh and age < SECRET_MIN_REFRESH_INTERVAL:
+            return _secret_cache["value"]
+
+    with phase("get_secret"):
+        _secret_cache["value"] = get_secret(secret_name)
+    _secret_cache["fetched_at"] = now
+    return _secret_cache["value"]
+
+
+def keys_match(client_key, api_key_secret):
+    """Compare the client key against the secret in constant time"""
+    return hmac.compare_digest(
+        client_key.strip().encode("utf-8"),
+        api_key_secret.strip().encode("utf-8"),
+    )
+
+
+def matching_client(client_key, api_keys):
+    """Which client's key the request carries, or None"""
+    # Every key is compared, so the time taken doesn't tell which one matched
+    matches = [client for client, api_key in api_keys.items() if keys_match(client_key, api_key)]
+    return matches[0] if matches else None
+
+
+def b64url_decode(segment):
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def fetch_signing_keys():
+    """Firebase's RSA public keys as kid -> public key, and how many seconds they may be cached"""
+    # cryptography comes from its own layer; requests without a token never import it
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+
+    with urllib.request.urlopen(FIREBASE_JWKS_URL, timeout=SIGNING_KEYS_FETCH_TIMEOUT) as response:
+        jwks = json.loads(response.read())
+        max_age = MAX_AGE_PATTERN.search(response.headers.get("Cache-Control", ""))
+    keys = {
+        key["kid"]: RSAPublicNumbers(
+            int.from_bytes(b64url_decode(key["e"]), "big"), int.from_bytes(b64url_decode(key["n"]), "big")
+        ).public_key()
+        for key in jwks["keys"] if key.get("kty") == "RSA"
+    }
+    return keys, int(max_age.group(1)) if max_age else SIGNING_KEYS_DEFAULT_TTL
+
+
+def get_signing_key(kid):
+    """
+    Return the public key for kid from the container's copy of the key set.
+
+    The set is fetched again once its Cache-Control max-age runs out, or when
+    a token names a key it doesn't hold (Google rotates keys ahead of use),
+    but at most every SIGNING_KEYS_MIN_REFRESH_INTERVAL seconds for the latter.
+    If a refresh fails the keys already held are kept.
+    """
+    now = time.monotonic()
+    expired = now >= _signing_keys["expires_at"]
+    unknown = kid not in _signing_keys["keys"]
+    if expired or (unknown and now - _signing_keys["fetched_at"] >= SIGNING_KEYS_MIN_REFRESH_INTERVAL):
+        try:
+            with phase("fetch_signing_keys"):
+                keys, max_age = fetch_signing_keys()
+            _signing_keys.update(keys=keys, expires_at=now + max_age, fetched_at=now)
+        except Exception as e:
+            logger.error(f"Error fetching signing keys: {e}")
+            if not _signing_keys["keys"]:
+                raise
+    key = _signing_keys["keys"].get(kid)
+    if key is None:
+        raise AuthenticationError("Unknown signing key")
+    return key
+
+
+def rsa_sha256_verify(message, signature, key):
+    """RSASSA-PKCS1-v1_5 verification with SHA-256"""
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
 
+    try:
+        key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+    except InvalidSignature:
+        return False
+    return True
+
+
+def verify_id_token(token):
+    """Check a Firebase ID token's signature and claims and return its claims"""
+    try:
+        header_segment, payload_segment, signature_segment = token.split(".")
+        header = json.loads(b64url_decode(header_segment))
+        claims = json.loads(b64url_decode(payload_segment))
+        signature = b64url_decode(signature_segment)
+        message = f"{header_segment}.{payload_segment}".encode("ascii")
+    except ValueError:
+        raise AuthenticationError("Malformed token")
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise AuthenticationError("Malformed token")
+    if header.get("alg") != "RS256" or not isinstance(header.get("kid"), str):
+        raise AuthenticationError("Unexpected token header")
+
+    key = get_signing_key(header["kid"])
+    if not rsa_sha256_verify(message, signature, key):
+        raise AuthenticationError("Bad signature")
+
+    now = time.time()
+    if claims.get("aud") != FIREBASE_PROJECT_ID:
+        raise AuthenticationError("Wrong audience")
+    if claims.get("iss") != f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}":
+        raise AuthenticationError("Wrong issuer")
+    if not isinstance(claims.get("exp"), (int, float)) or claims["exp"] <= now:
+        raise AuthenticationError("Token expired")
+    for claim in ("iat", "auth_time"):
+        if not isinstance(claims.get(claim), (int, float)) or claims[claim] > now + TOKEN_CLOCK_SKEW:
+            raise AuthenticationError(f"Bad {claim}")
+    if not isinstance(claims.get("sub"), str) or not 0 < len(claims["sub"]) <= 128:
+        raise AuthenticationError("Bad subject")
+    if not claims.get("email") or claims.get("email_verified") is not True:
+        raise AuthenticationError("No verified email")
+    return claims
+
+
+def get_token_user(token):
+    """
+    Return (email, uid) for a Firebase ID token.
+
+    Verified tokens are kept in an LRU until they expire, so a client
+    reusing its token (the SDK refreshes it hourly) is checked once per
+    container instead of on every request.
+    """
+    cached = _token_cache.get(token)
+    if cached and cached[0] > time.time():
+        _token_cache.move_to_end(token)
+        set_property("token_cache", "hit")
+        return cached[1], cached[2]
+
+    set_property("token_cache", "miss")
+    with phase("verify_token"):
+        claims = verify_id_token(token)
+    try:
+        email = validate_user_email(claims["email"])
+    except ValueError as e:
+        raise AuthenticationError(str(e))
+    _token_cache[token] = (claims["exp"], email, claims["sub"])
+    _token_cache.move_to_end(token)
+    while len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+    return email, claims["sub"]
+
+
+def bearer_token(headers):
+    authorization = headers.get("authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        return authorization[7:].strip()
+    return None
+
+
+def request_identity(headers, client):
+    """
+    The authorizer context for a request with a valid API key of client.
+
+    A Firebase ID token, when present, decides the user and must be valid.
+    Without one the user is whatever x-user-email says, which only the
+    mobile key may rely on while ID tokens are required.
+    """
+    token = bearer_token(headers) if FIREBASE_PROJECT_ID else None
+    if token:
+        email, uid = get_token_user(token)
+        return {"user": email, "uid": uid, "auth": "firebase"}
+    if REQUIRE_ID_TOKEN and client != "mobile":
+        raise AuthenticationError("ID token required")
+    user_email = headers.get("x-user-email", "")
+    try:
+        return {"user": validate_user_email(user_email) if user_email else "", "auth": "api_key"}
+    except ValueError as e:
+        raise AuthenticationError(str(e))
+
+
+@instrument_handler("lambda_authorizer")
+def lambda_handler(event, context):
     try:
         secret_name = os.environ.get("API_KEY_SECRET")
         if not secret_name:
             logger.error("Missing environment variable: API_KEY_SECRET")
             raise ValueError("API_KEY_SECRET environment variable is not set")
 
-        api_key_secret = get_secret(secret_name)
-
         headers = event.get("headers", {})
         client_key = headers.get("x-api-key")
 
-        if client_key and client_key.strip() == api_key_secret.strip():
+        client = None
+        if client_key:
+            client = matching_client(client_key, get_cached_secret(secret_name))
+            if client is None:
+                # The key may have been rotated since it was cached
+                client = matching_client(client_key, get_cached_secret(secret_name, force_refresh=True))
+
+        if client:
+            identity = request_identity(headers, client)
             logger.info("Authorization succeeded")
-            # Extract user from headers if available
-            headers = event.get("headers", {})
-            user_email = headers.get("x-user-email", "")
-            
+            set_property("auth", identity["auth"])
+            set_property("client", client)
             return {
                 "isAuthorized": True,
-                "context": {
-                    "user": user_email
-                }
+                "context": identity
             }
         else:
             logger.info("Authorization failed")
             return {"isAuthorized": False}
+    except AuthenticationError as e:
+        logger.info(f"Authorization failed: {e}")
+        add_count("RejectedIdentities")
+        return {"isAuthorized": False}
     except Exception as e:
         logger.exception("Unexpected error in authorizer")
         return {"isAuthorized": False}
@@ -1,14 +1,207 @@
-import boto3
+import hashlib
 import json
 import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from fitness_common import GOAL_ANNUAL_VOLUME, authorizer_context, validate_user_email
+from fitness_data import DynamoDBClient, LazyClient
+from fitness_metrics import instrument_handler, phase, propagate, set_property
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
-def lambda_handler(event, context):
-    bedrock_client = boto3.client('bedrock-runtime')
+MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+
+# Seconds a generated plan is served from the cache before DynamoDB expires it
+PLAN_CACHE_TTL = int(os.environ.get("PLAN_CACHE_TTL", "86400"))
+# A plan still marked as generating after this many seconds belongs to an
+# invocation that died, so the next request may take it over
+GENERATION_STALE_SECONDS = int(os.environ.get("GENERATION_STALE_SECONDS", "90"))
+# Seconds a request that finds the plan being generated, with no text yet, is told to wait
+GENERATION_RETRY_AFTER = int(os.environ.get("GENERATION_RETRY_AFTER", "2"))
+# While streaming, the partial plan is written back every this many characters
+STREAM_FLUSH_CHARS = int(os.environ.get("STREAM_FLUSH_CHARS", "400"))
+# Stop reading the stream this long before the Lambda timeout and keep what arrived
+STREAM_DEADLINE_MARGIN_MS = int(os.environ.get("STREAM_DEADLINE_MARGIN_MS", "3000"))
+
+# Rough budget for the personalized part of the prompt (about 4 characters a token)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "300"))
+CHARS_PER_TOKEN = 4
+TOP_EXERCISES = 5
+RECENT_DAYS = 14
+RECENT_WEEKS = 4
+CONTEXT_CACHE_SIZE = int(os.environ.get("CONTEXT_CACHE_SIZE", "256"))
+
+# Aggregate rows maintained by lambda_aggregate, and the rollup counter prefix
+SUMMARY_ROW = "total_lifted"
+VERSION_ROW = "#version"
+VOLUME_PREFIX = "volume:"
+
+# Created once per container, on first use, instead of on every invocation.
+# Context reads run on worker threads, which share the low-level client.
+bedrock_client = LazyClient('bedrock-runtime')
+dynamodb_client = DynamoDBClient()
+plans_table = dynamodb_client.Table(os.environ['PLANS_TABLE'])
+aggregates_table_name = os.environ['AGGREGATES_TABLE']
+rollups_table_name = os.environ['ROLLUPS_TABLE']
+context_executor = ThreadPoolExecutor(max_workers=4)
+
+# Compact context per user, reused until their data version or the date changes
+_context_cache = OrderedDict()
+
+
+def get_request_user(event):
+    """The user the plan is for, or None for the generic plan"""
+    authorizer_user = authorizer_context(event).get('user')
+    user = authorizer_user or (event.get('headers') or {}).get('x-user-email')
+    return validate_user_email(user) if user else None
+
+
+def get_version(user):
+    response = dynamodb_client.get_item(
+        TableName=aggregates_table_name,
+        Key={'user': user, 'exercise_name': VERSION_ROW},
+        ProjectionExpression='version'
+    )
+    return response.get('Item', {}).get('version', 0)
+
+
+def get_summary(user):
+    response = dynamodb_client.get_item(
+        TableName=aggregates_table_name,
+        Key={'user': user, 'exercise_name': SUMMARY_ROW},
+        ProjectionExpression='exercise_data, total_volume'
+    )
+    return response.get('Item', {})
+
+
+def get_rollup(user, bucket):
+    response = dynamodb_client.get_item(TableName=rollups_table_name, Key={'user': user, 'bucket': bucket})
+    return response.get('Item', {})
+
+
+def query_rollups(user, first_bucket, last_bucket):
+    items = []
+    query_kwargs = {
+        'TableName': rollups_table_name,
+        'KeyConditionExpression': '#user = :user AND #bucket BETWEEN :first AND :last',
+        'ExpressionAttributeNames': {'#user': 'user', '#bucket': 'bucket'},
+        'ExpressionAttributeValues': {':user': user, ':first': first_bucket, ':last': last_bucket}
+    }
+    while True:
+        response = dynamodb_client.query(**query_kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def week_bucket(day):
+    return "week#{0}-W{1:02d}".format(*day.isocalendar())
 
-    messages = [
+
+def rollup_volumes(item):
+    return {
+        attribute[len(VOLUME_PREFIX):]: value
+        for attribute, value in item.items()
+        if attribute.startswith(VOLUME_PREFIX) and value > 0
+    }
+
+
+def top_names(volumes, count=TOP_EXERCISES):
+    ranked = sorted(volumes.items(), key=lambda entry: entry[1], reverse=True)[:count]
+    return ", ".join(f"{name} {value:,.0f}" for name, value in ranked)
+
+
+def build_context(user, today):
+    """
+    Summarize the user's training for the prompt, most useful lines first.
+
+    The summary row and the rollups are read concurrently, with the reads
+    still counted towards the invocation's metrics. Lines are added until
+    the token budget is spent.
+    """
+    summary_future = context_executor.submit(propagate(get_summary), user)
+    year_future = context_executor.submit(propagate(get_rollup), user, f"year#{today.year}")
+    days_future = context_executor.submit(
+        propagate(query_rollups), user, f"day#{today - timedelta(days=RECENT_DAYS - 1)}", f"day#{today}"
+    )
+    weeks_future = context_executor.submit(
+        propagate(query_rollups), user, week_bucket(today - timedelta(weeks=RECENT_WEEKS - 1)), week_bucket(today)
+    )
+    summary = summary_future.result()
+    year = year_future.result()
+    days = [day for day in days_future.result() if day.get('total_volume', 0) > 0]
+    weeks = weeks_future.result()
+
+    lines = []
+    year_total = year.get('total_volume', Decimal('0'))
+    day_of_year = today.timetuple().tm_yday
+    days_in_year = (today.replace(month=12, day=31) - today.replace(month=1, day=1)).days + 1
+    projected = year_total / day_of_year * days_in_year
+    needed_per_day = max(GOAL_ANNUAL_VOLUME - year_total, 0) / max(days_in_year - day_of_year, 1)
+    lines.append(
+        f"Year to date: {year_total:,.0f} lbs of the {GOAL_ANNUAL_VOLUME:,.0f} lb goal, "
+        f"on pace for {projected:,.0f} lbs; needs {needed_per_day:,.0f} lbs/day for the rest of the year."
+    )
+    if weeks:
+        lines.append("Weekly volume: " + "; ".join(
+            f"{week['bucket'].split('#', 1)[1]} {week.get('total_volume', 0):,.0f} lbs" for week in weeks
+        ))
+    if days:
+        last = days[-1]
+        lines.append(
+            f"Trained {len(days)} of the last {RECENT_DAYS} days. Last session {last['bucket'].split('#', 1)[1]}: "
+            f"{last.get('total_volume', 0):,.0f} lbs ({top_names(rollup_volumes(last), 3)})."
+        )
+        recent = {}
+        for day in days:
+            for name, value in rollup_volumes(day).items():
+                recent[name] = recent.get(name, Decimal('0')) + value
+        lines.append(f"Most trained in the last {RECENT_DAYS} days (lbs): {top_names(recent)}.")
+    exercise_data = summary.get('exercise_data', {})
+    if exercise_data:
+        lifetime = {name: totals.get('total_volume', 0) for name, totals in exercise_data.items()}
+        lines.append(f"Top exercises by total volume (lbs): {top_names(lifetime)}.")
+
+    budget = CONTEXT_TOKEN_BUDGET * CHARS_PER_TOKEN
+    context_lines = []
+    for line in lines:
+        if len(line) + 3 > budget:
+            break
+        context_lines.append(f"- {line}")
+        budget -= len(line) + 3
+    return "\n".join(context_lines)
+
+
+def get_context(user):
+    """Return the user's prompt context, rebuilding it when their data version or the date moved"""
+    # The recent windows and the goal pace move with the date, not just with new data
+    stamp = (get_version(user), datetime.now(timezone.utc).date())
+    cached = _context_cache.get(user)
+    if cached and cached[0] == stamp:
+        _context_cache.move_to_end(user)
+        return cached[1]
+
+    context_text = build_context(user, stamp[1])
+    _context_cache[user] = (stamp, context_text)
+    _context_cache.move_to_end(user)
+    while len(_context_cache) > CONTEXT_CACHE_SIZE:
+        _context_cache.popitem(last=False)
+    return context_text
+
+
+def build_messages(context_text=None):
+    personalization = (
+        f"Recent training data for this person:\n{context_text}\n"
+        "Use it to balance the workout against what was trained recently and the pace toward the goal.\n\n"
+    ) if context_text else ""
+    return [
         {
             "role": "user",
             "content": (
@@ -18,6 +211,7 @@ def lambda_handler(event, context):
                 "Goal: Improve mobility, especially hips and shoulders, and achieve 15 million lbs total volume this year (~40,000 lbs/day). "
                 "Preferences: Perform 2-4 exercises per workout in rounds (same exercises repeated each round). Each workout should include at least one barbell and one bodyweight exercise. "
                 "Workout duration: ~45 minutes, including warmup and cooldown.\n\n"
+                f"{personalization}"
                 "Please provide a workout plan structured with the following sections:\n"
                 "- Warmup: Include exercises to prepare for the main workout.\n"
                 "- Main Workout: Specify exercises, sets, reps, and weights.\n"
@@ -28,30 +222,215 @@ def lambda_handler(event, context):
         }
     ]
 
+
+def build_request_body(messages):
+    return json.dumps({
+        "messages": messages,
+        "max_tokens": 1024,
+        "temperature": 0.7,
+        "anthropic_version": "bedrock-2023-05-31"
+    }, sort_keys=True)
+
+
+def plan_cache_key(request_body):
+    """Cache key for a model request: a hash of model and body, plus today's date"""
+    prompt_hash = hashlib.sha256(f"{MODEL_ID}\n{request_body}".encode('utf-8')).hexdigest()
+    return f"{prompt_hash}#{datetime.now(timezone.utc).date().isoformat()}"
+
+
+def get_cached_plan(cache_key):
+    item = plans_table.get_item(Key={'cache_key': cache_key}).get('Item')
+    if item and item.get('expires_at', 0) > time.time():
+        return item
+    return None
+
+
+def claim_generation(cache_key):
+    """
+    Mark the plan as generating so concurrent requests don't call the model too.
+
+    Returns False when another live invocation is already generating it.
+    """
+    now = int(time.time())
     try:
-        logger.info("Sending messages to Bedrock model")
-        response = bedrock_client.invoke_model(
-            modelId="anthropic.claude-3-5-sonnet-20240620-v1:0",
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps({
-                "messages": messages,
-                "max_tokens": 1024,
-                "temperature": 0.7,
-                "anthropic_version": "bedrock-2023-05-31"
-            })
+        plans_table.put_item(
+            Item={
+                'cache_key': cache_key,
+                'status': 'generating',
+                'text': '',
+                'updated_at': now,
+                'expires_at': now + PLAN_CACHE_TTL
+            },
+            ConditionExpression='attribute_not_exists(cache_key) OR (#status <> :complete AND updated_at < :stale)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':complete': 'complete', ':stale': now - GENERATION_STALE_SECONDS}
         )
+        return True
+    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+        return False
 
-        response_body = json.loads(response['body'].read().decode('utf-8'))
-        output = response_body.get('content', 'No response from the model')
-        logger.info("Received response from model")
 
+def release_claim(cache_key):
+    """
+    Give up a claim whose generation failed, so the next request claims it at once.
+
+    The placeholder is marked failed with updated_at 0, which claim_generation
+    treats as stale; a plan another invocation completed meanwhile is kept.
+    """
+    try:
+        plans_table.update_item(
+            Key={'cache_key': cache_key},
+            UpdateExpression='SET #status = :failed, updated_at = :zero',
+            ConditionExpression='attribute_exists(cache_key) AND #status <> :complete',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':failed': 'failed', ':zero': 0, ':complete': 'complete'}
+        )
+    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+        pass
+    except Exception:
+        logger.error("Failed to release the claim on %s", cache_key, exc_info=True)
+
+
+def store_plan(cache_key, text, status):
+    now = int(time.time())
+    plans_table.update_item(
+        Key={'cache_key': cache_key},
+        UpdateExpression='SET #text = :text, #status = :status, updated_at = :now, expires_at = :expires_at',
+        ExpressionAttributeNames={'#text': 'text', '#status': 'status'},
+        ExpressionAttributeValues={':text': text, ':status': status, ':now': now, ':expires_at': now + PLAN_CACHE_TTL}
+    )
+
+
+def generate_plan(request_body):
+    """Invoke the model and wait for the whole completion"""
+    response = bedrock_client.invoke_model(
+        modelId=MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=request_body
+    )
+    response_body = json.loads(response['body'].read().decode('utf-8'))
+    return "".join(block.get('text', '') for block in response_body.get('content', []))
+
+
+def stream_plan_chunks(request_body):
+    """Yield the completion's text deltas as the model produces them"""
+    response = bedrock_client.invoke_model_with_response_stream(
+        modelId=MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=request_body
+    )
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        payload = json.loads(chunk['bytes'])
+        if payload.get('type') == 'content_block_delta':
+            text = payload.get('delta', {}).get('text')
+            if text:
+                yield text
+
+
+def stream_plan(request_body, cache_key, context):
+    """
+    Read the streamed completion, writing the partial plan back as it grows.
+
+    Requests that arrive meanwhile are answered with the partial plan rather
+    than a second model call. Returns (text, complete); reading stops early
+    when the invocation is about to time out.
+    """
+    parts = []
+    unflushed = 0
+    for text in stream_plan_chunks(request_body):
+        parts.append(text)
+        unflushed += len(text)
+        if unflushed >= STREAM_FLUSH_CHARS:
+            store_plan(cache_key, "".join(parts), 'generating')
+            unflushed = 0
+        if context is not None and context.get_remaining_time_in_millis() < STREAM_DEADLINE_MARGIN_MS:
+            logger.warning("Stopping the stream before the Lambda timeout")
+            return "".join(parts), False
+    return "".join(parts), True
+
+
+def generating_response():
+    """Another request is generating the plan and has no text yet; ask the client to come back"""
+    return {
+        'statusCode': 202,
+        'headers': {'Retry-After': str(GENERATION_RETRY_AFTER)},
+        'body': json.dumps({
+            'status': 'generating',
+            'retry_after': GENERATION_RETRY_AFTER
+        })
+    }
+
+
+def plan_response(text, complete, cached):
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'workout_plan': [{'type': 'text', 'text': text}],
+            'complete': complete,
+            'cached': cached
+        })
+    }
+
+
+@instrument_handler('lambda_bedrock')
+def lambda_handler(event, context):
+    event = event or {}
+    params = event.get('queryStringParameters') or {}
+    stream = params.get('stream', '').lower() in ('1', 'true')
+    set_property('stream', stream)
+
+    try:
+        user = get_request_user(event)
+    except ValueError as e:
+        logger.warning("Validation error: %s", e)
         return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'workout_plan': output
-            })
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)})
         }
+
+    try:
+        context_text = None
+        if user:
+            try:
+                with phase('context'):
+                    context_text = get_context(user)
+            except Exception:
+                # A plan without personalization beats no plan
+                logger.error("Failed to build context for user %s", user, exc_info=True)
+        request_body = build_request_body(build_messages(context_text))
+        cache_key = plan_cache_key(request_body)
+
+        cached = get_cached_plan(cache_key)
+        if cached and cached.get('status') == 'complete':
+            logger.info("Serving cached workout plan")
+            return plan_response(cached['text'], True, True)
+
+        if not claim_generation(cache_key):
+            logger.info("Workout plan is being generated by another request")
+            cached = get_cached_plan(cache_key) or {}
+            if not cached.get('text'):
+                return generating_response()
+            return plan_response(cached['text'], cached.get('status') == 'complete', True)
+
+        logger.info("Sending messages to Bedrock model (stream=%s)", stream)
+        try:
+            with phase('model'):
+                if stream:
+                    text, complete = stream_plan(request_body, cache_key, context)
+                else:
+                    text, complete = generate_plan(request_body), True
+            store_plan(cache_key, text, 'complete' if complete else 'generating')
+        except Exception:
+            release_claim(cache_key)
+            raise
+        logger.info("Received response from model")
+
+        return plan_response(text, complete, False)
     except Exception as e:
         logger.error("Error occurred while invoking the model", exc_info=True)
         return {
@@ -1,74 +1,708 @@
+import base64
+import gzip
 import json
 import logging
 import os
-import re
-from decimal import Decimal
-import boto3
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from fitness_common import (
+    GOAL_ANNUAL_VOLUME, MAX_EXERCISE_NAME_LENGTH, authorizer_context, dumps, validate_user_email,
+)
+from fitness_data import DynamoDBClient, LazyClient
+from fitness_metrics import instrument_handler, phase, sampled, set_property
+from fitness_records import RECORD_METRICS, RECORD_PREFIX, records_from_items
+from fitness_suggest import ExerciseIndex
+from fitness_sync import CHANGE_SEQUENCE, CHANGES_INDEX, SETTLE_SECONDS, change_sequence
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource("dynamodb")
-aggregates_table = dynamodb.Table(os.environ["AGGREGATES_TABLE"])
+dynamodb_client = DynamoDBClient()
+aggregates_table = dynamodb_client.Table(os.environ["AGGREGATES_TABLE"])
+rollups_table = dynamodb_client.Table(os.environ["ROLLUPS_TABLE"])
+raw_data_table = dynamodb_client.Table(os.environ["RAW_DATA_TABLE"])
+aliases_table = dynamodb_client.Table(os.environ["ALIASES_TABLE"])
+s3 = LazyClient("s3")
+
+# History exports are written here and handed out as presigned links valid this many seconds
+EXPORT_BUCKET = os.environ.get("EXPORT_BUCKET", "")
+EXPORT_LINK_TTL = int(os.environ.get("EXPORT_LINK_TTL", "3600"))
+# Bytes of gzip per multipart upload part; S3 needs at least 5 MiB for all but the last
+EXPORT_PART_SIZE = int(os.environ.get("EXPORT_PART_SIZE", str(8 * 1024 * 1024)))
+
+# Row holding total_lifted plus the exercise_data summary lambda_aggregate
+# keeps current, so a dashboard load is a single GetItem
+SUMMARY_ROW = "total_lifted"
+# Small row holding the user's data version, bumped by lambda_aggregate
+VERSION_ROW = "#version"
+
+# Serialized responses kept per warm container, keyed by user (and mode
+# where it isn't the summary) and checked against the data version before
+# they are reused
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+_response_cache = OrderedDict()
+
+# Rollup buckets lambda_aggregate maintains, and how a date maps to each
+ROLLUP_GRANULARITIES = {
+    "day": lambda date: date.isoformat(),
+    "week": lambda date: "{0}-W{1:02d}".format(*date.isocalendar()),
+    "month": lambda date: date.strftime("%Y-%m"),
+    "year": lambda date: date.strftime("%Y"),
+}
+VOLUME_PREFIX = "volume:"
+REPS_PREFIX = "reps:"
+MAX_RANGE_DAYS = 3660
+# Earliest year the analytics mode accepts
+FIRST_ANALYTICS_YEAR = 2020
 
+# Changed items read per table for one sync; more than any single write stamps
+# alike, so a cut between two stamps always moves the cursor on
+SYNC_MAX_ITEMS = int(os.environ.get("SYNC_MAX_ITEMS", "500"))
+# What a sync sends of each item; the indexes project just these
+SYNC_DAY_ATTRIBUTES = ("date", "version", "total_volume", "exercise_volumes", "exercise_reps")
+SYNC_AGGREGATE_ATTRIBUTES = (
+    "exercise_name", "total_volume", "total_reps",
+    *(attribute for metric in RECORD_METRICS for attribute in (metric, f"{metric}_date")),
+)
+# Smaller bodies aren't worth compressing
+GZIP_MIN_BYTES = 1024
 
-def validate_user_email(email):
-    """Validate user email format"""
-    if not email or not isinstance(email, str):
-        raise ValueError("User email is required and must be a string")
-    
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    if not re.match(email_pattern, email):
-        raise ValueError("Invalid email format")
-    
-    if len(email) > 254:  # RFC 5321 limit
-        raise ValueError("Email address too long")
-    
-    return email.strip().lower()
+# Typeahead indexes kept per warm container, keyed by user, with the data
+# version each one is current to
+SUGGEST_CACHE_SIZE = int(os.environ.get("SUGGEST_CACHE_SIZE", "64"))
+_suggest_cache = OrderedDict()
+SUGGEST_ATTRIBUTES = ("exercise_name", "total_reps")
+DEFAULT_SUGGESTIONS = 8
+MAX_SUGGESTIONS = 25
 
 
 def get_authenticated_user(event):
-    """Extract and validate the authenticated user from the request"""
-    headers = event.get('headers', {})
-    
-    # First try to get user from headers (this is what we're actually using)
-    user = headers.get('x-user-email')
+    """Extract the authenticated user from the request"""
+    # lambda_authorizer already validated the user, from the Firebase ID token if there was one
+    authorizer_user = authorizer_context(event).get('user')
+    if authorizer_user:
+        return authorizer_user
+
+    # Invoked without the authorizer
+    user = (event.get('headers') or {}).get('x-user-email')
     if user:
         return validate_user_email(user)
-    
-    # Fallback: check if user is in authorizer context
-    if 'requestContext' in event and 'authorizer' in event['requestContext']:
-        authorizer_user = event['requestContext']['authorizer'].get('user')
-        if authorizer_user:
-            return validate_user_email(authorizer_user)
-    
+
     raise ValueError("User authentication required")
 
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
+def get_summary(user_email, consistent=False):
+    """Read the user's summary row, projecting only the fields the dashboard needs"""
+    try:
+        response = aggregates_table.get_item(
+            Key={"user": str(user_email), "exercise_name": SUMMARY_ROW},
+            ProjectionExpression="exercise_data, total_volume, last_sequence, version",
+            ConsistentRead=consistent,
+        )
+        return response.get("Item")
+    except Exception as e:
+        logger.error(f"Error reading summary for user: {user_email}: {e}")
+        raise
 
 
 def query_aggregates_by_user(user_email):
+    """Read every aggregate row of the user, following LastEvaluatedKey"""
     try:
-        response = aggregates_table.query(
-            KeyConditionExpression="#user = :user",
-            ExpressionAttributeNames={"#user": "user"},
-            ExpressionAttributeValues={":user": str(user_email)},
-        )
-        return response.get("Items", [])
+        items = []
+        query_kwargs = {
+            "KeyConditionExpression": "#user = :user",
+            "ExpressionAttributeNames": {"#user": "user"},
+            "ExpressionAttributeValues": {":user": str(user_email)},
+            "ProjectionExpression": "exercise_name, total_volume, total_reps",
+            "ConsistentRead": True,
+        }
+        while True:
+            response = aggregates_table.query(**query_kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
     except Exception as e:
         logger.error(f"Error querying aggregates table for user: {user_email}: {e}")
         raise
 
 
-def lambda_handler(event, context):
+def build_exercise_data(items):
+    """Rebuild exercise_data and total_lifted from the per-exercise rows"""
+    exercise_data = {}
+    total_lifted = 0
+
+    for item in items:
+        try:
+            exercise_name = item["exercise_name"]
+            total_volume = item.get("total_volume", 0)
+            total_reps = item.get("total_reps", 0)
+
+            if exercise_name == SUMMARY_ROW:
+                total_lifted = total_volume
+            elif exercise_name.startswith("#"):
+                continue
+            else:
+                exercise_data[exercise_name] = {
+                    "total_volume": total_volume,
+                    "total_reps": total_reps,
+                }
+        except KeyError as e:
+            logger.error(f"Missing key in item: {item}. Error: {e}")
+        except TypeError as e:
+            logger.error(f"Invalid item structure: {item}. Error: {e}")
+
+    return exercise_data, total_lifted
+
+
+def rebuild_summary(user_email, exercise_data, last_sequence):
+    """
+    Store a freshly queried exercise_data summary on the summary row.
+
+    The write only succeeds if lambda_aggregate has not applied anything
+    since last_sequence was read and nobody (scripts/rebuild_aggregates.py)
+    stored a summary in the meantime; otherwise the next read rebuilds it.
+    """
+    values = {":exercise_data": exercise_data}
+    if last_sequence is None:
+        condition = "attribute_not_exists(last_sequence)"
+    else:
+        condition = "last_sequence = :last_sequence"
+        values[":last_sequence"] = last_sequence
+
+    try:
+        aggregates_table.update_item(
+            Key={"user": str(user_email), "exercise_name": SUMMARY_ROW},
+            UpdateExpression="SET exercise_data = :exercise_data",
+            ConditionExpression=f"attribute_exists(total_volume) AND attribute_not_exists(exercise_data) AND {condition}",
+            ExpressionAttributeValues=values,
+        )
+        logger.info(f"Rebuilt summary for user: {user_email}")
+    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+        logger.info(f"Summary for user {user_email} changed while rebuilding; skipped")
+
+
+def load_aggregates(user_email):
+    """
+    Return (exercise_data, total_lifted), or None when the user has no data.
+
+    The summary row answers the common case. Users without one yet go
+    through the full paginated query, which then rebuilds the summary.
+    The summary is read consistently, so it is at least as new as a version
+    row read before it: the version and the summary are bumped together.
+    """
+    summary = get_summary(user_email, consistent=True)
+    if summary and "exercise_data" in summary:
+        return summary["exercise_data"], summary.get("total_volume", 0)
+
+    logger.info(f"No summary for user: {user_email}; querying all aggregate rows")
+    items = query_aggregates_by_user(user_email)
+    if not items:
+        return None
+
+    exercise_data, total_lifted = build_exercise_data(items)
+    if summary:
+        rebuild_summary(user_email, exercise_data, summary.get("last_sequence"))
+    return exercise_data, total_lifted
+
+
+def get_version(user_email):
+    """Read the user's data version from its own small row"""
+    try:
+        response = aggregates_table.get_item(
+            Key={"user": str(user_email), "exercise_name": VERSION_ROW},
+            ProjectionExpression="version",
+        )
+        return response.get("Item", {}).get("version", 0)
+    except Exception as e:
+        logger.error(f"Error reading version for user: {user_email}: {e}")
+        raise
+
+
+def make_etag(version):
+    return f'"v{version}"'
+
+
+def get_cached_response(key, version):
+    """Return the cached serialized body if it was built from this version"""
+    cached = _response_cache.get(key)
+    if cached is None or cached[0] != version:
+        return None
+    _response_cache.move_to_end(key)
+    return cached[1]
+
+
+def cache_response(key, version, body):
+    _response_cache[key] = (version, body)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
+
+def summary_response(user, body_json, event):
+    """Lifetime totals per exercise, with ETag and warm-cache handling"""
+    # A client that already has the current version gets a 304
+    version = get_version(user)
+    headers = event.get("headers") or {}
+    if_none_match = headers.get("if-none-match") or headers.get("If-None-Match")
+    if if_none_match and if_none_match == make_etag(version):
+        logger.info(f"Not modified for user: {user} at version {version}")
+        return {
+            "statusCode": 304,
+            "headers": {"ETag": make_etag(version)},
+            "body": "",
+        }
+
+    body = get_cached_response(user, version)
+    if body is not None:
+        logger.info(f"Serving cached response for user: {user} at version {version}")
+        return {
+            "statusCode": 200,
+            "headers": {"ETag": make_etag(version)},
+            "body": body,
+        }
+
+    # Read the user's aggregates from DynamoDB
+    aggregates = load_aggregates(user)
+    if aggregates is None:
+        logger.info(f"No data found for user: {user}")
+        return {
+            "statusCode": 404,
+            "body": json.dumps({"error": f"No data found for user: {user}"}),
+        }
+    exercise_data, total_lifted = aggregates
+
+    # Build the response
+    response_body = {
+        "user": user,
+        "exercise_data": exercise_data,
+        "total_lifted": total_lifted,
+    }
+
+    # Tag the body with the version read before it; the body can only be
+    # newer, and a client holding it then just reads it once more
+    body = dumps(response_body)
+    if sampled():
+        logger.info(f"Response body: {body}")
+    cache_response(user, version, body)
+
+    return {
+        "statusCode": 200,
+        "headers": {"ETag": make_etag(version)},
+        "body": body,
+    }
+
+
+def range_buckets(body_json):
+    """Validate a range request and return its (granularity, first bucket, last bucket)"""
+    granularity = body_json.get("granularity", "day")
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(f"Unknown granularity. Use one of: {', '.join(ROLLUP_GRANULARITIES)}")
+
+    try:
+        start = datetime.strptime(str(body_json.get("start")), "%Y-%m-%d").date()
+        end = datetime.strptime(str(body_json.get("end")), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("Range start and end are required. Use YYYY-MM-DD")
+    if start > end:
+        raise ValueError("Range start must not be after end")
+    if (end - start).days > MAX_RANGE_DAYS:
+        raise ValueError(f"Range cannot span more than {MAX_RANGE_DAYS} days")
+
+    bucket_of = ROLLUP_GRANULARITIES[granularity]
+    return granularity, f"{granularity}#{bucket_of(start)}", f"{granularity}#{bucket_of(end)}"
+
+
+def query_rollups(user_email, first_bucket, last_bucket):
+    """Read the rollup items between two bucket keys, following LastEvaluatedKey"""
+    try:
+        items = []
+        query_kwargs = {
+            "KeyConditionExpression": "#user = :user AND #bucket BETWEEN :first AND :last",
+            "ExpressionAttributeNames": {"#user": "user", "#bucket": "bucket"},
+            "ExpressionAttributeValues": {":user": str(user_email), ":first": first_bucket, ":last": last_bucket},
+        }
+        while True:
+            response = rollups_table.query(**query_kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except Exception as e:
+        logger.error(f"Error querying rollups table for user: {user_email}: {e}")
+        raise
+
+
+def build_rollup(item):
+    """Turn a rollup item's per-exercise counters back into exercise_data"""
+    exercise_data = {}
+    for attribute, value in item.items():
+        for prefix, field in ((VOLUME_PREFIX, "total_volume"), (REPS_PREFIX, "total_reps")):
+            if attribute.startswith(prefix):
+                totals = exercise_data.setdefault(attribute[len(prefix):], {"total_volume": 0, "total_reps": 0})
+                totals[field] = value
+    return {
+        "bucket": item["bucket"].split("#", 1)[1],
+        "total_volume": item.get("total_volume", 0),
+        "exercise_data": exercise_data,
+    }
+
+
+def range_response(user, body_json, event):
+    """Day, week, month or year totals between two dates, one item per bucket"""
+    granularity, first_bucket, last_bucket = range_buckets(body_json)
+    items = query_rollups(user, first_bucket, last_bucket)
+    logger.info(f"Read {len(items)} {granularity} rollups for user: {user}")
+
+    return {
+        "statusCode": 200,
+        "body": dumps({
+            "user": user,
+            "granularity": granularity,
+            "rollups": [build_rollup(item) for item in items],
+        }),
+    }
+
+
+def query_records(user_email):
+    """Read the user's personal record rows, one per exercise"""
     try:
-        logger.info(f"Received event: {json.dumps(event)}")
+        items = []
+        query_kwargs = {
+            "KeyConditionExpression": "#user = :user AND begins_with(exercise_name, :prefix)",
+            "ExpressionAttributeNames": {"#user": "user"},
+            "ExpressionAttributeValues": {":user": str(user_email), ":prefix": RECORD_PREFIX},
+        }
+        while True:
+            response = aggregates_table.query(**query_kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except Exception as e:
+        logger.error(f"Error querying records for user: {user_email}: {e}")
+        raise
+
+
+def records_response(user, body_json, event):
+    """Heaviest weight, best set volume and best estimated 1RM per exercise, with the dates set"""
+    records = records_from_items(query_records(user))
+    logger.info(f"Read records of {len(records)} exercises for user: {user}")
+
+    return {
+        "statusCode": 200,
+        "body": dumps({"user": user, "records": records}),
+    }
+
+
+def analytics_response(user, body_json, event):
+    """Goal pace, rolling averages, streaks and exercise share trends of one year, from the day rollups"""
+    today = datetime.now(timezone.utc).date()
+    year = body_json.get("year", today.year)
+    if not isinstance(year, int) or not FIRST_ANALYTICS_YEAR <= year <= today.year:
+        raise ValueError(f"Year must be a number from {FIRST_ANALYTICS_YEAR} to {today.year}")
+
+    # Pace moves with the date, so a body is reused for one day at most
+    version = get_version(user)
+    cache_key = f"{user}#analytics#{year}#{today.isoformat()}"
+    body = get_cached_response(cache_key, version)
+    if body is not None:
+        logger.info(f"Serving cached analytics for user: {user} at version {version}")
+        return {"statusCode": 200, "body": body}
+
+    items = query_rollups(user, f"day#{year}-01-01", f"day#{year}-12-31")
+    logger.info(f"Read {len(items)} day rollups of {year} for user: {user}")
+    with phase("analytics"):
+        # NumPy is only imported by requests that need it
+        from fitness_analytics import year_analytics
+
+        analytics = year_analytics(items, year, today, GOAL_ANNUAL_VOLUME)
+    body = dumps({"user": user, **analytics})
+    cache_response(cache_key, version, body)
+
+    return {"statusCode": 200, "body": body}
+
+
+def export_response(user, body_json, event):
+    """The user's whole raw history, one row per set, as a gzip CSV or NDJSON download"""
+    # Only exports need these; keep them off the other modes' cold start
+    from fitness_export import EXPORT_FORMATS, export_history
+
+    export_format = body_json.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format. Use one of: {', '.join(EXPORT_FORMATS)}")
+    if not EXPORT_BUCKET:
+        raise RuntimeError("EXPORT_BUCKET is not set")
+
+    exported_at = datetime.now(timezone.utc)
+    key = f"exports/{user}/{exported_at:%Y%m%dT%H%M%S%fZ}.{export_format}.gz"
+    with phase("export"):
+        sets, parts = export_history(raw_data_table, s3, EXPORT_BUCKET, key, user, export_format, EXPORT_PART_SIZE)
+    logger.info(f"Exported {sets} sets in {parts} parts for user: {user}")
+
+    filename = f"fitness-history-{exported_at:%Y-%m-%d}.{export_format}.gz"
+    url = s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": EXPORT_BUCKET, "Key": key, "ResponseContentDisposition": f'attachment; filename="{filename}"'},
+        ExpiresIn=EXPORT_LINK_TTL,
+    )
+    return {
+        "statusCode": 200,
+        "body": dumps({
+            "user": user,
+            "format": export_format,
+            "sets": sets,
+            "url": url,
+            "expires_in": EXPORT_LINK_TTL,
+        }),
+    }
+
+
+def get_sync_state(user_email):
+    """(data version, change stamp of the last resync request) of the user, from their version row"""
+    response = aggregates_table.get_item(
+        Key={"user": str(user_email), "exercise_name": VERSION_ROW},
+        ProjectionExpression="version, reset_sequence",
+    )
+    item = response.get("Item", {})
+    return int(item.get("version", 0)), int(item.get("reset_sequence", 0))
+
+
+def query_sync_items(table, user_email, attributes, since=None):
+    """
+    The user's items with the given attributes and their change stamp.
+
+    With since, only items changed after it, read from the sparse change
+    index in change order and at most SYNC_MAX_ITEMS; otherwise all of
+    them from the table. Returns (items, more).
+    """
+    names = {"#user": "user", "#change": CHANGE_SEQUENCE}
+    names.update({f"#a{i}": attribute for i, attribute in enumerate(attributes)})
+    query_kwargs = {
+        "KeyConditionExpression": "#user = :user",
+        "ProjectionExpression": ", ".join(["#change"] + [f"#a{i}" for i in range(len(attributes))]),
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": {":user": str(user_email)},
+    }
+    if since is None:
+        query_kwargs["ConsistentRead"] = True
+    else:
+        query_kwargs.update({
+            "IndexName": CHANGES_INDEX,
+            "KeyConditionExpression": "#user = :user AND #change > :since",
+            "Limit": SYNC_MAX_ITEMS,
+        })
+        query_kwargs["ExpressionAttributeValues"][":since"] = since
+
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return items, False
+        # Items written together share a stamp, so a page stops only once it holds
+        # two; the caller can then leave out the last stamp and still move on
+        if since is not None and len(items) >= SYNC_MAX_ITEMS \
+                and items[-1][CHANGE_SEQUENCE] > items[0][CHANGE_SEQUENCE]:
+            return items, True
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def validate_cursor(cursor):
+    """A sync cursor, or None for a client that has nothing yet"""
+    if cursor is None:
+        return None
+    if isinstance(cursor, bool) or not isinstance(cursor, int) or cursor < 0:
+        raise ValueError("Cursor must be a non-negative integer")
+    return cursor
+
+
+def synced_row(item):
+    """Whether a client keeps this aggregate row: exercises, total_lifted and records"""
+    name = item["exercise_name"]
+    return not name.startswith("#") or name.startswith(RECORD_PREFIX)
+
+
+def sync_response(user, body_json, event):
+    """
+    Aggregate rows and raw days changed since the client's cursor, and the next cursor.
+
+    A client without a cursor gets everything, and applies rows by key:
+    aggregate rows by exercise_name, days by date. "full" means the client
+    should drop everything it has first, "reset" only its aggregate rows;
+    "more" that it should call again straight away. With nothing new the
+    answer is one GetItem and a Query of each change index.
+
+    The cursor only moves up to the changes that have settled, stamped
+    SETTLE_SECONDS ago (fitness_sync); the client gets the ones after that
+    again on its next sync.
+    """
+    cursor = validate_cursor(body_json.get("cursor"))
+    _, reset_sequence = get_sync_state(user)
+    now = change_sequence()
 
+    # A cursor from ahead of the clock can only be stale, so start over
+    full = cursor is None or cursor > now
+    reset = full or cursor < reset_sequence
+    since = None if full else cursor
+    with phase("sync"):
+        days, more_days = query_sync_items(raw_data_table, user, SYNC_DAY_ATTRIBUTES, since)
+        aggregates, more_aggregates = query_sync_items(
+            aggregates_table, user, SYNC_AGGREGATE_ATTRIBUTES, None if reset else since
+        )
+
+    settled = now - SETTLE_SECONDS * 1000
+    next_cursor = settled if full else max(cursor, settled)
+    truncated = [items for items, more in ((days, more_days), (aggregates, more_aggregates)) if more]
+    last_read = truncated and int(min(items[-1][CHANGE_SEQUENCE] for items in truncated)) - 1
+    # A page that reaches unsettled changes is sent whole; the cursor stops at
+    # the settled ones and the rest comes with the next sync
+    truncated = truncated and last_read < next_cursor
+    if truncated:
+        # A truncated index may hold more items with the last stamp read,
+        # so stop short of it and leave out everything after
+        next_cursor = last_read
+        days = [item for item in days if item[CHANGE_SEQUENCE] <= next_cursor]
+        aggregates = [item for item in aggregates if item[CHANGE_SEQUENCE] <= next_cursor]
+    logger.info(f"Synced user {user} from {cursor} to {next_cursor}: "
+                f"{len(days)} days, {len(aggregates)} aggregate rows")
+
+    return sync_body(event, {
+        "user": user,
+        "cursor": next_cursor,
+        "full": full,
+        "reset": reset,
+        "more": bool(truncated),
+        "aggregates": [
+            {attribute: item[attribute] for attribute in SYNC_AGGREGATE_ATTRIBUTES if attribute in item}
+            for item in aggregates if synced_row(item)
+        ],
+        "days": [
+            {attribute: item[attribute] for attribute in SYNC_DAY_ATTRIBUTES if attribute in item}
+            for item in days
+        ],
+    })
+
+
+def sync_body(event, payload):
+    """A sync response, gzip-compressed when the client accepts it and it is worth it"""
+    body = dumps(payload)
+    headers = event.get("headers") or {}
+    accept_encoding = headers.get("accept-encoding") or headers.get("Accept-Encoding") or ""
+    if "gzip" not in accept_encoding or len(body) < GZIP_MIN_BYTES:
+        return {"statusCode": 200, "body": body}
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Encoding": "gzip", "Content-Type": "application/json"},
+        "isBase64Encoded": True,
+        "body": base64.b64encode(gzip.compress(body.encode("utf-8"), 6)).decode("ascii"),
+    }
+
+
+def query_aliases(user_email):
+    """Read every alias -> canonical name mapping of the user"""
+    aliases = {}
+    query_kwargs = {
+        "KeyConditionExpression": "#user = :user",
+        "ExpressionAttributeNames": {"#user": "user"},
+        "ExpressionAttributeValues": {":user": str(user_email)},
+        "ConsistentRead": True,
+    }
+    while True:
+        response = aliases_table.query(**query_kwargs)
+        for item in response.get("Items", []):
+            aliases[item["alias"]] = item["canonical"]
+        if "LastEvaluatedKey" not in response:
+            return aliases
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def exercise_rows(items):
+    """The per-exercise rows among aggregate items"""
+    return [
+        item for item in items
+        if item["exercise_name"] != SUMMARY_ROW and not item["exercise_name"].startswith("#")
+    ]
+
+
+def get_exercise_index(user_email):
+    """
+    The user's typeahead index, current to their data version.
+
+    A cached index takes the aggregate rows changed since its cursor once
+    the version moves. It is built again from all rows and aliases when
+    there is none, or when a merge or repair may have removed names. The
+    change index can lag the version by up to SETTLE_SECONDS (fitness_sync),
+    so for that long after it moves the changed rows are read again on every
+    call; an index built from the table holds them all straight away.
+    """
+    version, reset_sequence = get_sync_state(user_email)
+    now = change_sequence()
+    cached_version, unsettled_until, cursor, index = _suggest_cache.get(user_email, (None, 0, None, None))
+    if cached_version == version and not unsettled_until:
+        _suggest_cache.move_to_end(user_email)
+        return index
+    if cached_version != version:
+        unsettled_until = now + SETTLE_SECONDS * 1000
+
+    with phase("suggest_index"):
+        rows, more = [], True
+        if index is not None and reset_sequence <= cursor:
+            rows, more = query_sync_items(aggregates_table, user_email, SUGGEST_ATTRIBUTES, cursor)
+        if more:
+            items, _ = query_sync_items(aggregates_table, user_email, SUGGEST_ATTRIBUTES)
+            index = ExerciseIndex(exercise_rows(items), query_aliases(user_email))
+            cursor = unsettled_until = 0
+            logger.info(f"Built the exercise index of user {user_email}: {len(index)} names")
+        else:
+            for row in exercise_rows(rows):
+                index.update(row)
+            if now >= unsettled_until:
+                unsettled_until = 0
+            logger.info(f"Applied {len(rows)} changed rows to the exercise index of user {user_email}")
+
+    cursor = max(cursor, now - SETTLE_SECONDS * 1000)
+    _suggest_cache[user_email] = (version, unsettled_until, cursor, index)
+    _suggest_cache.move_to_end(user_email)
+    while len(_suggest_cache) > SUGGEST_CACHE_SIZE:
+        _suggest_cache.popitem(last=False)
+    return index
+
+
+def suggest_response(user, body_json, event):
+    """The user's exercise names with a word starting with the typed prefix, most used and recent first"""
+    prefix = body_json.get("prefix", "")
+    if not isinstance(prefix, str) or len(prefix) > MAX_EXERCISE_NAME_LENGTH:
+        raise ValueError(f"Prefix must be text of at most {MAX_EXERCISE_NAME_LENGTH} characters")
+    limit = body_json.get("limit", DEFAULT_SUGGESTIONS)
+    if not isinstance(limit, int) or not 1 <= limit <= MAX_SUGGESTIONS:
+        raise ValueError(f"Limit must be a number from 1 to {MAX_SUGGESTIONS}")
+
+    index = get_exercise_index(user)
+    with phase("suggest"):
+        suggestions = index.top(prefix, limit)
+
+    return {
+        "statusCode": 200,
+        "body": dumps({"user": user, "prefix": prefix, "suggestions": suggestions}),
+    }
+
+
+MODES = {
+    "summary": summary_response,
+    "range": range_response,
+    "records": records_response,
+    "analytics": analytics_response,
+    "export": export_response,
+    "sync": sync_response,
+    "suggest": suggest_response,
+}
+
+
+@instrument_handler("lambda_get")
+def lambda_handler(event, context):
+    try:
         # Parse the body of the request
         body = event.get("body")
         if not body:
@@ -121,50 +755,12 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": "Access denied"}),
             }
 
-        # Query DynamoDB for the user's data
-        items = query_aggregates_by_user(authenticated_user)
-        if not items:
-            logger.info(f"No data found for user: {authenticated_user}")
-            return {
-                "statusCode": 404,
-                "body": json.dumps({"error": f"No data found for user: {authenticated_user}"}),
-            }
+        set_property("mode", body_json.get("mode", "summary"))
+        mode = MODES.get(body_json.get("mode", "summary"))
+        if mode is None:
+            raise ValueError(f"Unknown mode. Use one of: {', '.join(MODES)}")
 
-        # Process the data
-        exercise_data = {}
-        total_lifted = 0
-
-        for item in items:
-            try:
-                exercise_name = item["exercise_name"]
-                total_volume = item.get("total_volume", 0)
-                total_reps = item.get("total_reps", 0)
-
-                if exercise_name == "total_lifted":
-                    total_lifted = total_volume
-                else:
-                    exercise_data[exercise_name] = {
-                        "total_volume": total_volume,
-                        "total_reps": total_reps,
-                    }
-            except KeyError as e:
-                logger.error(f"Missing key in item: {item}. Error: {e}")
-            except TypeError as e:
-                logger.error(f"Invalid item structure: {item}. Error: {e}")
-
-        # Build the response
-        response_body = {
-            "user": authenticated_user,
-            "exercise_data": exercise_data,
-            "total_lifted": total_lifted,
-        }
-
-        logger.info(f"Response body: {json.dumps(response_body, cls=DecimalEncoder)}")
-
-        return {
-            "statusCode": 200,
-            "body": json.dumps(response_body, cls=DecimalEncoder),
-        }
+        return mode(authenticated_user, body_json, event)
 
     except ValueError as e:
         logger.warning("Validation error: %s", e)
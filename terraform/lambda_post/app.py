@@ -1,118 +1,121 @@
 import json
 import logging
 import os
-import re
+import time
 from decimal import Decimal
-from datetime import datetime, timedelta
 
-import boto3
+from fitness_common import (
+    MAX_EXERCISES,
+    authorizer_context,
+    daily_summary_key,
+    dumps,
+    normalize_exercise_name,
+    validate_date,
+    validate_exercises,
+    validate_user_email,
+)
+from fitness_data import DynamoDBClient
+from fitness_metrics import add_count, instrument_handler, set_property
+from fitness_records import RECORD_METRICS, build_record_update, day_bests, query_history_bests, record_row
+from fitness_sets import day_sets, encode_sets
+from fitness_sync import CHANGE_SEQUENCE, change_sequence
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-raw_data_table = dynamodb.Table(os.environ['RAW_DATA_TABLE'])
-aggregates_table = dynamodb.Table(os.environ['AGGREGATES_TABLE'])
-
-
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
-
-
-def validate_user_email(email):
-    """Validate user email format"""
-    if not email or not isinstance(email, str):
-        raise ValueError("User email is required and must be a string")
-    
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    if not re.match(email_pattern, email):
-        raise ValueError("Invalid email format")
-    
-    if len(email) > 254:  # RFC 5321 limit
-        raise ValueError("Email address too long")
-    
-    return email.strip().lower()
-
-
-def validate_date(date_str):
-    """Validate date format and range"""
-    if not date_str or not isinstance(date_str, str):
-        raise ValueError("Date is required and must be a string")
-    
-    try:
-        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-    except ValueError:
-        raise ValueError("Invalid date format. Use YYYY-MM-DD")
-    
-    today = datetime.now().date()
-    one_year_ago = today - timedelta(days=365)
-    
-    if date_obj.date() > today:
-        raise ValueError("Date cannot be in the future")
-    
-    if date_obj.date() < one_year_ago:
-        raise ValueError("Date cannot be more than 1 year ago")
-    
-    return date_str
-
-
-def validate_exercises(exercises):
-    """Validate exercises array"""
-    if not isinstance(exercises, list):
-        raise ValueError("Exercises must be an array")
-    
-    if len(exercises) == 0:
-        raise ValueError("At least one exercise is required")
-    
-    if len(exercises) > 50:
-        raise ValueError("Maximum 50 exercises per workout")
-    
-    validated_exercises = []
-    for i, exercise in enumerate(exercises):
-        if not isinstance(exercise, dict):
-            raise ValueError(f"Exercise {i+1} must be an object")
-        
-        name = exercise.get('name')
-        if not name or not isinstance(name, str) or len(name.strip()) == 0:
-            raise ValueError(f"Exercise {i+1} must have a valid name")
-        
-        if len(name) > 100:
-            raise ValueError(f"Exercise {i+1} name too long (max 100 characters)")
-        
-        weight = exercise.get('weight')
-        if not isinstance(weight, (int, float)) or weight < 0:
-            raise ValueError(f"Exercise {i+1} weight must be a positive number")
-        
-        if weight > 10000:
-            raise ValueError(f"Exercise {i+1} weight seems unrealistic (max 10,000 lbs)")
-        
-        reps = exercise.get('reps')
-        if not isinstance(reps, int) or reps < 0:
-            raise ValueError(f"Exercise {i+1} reps must be a positive integer")
-        
-        if reps > 1000:
-            raise ValueError(f"Exercise {i+1} reps seem unrealistic (max 1,000)")
-        
-        validated_exercises.append({
-            'name': name.strip(),
-            'weight': Decimal(str(weight)),
-            'reps': int(reps)
-        })
-    
-    return validated_exercises
-
-
-def calculate_volume(exercises):
+# Takes and returns plain Python values; the botocore client is created on first use
+dynamodb_client = DynamoDBClient()
+raw_data_table = dynamodb_client.Table(os.environ['RAW_DATA_TABLE'])
+aggregates_table = dynamodb_client.Table(os.environ['AGGREGATES_TABLE'])
+rollups_table = dynamodb_client.Table(os.environ['ROLLUPS_TABLE'])
+aliases_table = dynamodb_client.Table(os.environ['ALIASES_TABLE'])
+
+MAX_IMPORT_DAYS = 366
+MAX_MERGE_ALIASES = 20
+MERGE_MAX_ATTEMPTS = 3
+RECORD_MAX_ATTEMPTS = 5
+# Every attribute a raw day has held; replacing a day removes the ones the new day doesn't set
+DAY_ATTRIBUTES = (
+    'exercise', 'raw_exercises', 'raw_sets', 'append_limit', 'total_volume', 'exercise_volumes', 'exercise_reps',
+    CHANGE_SEQUENCE,
+)
+
+# DynamoDB limit on actions in a single TransactWriteItems call
+TRANSACT_MAX_ITEMS = 100
+
+# Aggregate rows lambda_aggregate maintains besides the per-exercise ones
+SUMMARY_ROW = 'total_lifted'
+VERSION_ROW = '#version'
+# Per-exercise counter prefixes on rollup items
+ROLLUP_PREFIXES = ('volume:', 'reps:')
+
+# Seconds a user's alias map is reused before it is queried again. Applying
+# aliases here keeps raw days tidy; lambda_aggregate applies them exactly.
+ALIAS_CACHE_TTL = int(os.environ.get('ALIAS_CACHE_TTL', '300'))
+_alias_cache = {}
+
+# Store whole days' sets packed into raw_sets (fitness_sets) instead of the raw_exercises list
+COMPACT_SETS = os.environ.get('COMPACT_SETS', 'true').lower() == 'true'
+
+# DynamoDB batch limits and the backoff used when it returns unprocessed requests
+BATCH_GET_MAX_KEYS = 100
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_MAX_RETRIES = 8
+BATCH_BACKOFF_BASE = 0.05
+BATCH_BACKOFF_MAX = 2.0
+
+
+class ConflictError(Exception):
+    """The day changed under a write that was based on an older version of it"""
+
+    def __init__(self, message, version=None):
+        super().__init__(message)
+        self.version = version
+
+
+def query_aliases(user):
+    """Read every alias -> canonical name mapping of the user"""
+    aliases = {}
+    query_kwargs = {
+        'KeyConditionExpression': '#user = :user',
+        'ExpressionAttributeNames': {'#user': 'user'},
+        'ExpressionAttributeValues': {':user': user},
+        'ConsistentRead': True
+    }
+    while True:
+        response = aliases_table.query(**query_kwargs)
+        for item in response.get('Items', []):
+            aliases[item['alias']] = item['canonical']
+        if 'LastEvaluatedKey' not in response:
+            return aliases
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def get_aliases(user):
+    """Return the user's alias map, querying it only when the cached copy is stale"""
+    cached = _alias_cache.get(user)
+    now = time.monotonic()
+    if cached and now - cached[0] < ALIAS_CACHE_TTL:
+        return cached[1]
+    aliases = query_aliases(user)
+    _alias_cache[user] = (now, aliases)
+    return aliases
+
+
+def canonical_exercise_name(name, aliases):
+    name = normalize_exercise_name(name)
+    return aliases.get(name, name)
+
+
+def calculate_volume(exercises, aliases=None):
     logger.info("Calculating volumes and reps for exercises.")
+    aliases = aliases or {}
     total_volume = Decimal('0')
     exercise_volumes = {}
     exercise_reps = {}
 
     for exercise in exercises:
-        name = exercise['name'].lower()
+        name = canonical_exercise_name(exercise['name'], aliases)
         weight = exercise['weight']  # Already Decimal from validation
         reps = int(exercise['reps'])
 
@@ -126,102 +129,734 @@ def calculate_volume(exercises):
     return total_volume, exercise_volumes, exercise_reps
 
 
-def update_aggregates(user, exercise_volumes, exercise_reps, total_volume):
-    logger.info("Updating aggregates table.")
-    for exercise_name, volume in exercise_volumes.items():
-        reps = exercise_reps[exercise_name]
-        logger.info(f"Updating aggregate for user: {user}, exercise: {exercise_name}, Volume: {volume}, Reps: {reps}")
-        aggregates_table.update_item(
-            Key={'user': user, 'exercise_name': exercise_name},
-            UpdateExpression="ADD total_volume :v, total_reps :r",
-            ExpressionAttributeValues={
-                ':v': volume,  # Already Decimal
-                ':r': Decimal(str(reps))
+def validate_expected_version(version):
+    """Validate the optional day version a record_workout request is based on"""
+    if version is None:
+        return None
+    if isinstance(version, bool) or not isinstance(version, int) or version < 0:
+        raise ValueError("Expected version must be a non-negative integer")
+    return version
+
+
+def get_day_version(user, date):
+    """Current version of a raw day; 0 if it doesn't exist or predates versioning"""
+    item = raw_data_table.get_item(
+        Key={'user': user, 'date': date},
+        ProjectionExpression='version',
+        ConsistentRead=True
+    ).get('Item')
+    return int(item.get('version', 0)) if item else 0
+
+
+def put_day(raw_data_item, version):
+    """Write a raw day as version + 1, only if it is still at version"""
+    if version:
+        condition, values = 'version = :version', {':version': version}
+    else:
+        condition, values = 'attribute_not_exists(version)', None
+    params = {'Item': dict(raw_data_item, version=version + 1), 'ConditionExpression': condition}
+    if values:
+        params['ExpressionAttributeValues'] = values
+    raw_data_table.put_item(**params)
+    return version + 1
+
+
+def replace_day(raw_data_item):
+    """
+    Write a raw day over whatever it holds, as its next version; returns that version.
+
+    One UpdateItem sets every attribute, removes the ones the new day lacks
+    and increments the version, so concurrent replacements each land as
+    exactly one version without reading the day or retrying.
+    """
+    attributes = [attribute for attribute in raw_data_item if attribute not in ('user', 'date')]
+    names = {f"#a{i}": attribute for i, attribute in enumerate(attributes)}
+    values = {f":a{i}": raw_data_item[attribute] for i, attribute in enumerate(attributes)}
+    update_expression = "SET " + ", ".join(f"#a{i} = :a{i}" for i in range(len(attributes)))
+    update_expression += ", version = if_not_exists(version, :zero) + :one"
+    removed = [attribute for attribute in DAY_ATTRIBUTES if attribute not in raw_data_item]
+    if removed:
+        names.update({f"#r{i}": attribute for i, attribute in enumerate(removed)})
+        update_expression += " REMOVE " + ", ".join(f"#r{i}" for i in range(len(removed)))
+    response = raw_data_table.update_item(
+        Key={'user': raw_data_item['user'], 'date': raw_data_item['date']},
+        UpdateExpression=update_expression,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues={**values, ':zero': 0, ':one': 1},
+        ReturnValues='UPDATED_NEW'
+    )
+    return int(response['Attributes']['version'])
+
+
+def record_workout(user, body):
+    """
+    Replace the whole day's workout.
+
+    Only the raw day is written here; lambda_aggregate applies the difference
+    between the old and new day to the aggregates from the table stream.
+
+    Every write moves the day to its next version. A client that sends
+    expected_version writes only if the day is still at it and gets a 409
+    otherwise; without one the day is replaced whatever version it is at,
+    so only expected_version writes can conflict.
+    """
+    date = validate_date(body.get('date'))
+    exercises = validate_exercises(body.get('exercises', []))
+    expected_version = validate_expected_version(body.get('expected_version'))
+
+    logger.info("Processing exercises for user: %s, date: %s", user, date)
+
+    total_volume, exercise_volumes, exercise_reps = calculate_volume(exercises, get_aliases(user))
+
+    # Write raw data for the specific date
+    raw_data_item = {
+        'user': user,
+        'date': date,
+        'exercise': daily_summary_key(user, date),
+        **day_sets_attributes(exercises),
+        'total_volume': total_volume,  # Already Decimal
+        'exercise_volumes': exercise_volumes,  # Already Decimal values
+        'exercise_reps': exercise_reps,
+        CHANGE_SEQUENCE: change_sequence()
+    }
+    if expected_version is None:
+        version = replace_day(raw_data_item)
+    else:
+        try:
+            version = put_day(raw_data_item, expected_version)
+        except dynamodb_client.exceptions.ConditionalCheckFailedException:
+            add_count('DayWriteConflicts')
+            raise ConflictError(f"Day {date} changed since version {expected_version}", get_day_version(user, date))
+    logger.info("Successfully wrote raw data.")
+
+    return {
+        'statusCode': 200,
+        'body': dumps({
+            'message': 'Workout recorded successfully',
+            'user': user,
+            'date': date,
+            'version': version,
+            'total_volume': float(total_volume),
+            'exercise_volumes': {k: float(v) for k, v in exercise_volumes.items()},
+            'exercise_reps': exercise_reps
+        })
+    }
+
+
+def day_sets_attributes(exercises):
+    """
+    Raw-day attributes holding a whole day's sets.
+
+    Packed days keep an empty raw_exercises list for append_set, which may
+    add sets until the day holds MAX_EXERCISES in total.
+    """
+    if not COMPACT_SETS:
+        return {'raw_exercises': exercises}
+    return {
+        'raw_sets': encode_sets(exercises),
+        'raw_exercises': [],
+        'append_limit': MAX_EXERCISES - len(exercises)
+    }
+
+
+def build_append_set_write(user, date, name, exercise_set, volume, create_day, change_seq):
+    """
+    Raw-day write for appending one set, as (client method, parameters).
+
+    Appending to an existing day is a conditional UpdateItem; the first set
+    of a day is a PutItem that only succeeds if the day still does not exist.
+    Both move the day to its next version and return it, and stamp it with
+    change_seq.
+    """
+    if create_day:
+        return dynamodb_client.put_item, {
+            'TableName': raw_data_table.name,
+            'Item': {
+                'user': user,
+                'date': date,
+                'exercise': daily_summary_key(user, date),
+                'raw_exercises': [exercise_set],
+                'total_volume': volume,
+                'exercise_volumes': {name: volume},
+                'exercise_reps': {name: exercise_set['reps']},
+                'version': 1,
+                CHANGE_SEQUENCE: change_seq
+            },
+            'ConditionExpression': 'attribute_not_exists(#user)',
+            'ExpressionAttributeNames': {'#user': 'user'}
+        }
+
+    # ADD only works on top-level attributes, so the per-exercise map
+    # entries are incremented with SET ... if_not_exists
+    return dynamodb_client.update_item, {
+        'TableName': raw_data_table.name,
+        'Key': {'user': user, 'date': date},
+        'UpdateExpression': (
+            "SET raw_exercises = list_append(raw_exercises, :set), #exercise = :shard, "
+            f"{CHANGE_SEQUENCE} = :change_seq, "
+            "exercise_volumes.#name = if_not_exists(exercise_volumes.#name, :zero) + :v, "
+            "exercise_reps.#name = if_not_exists(exercise_reps.#name, :zero) + :r "
+            "ADD total_volume :v, version :one"
+        ),
+        # Packed days carry the room left for appended sets in append_limit
+        'ConditionExpression': (
+            'attribute_exists(exercise_volumes) AND (size(raw_exercises) < append_limit '
+            'OR (attribute_not_exists(append_limit) AND size(raw_exercises) < :max))'
+        ),
+        'ExpressionAttributeNames': {'#name': name, '#exercise': 'exercise'},
+        'ExpressionAttributeValues': {
+            ':set': [exercise_set],
+            ':shard': daily_summary_key(user, date),
+            ':zero': Decimal('0'),
+            ':v': volume,
+            ':r': Decimal(str(exercise_set['reps'])),
+            ':max': MAX_EXERCISES,
+            ':one': 1,
+            ':change_seq': change_seq
+        },
+        'ReturnValues': 'UPDATED_NEW'
+    }
+
+
+def append_set(user, body):
+    """Log one set without resending or rewriting the rest of the day"""
+    date = validate_date(body.get('date'))
+    exercise_set = validate_exercises([body.get('set')])[0]
+    name = canonical_exercise_name(exercise_set['name'], get_aliases(user))
+    volume = exercise_set['weight'] * Decimal(str(exercise_set['reps']))
+    change_seq = change_sequence()
+
+    # Try the common case (the day already exists) first. If the condition
+    # fails the day is either missing or full; creating it tells us which.
+    for create_day in (False, True, False):
+        operation, params = build_append_set_write(user, date, name, exercise_set, volume, create_day, change_seq)
+        try:
+            response = operation(**params)
+            break
+        except dynamodb_client.exceptions.ConditionalCheckFailedException:
+            logger.info("Append condition failed for user: %s, date: %s (create_day=%s)", user, date, create_day)
+    else:
+        raise ValueError(f"Maximum {MAX_EXERCISES} exercises per workout")
+    version = int(response.get('Attributes', {}).get('version', 1))
+
+    logger.info("Appended set for user: %s, date: %s, exercise: %s", user, date, name)
+    return {
+        'statusCode': 200,
+        'body': dumps({
+            'message': 'Set recorded successfully',
+            'user': user,
+            'date': date,
+            'exercise': name,
+            'version': version,
+            'volume': volume,
+            'reps': exercise_set['reps']
+        })
+    }
+
+
+def validate_days(days):
+    """Validate the days array of a bulk import"""
+    if not isinstance(days, list):
+        raise ValueError("Days must be an array")
+
+    if len(days) == 0:
+        raise ValueError("At least one day is required")
+
+    if len(days) > MAX_IMPORT_DAYS:
+        raise ValueError(f"Maximum {MAX_IMPORT_DAYS} days per import")
+
+    validated_days = {}
+    for i, day in enumerate(days):
+        if not isinstance(day, dict):
+            raise ValueError(f"Day {i+1} must be an object")
+
+        date = validate_date(day.get('date'))
+        if date in validated_days:
+            raise ValueError(f"Day {i+1} duplicates date {date}")
+
+        try:
+            validated_days[date] = validate_exercises(day.get('exercises', []))
+        except ValueError as e:
+            raise ValueError(f"Day {i+1} ({date}): {e}")
+
+    return validated_days
+
+
+def retry_unprocessed(operation, request_items, unprocessed_key):
+    """
+    Call a batch operation until DynamoDB has processed every request.
+
+    Returns the responses of every call so callers can collect results.
+    """
+    responses = []
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        response = operation(RequestItems=request_items)
+        responses.append(response)
+        request_items = response.get(unprocessed_key) or {}
+        if not request_items:
+            return responses
+        logger.info(f"Retrying {unprocessed_key} (attempt {attempt + 1})")
+        time.sleep(min(BATCH_BACKOFF_BASE * (2 ** attempt), BATCH_BACKOFF_MAX))
+    raise RuntimeError(f"{unprocessed_key} still pending after {BATCH_MAX_RETRIES} retries")
+
+
+def batch_get_day_versions(user, dates):
+    """Current version of each of the user's days, by date"""
+    versions = {}
+    for start in range(0, len(dates), BATCH_GET_MAX_KEYS):
+        request_items = {
+            raw_data_table.name: {
+                'Keys': [{'user': user, 'date': date} for date in dates[start:start + BATCH_GET_MAX_KEYS]],
+                'ProjectionExpression': '#date, version',
+                'ExpressionAttributeNames': {'#date': 'date'},
+                'ConsistentRead': True
+            }
+        }
+        for response in retry_unprocessed(dynamodb_client.batch_get_item, request_items, 'UnprocessedKeys'):
+            for item in response['Responses'].get(raw_data_table.name, []):
+                versions[item['date']] = int(item.get('version', 0))
+    return versions
+
+
+def batch_put_days(raw_data_items):
+    """Write many raw days with BatchWriteItem"""
+    for start in range(0, len(raw_data_items), BATCH_WRITE_MAX_ITEMS):
+        request_items = {
+            raw_data_table.name: [
+                {'PutRequest': {'Item': item}} for item in raw_data_items[start:start + BATCH_WRITE_MAX_ITEMS]
+            ]
+        }
+        retry_unprocessed(dynamodb_client.batch_write_item, request_items, 'UnprocessedItems')
+
+
+def import_days(user, body):
+    """
+    Import or replay many days in one request.
+
+    The raw days are written with BatchWriteItem; lambda_aggregate folds the
+    resulting stream records into one aggregate write per exercise.
+    BatchWriteItem can't be conditional, so imported days move to the next
+    version of what was read beforehand and win over concurrent writes.
+    """
+    days = validate_days(body.get('days'))
+    dates = sorted(days)
+    logger.info("Importing %d days for user: %s", len(dates), user)
+
+    aliases = get_aliases(user)
+    versions = batch_get_day_versions(user, dates)
+    # One change stamp per day, in date order
+    first_change = change_sequence(len(dates))
+    raw_data_items = []
+    for change_seq, date in enumerate(dates, first_change):
+        exercises = days[date]
+        total_volume, exercise_volumes, exercise_reps = calculate_volume(exercises, aliases)
+        raw_data_items.append({
+            'user': user,
+            'date': date,
+            'exercise': daily_summary_key(user, date),
+            **day_sets_attributes(exercises),
+            'total_volume': total_volume,
+            'exercise_volumes': exercise_volumes,
+            'exercise_reps': exercise_reps,
+            'version': versions.get(date, 0) + 1,
+            CHANGE_SEQUENCE: change_seq
+        })
+
+    batch_put_days(raw_data_items)
+    logger.info("Imported %d days.", len(dates))
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Days imported successfully',
+            'user': user,
+            'days_imported': len(dates)
+        })
+    }
+
+
+def validate_exercise_name(name, label):
+    """Validate and normalize a name given to merge_exercises"""
+    if not name or not isinstance(name, str) or len(name.strip()) == 0:
+        raise ValueError(f"{label} must be a non-empty string")
+
+    if len(name) > 100:
+        raise ValueError(f"{label} too long (max 100 characters)")
+
+    name = normalize_exercise_name(name)
+    if name.startswith('#') or name == SUMMARY_ROW:
+        raise ValueError(f"{label} '{name}' is reserved")
+
+    return name
+
+
+def validate_merge(body, existing_aliases):
+    """Validate a merge request and return (canonical, aliases)"""
+    canonical = validate_exercise_name(body.get('canonical'), "Canonical name")
+    if canonical in existing_aliases:
+        raise ValueError(f"'{canonical}' is already an alias of '{existing_aliases[canonical]}'")
+
+    names = body.get('aliases')
+    if not isinstance(names, list) or len(names) == 0:
+        raise ValueError("At least one alias is required")
+
+    if len(names) > MAX_MERGE_ALIASES:
+        raise ValueError(f"Maximum {MAX_MERGE_ALIASES} aliases per merge")
+
+    aliases = []
+    for i, name in enumerate(names):
+        alias = validate_exercise_name(name, f"Alias {i+1}")
+        if alias == canonical:
+            raise ValueError(f"Alias {i+1} is the canonical name")
+        if alias not in aliases:
+            aliases.append(alias)
+
+    return canonical, aliases
+
+
+def batch_get_aggregates(user, exercise_names):
+    """Strongly consistent read of several aggregate rows with BatchGetItem"""
+    rows = {}
+    request_items = {
+        aggregates_table.name: {
+            'Keys': [{'user': user, 'exercise_name': name} for name in exercise_names],
+            'ConsistentRead': True
+        }
+    }
+    for response in retry_unprocessed(dynamodb_client.batch_get_item, request_items, 'UnprocessedKeys'):
+        for item in response.get('Responses', {}).get(aggregates_table.name, []):
+            rows[item['exercise_name']] = item
+    return rows
+
+
+def unchanged_condition(item, attributes):
+    """Condition (and values) that holds only while the attributes keep the values read"""
+    conditions = []
+    values = {}
+    for attribute in attributes:
+        if attribute in item:
+            conditions.append(f"{attribute} = :old_{attribute}")
+            values[f":old_{attribute}"] = item[attribute]
+        else:
+            conditions.append(f"attribute_not_exists({attribute})")
+    return " AND ".join(conditions), values
+
+
+def build_merge_transaction(user, canonical, aliases, existing_aliases, rows):
+    """
+    Transaction items that merge the alias aggregate rows into the canonical one.
+
+    Every row read is written back conditionally, so the transaction fails
+    if lambda_aggregate changed any of them in the meantime. Bumping the
+    summary row's version also fails any aggregate transaction that read it
+    before the merge, and aliases_version tells lambda_aggregate to reload
+    the alias map.
+    """
+    transact_items = []
+    for alias, target in existing_aliases.items():
+        if target in aliases:
+            aliases = aliases + [alias]
+    for alias in aliases:
+        transact_items.append({
+            'Put': {
+                'TableName': aliases_table.name,
+                'Item': {'user': user, 'alias': alias, 'canonical': canonical}
+            }
+        })
+
+    merged = {'total_volume': Decimal('0'), 'total_reps': Decimal('0')}
+    for alias in aliases:
+        row = rows.get(alias)
+        if row is None:
+            continue
+        for attribute in merged:
+            merged[attribute] += row.get(attribute, Decimal('0'))
+        condition, values = unchanged_condition(row, ('total_volume', 'total_reps'))
+        transact_items.append({
+            'Delete': {
+                'TableName': aggregates_table.name,
+                'Key': {'user': user, 'exercise_name': alias},
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': values
+            }
+        })
+
+    if any(rows.get(alias) for alias in aliases):
+        transact_items.append({
+            'Update': {
+                'TableName': aggregates_table.name,
+                'Key': {'user': user, 'exercise_name': canonical},
+                'UpdateExpression': 'ADD total_volume :total_volume, total_reps :total_reps',
+                'ExpressionAttributeValues': {':total_volume': merged['total_volume'], ':total_reps': merged['total_reps']}
             }
-        )
-
-    logger.info(f"Updating total_lifted for user: {user} with volume: {total_volume}")
-    aggregates_table.update_item(
-        Key={'user': user, 'exercise_name': 'total_lifted'},
-        UpdateExpression="ADD total_volume :v",
-        ExpressionAttributeValues={
-            ':v': total_volume  # Already Decimal
+        })
+
+    summary = rows.get(SUMMARY_ROW, {})
+    condition, values = unchanged_condition(summary, ('version',))
+    values[':one'] = 1
+    update_expression = 'ADD version :one, aliases_version :one'
+    if 'exercise_data' in summary:
+        exercise_data = {name: dict(totals) for name, totals in summary['exercise_data'].items()}
+        for alias in aliases:
+            totals = exercise_data.pop(alias, None)
+            if totals is None:
+                continue
+            target = exercise_data.setdefault(canonical, {'total_volume': Decimal('0'), 'total_reps': Decimal('0')})
+            for attribute, value in totals.items():
+                target[attribute] = target.get(attribute, Decimal('0')) + value
+        update_expression = 'SET exercise_data = :exercise_data ' + update_expression
+        values[':exercise_data'] = exercise_data
+    transact_items.append({
+        'Update': {
+            'TableName': aggregates_table.name,
+            'Key': {'user': user, 'exercise_name': SUMMARY_ROW},
+            'UpdateExpression': update_expression,
+            'ConditionExpression': condition,
+            'ExpressionAttributeValues': values
         }
+    })
+    transact_items.append({
+        'Update': {
+            'TableName': aggregates_table.name,
+            'Key': {'user': user, 'exercise_name': VERSION_ROW},
+            # Alias rows are gone, which a sync can't see; send synced clients every row again
+            'UpdateExpression': 'SET reset_sequence = :now ADD version :one',
+            'ExpressionAttributeValues': {':now': change_sequence(), ':one': 1}
+        }
+    })
+
+    if len(transact_items) > TRANSACT_MAX_ITEMS:
+        raise ValueError("Too many aliases to merge at once")
+    return aliases, transact_items
+
+
+def query_rollups_with(user, attributes):
+    """Read the user's rollup items, projecting only the given attributes"""
+    names = {'#user': 'user', '#bucket': 'bucket'}
+    names.update({f"#a{i}": attribute for i, attribute in enumerate(attributes)})
+    query_kwargs = {
+        'KeyConditionExpression': '#user = :user',
+        'ProjectionExpression': ', '.join(['#bucket'] + [f"#a{i}" for i in range(len(attributes))]),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': {':user': user},
+        'ConsistentRead': True
+    }
+    while True:
+        response = rollups_table.query(**query_kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def merge_rollup_item(user, item, canonical):
+    """
+    Move the alias counters of one rollup item onto the canonical exercise.
+
+    The alias counters only change through merges once the alias is
+    registered, so the condition that they still hold the values read is
+    what keeps the move exact.
+    """
+    additions = {}
+    names = {}
+    values = {}
+    conditions = []
+    removals = []
+    for i, (attribute, value) in enumerate(sorted(item.items())):
+        if attribute == 'bucket':
+            continue
+        prefix = next(p for p in ROLLUP_PREFIXES if attribute.startswith(p))
+        additions[prefix] = additions.get(prefix, Decimal('0')) + value
+        names[f"#a{i}"] = attribute
+        values[f":a{i}"] = value
+        conditions.append(f"#a{i} = :a{i}")
+        removals.append(f"#a{i}")
+    for j, (prefix, total) in enumerate(additions.items()):
+        names[f"#c{j}"] = f"{prefix}{canonical}"
+        values[f":c{j}"] = total
+
+    rollups_table.update_item(
+        Key={'user': user, 'bucket': item['bucket']},
+        UpdateExpression=f"ADD {', '.join(f'#c{j} :c{j}' for j in range(len(additions)))} REMOVE {', '.join(removals)}",
+        ConditionExpression=' AND '.join(conditions),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
     )
 
 
+def merge_rollups(user, canonical, aliases):
+    """Move the aliases' counters of every rollup item that still has some; returns how many items"""
+    rollups_updated = 0
+    alias_attributes = [f"{prefix}{alias}" for alias in aliases for prefix in ROLLUP_PREFIXES]
+    for item in query_rollups_with(user, alias_attributes):
+        if len(item) > 1:
+            merge_rollup_item(user, item, canonical)
+            rollups_updated += 1
+    return rollups_updated
+
+
+def record_days_hold(user, canonical, written, aliases):
+    """Whether each written (value, date) is still reached by that day's sets"""
+    for metric, (value, date) in written.items():
+        day = raw_data_table.get_item(
+            Key={'user': user, 'date': date},
+            ProjectionExpression='raw_exercises, raw_sets',
+            ConsistentRead=True
+        ).get('Item', {})
+        if day_bests(day_sets(day), aliases).get(canonical, {}).get(metric, 0) < value:
+            return False
+    return True
+
+
+def merge_records(user, canonical, aliases):
+    """
+    Recompute the canonical exercise's personal records now that the aliases count for it.
+
+    The records are taken from the user's raw days read with the new alias
+    map, not folded from the alias rows, which are stale if an alias day was
+    lowered around the merge. Each metric is written only if the canonical
+    record is still the one read. A day lowered after the history was read
+    may have reached lambda_aggregate before the write, which then never
+    re-checks it, so the days of the written records are read again and
+    the records recomputed if one of them came down. The alias rows are
+    deleted afterwards. Returns how many there were.
+    """
+    rows = batch_get_aggregates(user, [record_row(alias) for alias in aliases])
+    for attempt in range(RECORD_MAX_ATTEMPTS):
+        row = batch_get_aggregates(user, [record_row(canonical)]).get(record_row(canonical), {})
+        current_aliases = query_aliases(user)
+        history = query_history_bests(raw_data_table, user, current_aliases).get(canonical, {})
+        raised = {}
+        replaced = {}
+        for metric in RECORD_METRICS:
+            best = history.get(metric)
+            if metric not in row:
+                if best is not None:
+                    raised[metric] = best
+            elif best != (row[metric], row.get(f"{metric}_date")):
+                replaced[metric] = best
+        if not raised and not replaced:
+            break
+        try:
+            aggregates_table.update_item(
+                **build_record_update(user, canonical, raised, replaced, row, change_sequence())
+            )
+        except dynamodb_client.exceptions.ConditionalCheckFailedException:
+            logger.info("Records of %s changed while merging; reading them again", canonical)
+            continue
+        written = {metric: best for metric, best in {**raised, **replaced}.items() if best is not None}
+        if record_days_hold(user, canonical, written, current_aliases):
+            break
+        logger.info("A record day of %s came down while merging; reading the history again", canonical)
+    else:
+        raise RuntimeError(f"Records of {canonical} kept changing after {RECORD_MAX_ATTEMPTS} attempts")
+    for exercise_name in rows:
+        aggregates_table.delete_item(Key={'user': user, 'exercise_name': exercise_name})
+    return len(rows)
+
+
+def merge_exercises(user, body):
+    """
+    Merge alias exercise names into a canonical one.
+
+    The aliases are registered and the aggregate rows moved in one
+    transaction; the rollup items are then moved one item at a time, and
+    the canonical exercise's personal records recomputed from the raw days.
+
+    Once the transaction is in, the merge has happened and the response is
+    never an error. Moving a rollup item removes the alias counters it
+    moved, in the same conditional update, and recomputing the records can
+    be repeated, so what is already done is not done twice: when the rest
+    fails, the response is a 202 with "pending", and repeating the merge
+    finishes it.
+    """
+    for attempt in range(MERGE_MAX_ATTEMPTS):
+        existing_aliases = query_aliases(user)
+        canonical, aliases = validate_merge(body, existing_aliases)
+        rows = batch_get_aggregates(user, aliases + [canonical, SUMMARY_ROW])
+        aliases, transact_items = build_merge_transaction(user, canonical, aliases, existing_aliases, rows)
+        try:
+            dynamodb_client.transact_write_items(TransactItems=transact_items)
+            break
+        except dynamodb_client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            if not any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons):
+                raise
+            logger.info("Aggregates changed during merge for user: %s (attempt %d)", user, attempt + 1)
+    else:
+        raise RuntimeError(f"Aggregates kept changing during merge after {MERGE_MAX_ATTEMPTS} attempts")
+    _alias_cache.pop(user, None)
+
+    pending = False
+    rollups_updated = records_merged = None
+    try:
+        rollups_updated = merge_rollups(user, canonical, aliases)
+        records_merged = merge_records(user, canonical, aliases)
+    except Exception as e:
+        logger.error("Merged %s into %s for user %s, but moving rollups and records failed: %s",
+                     aliases, canonical, user, e, exc_info=True)
+        pending = True
+
+    merged_rows = [alias for alias in aliases if alias in rows]
+    logger.info("Merged %s into %s for user: %s (%d aggregate rows, %s rollups)",
+                aliases, canonical, user, len(merged_rows), rollups_updated)
+    if pending:
+        message = 'Exercises merged; moving their history is pending, repeat the merge to finish it'
+    else:
+        message = 'Exercises merged successfully'
+    return {
+        'statusCode': 202 if pending else 200,
+        'body': json.dumps({
+            'message': message,
+            'user': user,
+            'canonical': canonical,
+            'aliases': aliases,
+            'pending': pending,
+            'aggregate_rows_merged': len(merged_rows),
+            'rollups_updated': rollups_updated,
+            'records_merged': records_merged
+        })
+    }
+
+
+ACTIONS = {
+    'record_workout': record_workout,
+    'append_set': append_set,
+    'import_days': import_days,
+    'merge_exercises': merge_exercises,
+}
+
+
+@instrument_handler('lambda_post')
 def lambda_handler(event, context):
     try:
-        logger.info("Received event: %s", event)
         body = json.loads(event['body'])
 
+        set_property('action', body.get('action', 'record_workout'))
+        action = ACTIONS.get(body.get('action', 'record_workout'))
+        if action is None:
+            raise ValueError(f"Unknown action. Use one of: {', '.join(ACTIONS)}")
+
         # Validate input data
         user = validate_user_email(body.get('user'))
-        date = validate_date(body.get('date'))
-        exercises = validate_exercises(body.get('exercises', []))
-
-        logger.info("Processing exercises for user: %s, date: %s", user, date)
-
-        # Fetch existing data for the specific user and date
-        existing_data = raw_data_table.get_item(Key={'user': user, 'date': date}).get('Item')
-
-        if existing_data:
-            logger.info("Found existing data for the same user and date. Adjusting aggregates.")
-            previous_exercise_volumes = existing_data['exercise_volumes']
-            previous_exercise_reps = existing_data['exercise_reps']
-            previous_total_volume = existing_data['total_volume']
-
-            # Subtract previous contributions from aggregates
-            for exercise_name, previous_volume in previous_exercise_volumes.items():
-                previous_reps = previous_exercise_reps[exercise_name]
-                aggregates_table.update_item(
-                    Key={'user': user, 'exercise_name': exercise_name},
-                    UpdateExpression="ADD total_volume :v, total_reps :r",
-                    ExpressionAttributeValues={
-                        ':v': -previous_volume,  # Convert to negative Decimal
-                        ':r': Decimal(str(-int(previous_reps)))
-                    }
-                )
-
-            aggregates_table.update_item(
-                Key={'user': user, 'exercise_name': 'total_lifted'},
-                UpdateExpression="ADD total_volume :v",
-                ExpressionAttributeValues={
-                    ':v': -previous_total_volume  # Convert to negative Decimal
-                }
-            )
 
-        # Calculate new contributions
-        total_volume, exercise_volumes, exercise_reps = calculate_volume(exercises)
-
-        # Write raw data for the specific date
-        raw_data_item = {
-            'user': user,
-            'date': date,
-            'exercise': 'DAILY_SUMMARY',
-            'raw_exercises': exercises,
-            'total_volume': total_volume,  # Already Decimal
-            'exercise_volumes': exercise_volumes,  # Already Decimal values
-            'exercise_reps': exercise_reps
-        }
-        raw_data_table.put_item(Item=raw_data_item)
-        logger.info("Successfully wrote raw data to table.")
+        # Only the user lambda_authorizer identified may write, when it identified one
+        authenticated_user = authorizer_context(event).get('user')
+        if authenticated_user and authenticated_user != user:
+            logger.warning("User %s attempted to write data for different user %s", authenticated_user, user)
+            return {
+                'statusCode': 403,
+                'body': json.dumps({'error': 'Access denied'})
+            }
 
-        # Update aggregates with new contributions
-        update_aggregates(user, exercise_volumes, exercise_reps, total_volume)
+        return action(user, body)
 
+    except ConflictError as e:
+        logger.warning("Write conflict: %s", e)
         return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Workout recorded successfully',
-                'user': user,
-                'date': date,
-                'total_volume': float(total_volume),
-                'exercise_volumes': {k: float(v) for k, v in exercise_volumes.items()},
-                'exercise_reps': exercise_reps
-            }, cls=DecimalEncoder)
+            'statusCode': 409,
+            'body': json.dumps({'error': str(e), 'version': e.version})
         }
-
     except ValueError as e:
         logger.warning("Validation error: %s", e)
         return {
@@ -0,0 +1,147 @@
+"""
+Year analytics over a user's daily rollups: goal pace, rolling averages,
+training streaks and how each exercise's share of the volume moves.
+
+The day rollups of a year are laid out as dense NumPy arrays indexed by day
+of year, one row per exercise, and everything after that is vectorized.
+NumPy is not part of the Lambda runtime; it comes from the numpy layer,
+which only lambda_get has, and lambda_get imports this module on first use
+so its other modes don't pay for the import.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+
+VOLUME_PREFIX = "volume:"
+ROLLING_WINDOWS = (7, 28)
+# Exercises returned with their share trend, by volume this year
+TOP_EXERCISES = 20
+
+
+def daily_arrays(items, year):
+    """
+    Day rollup items of one year -> (names, totals, volumes).
+
+    totals[d] is the volume of day-of-year d (0-based) and volumes[e, d]
+    that of names[e] on it; days without a rollup are 0.
+    """
+    days_in_year = (date(year, 12, 31) - date(year, 1, 1)).days + 1
+    index = {}
+    days = []
+    cells = []
+    totals = np.zeros(days_in_year)
+    for item in items:
+        day = date.fromisoformat(item["bucket"].split("#", 1)[1]).timetuple().tm_yday - 1
+        totals[day] = item.get("total_volume", 0)
+        for attribute, value in item.items():
+            if attribute.startswith(VOLUME_PREFIX) and value:
+                days.append(day)
+                cells.append((index.setdefault(attribute[len(VOLUME_PREFIX):], len(index)), float(value)))
+
+    volumes = np.zeros((len(index), days_in_year))
+    if cells:
+        rows, values = zip(*cells)
+        np.add.at(volumes, (np.array(rows), np.array(days)), np.array(values))
+    return list(index), totals, volumes
+
+
+def rolling_average(totals, window):
+    """Trailing window-day mean of every day; days before January 1 count as 0"""
+    cumulative = np.concatenate(([0.0], np.cumsum(totals)))
+    ends = np.arange(1, len(totals) + 1)
+    return (cumulative[ends] - cumulative[np.maximum(ends - window, 0)]) / window
+
+
+def streaks(trained, first_day):
+    """Current and longest run of training days; today only breaks the current run once it is over"""
+    edges = np.diff(np.concatenate(([0], trained.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    lengths = ends - starts
+    longest = int(lengths.max()) if len(lengths) else 0
+    longest_start = None
+    if len(lengths):
+        longest_start = (first_day + timedelta(days=int(starts[lengths.argmax()]))).isoformat()
+
+    today = len(trained)
+    current = 0
+    if len(ends) and ends[-1] >= today - 1:
+        current = int(lengths[-1])
+    return {
+        "current": current,
+        "longest": longest,
+        "longest_start": longest_start,
+        "training_days": int(trained.sum()),
+    }
+
+
+def exercise_shares(names, volumes, through, year, top=TOP_EXERCISES):
+    """Each top exercise's share of the volume this year, per month and over the last two 28-day windows"""
+    volumes = volumes[:, :through]
+    year_volumes = volumes.sum(axis=1)
+    order = np.argsort(-year_volumes, kind="stable")[:top]
+
+    month_starts = np.array([date(year, month, 1).timetuple().tm_yday - 1 for month in range(1, 13)])
+    month_starts = month_starts[month_starts < through]
+    monthly = np.add.reduceat(volumes, month_starts, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        monthly_share = np.nan_to_num(monthly / monthly.sum(axis=0))
+        windows = [volumes[:, max(through - 28, 0):], volumes[:, max(through - 56, 0):max(through - 28, 0)]]
+        last, prior = (np.nan_to_num(window.sum(axis=1) / window.sum()) for window in windows)
+        year_share = np.nan_to_num(year_volumes / year_volumes.sum())
+
+    return [
+        {
+            "name": names[e],
+            "volume": round(float(year_volumes[e]), 2),
+            "share": round(float(year_share[e]), 4),
+            "share_last_28_days": round(float(last[e]), 4),
+            "share_prior_28_days": round(float(prior[e]), 4),
+            "share_change": round(float(last[e] - prior[e]), 4),
+            "monthly_share": np.round(monthly_share[e], 4).tolist(),
+        }
+        for e in order if year_volumes[e] > 0
+    ]
+
+
+def year_analytics(items, year, today, goal):
+    """
+    Analytics of a year's day rollups as of today.
+
+    For a past year everything is as of December 31. Rolling averages are
+    returned for every day so far, for a chart.
+    """
+    names, totals, volumes = daily_arrays(items, year)
+    days_in_year = len(totals)
+    through = days_in_year if today.year > year else today.timetuple().tm_yday
+    totals = totals[:through]
+
+    year_to_date = float(totals.sum())
+    goal = float(goal)
+    goal_to_date = goal * through / days_in_year
+    pace = {
+        "year_to_date": round(year_to_date, 2),
+        "goal": goal,
+        "goal_to_date": round(goal_to_date, 2),
+        "pace_ratio": round(year_to_date / goal_to_date, 4) if goal_to_date else None,
+        "projected_total": round(year_to_date / through * days_in_year, 2),
+        "goal_per_day": round(goal / days_in_year, 2),
+        "needed_per_day": round(max(goal - year_to_date, 0) / max(days_in_year - through, 1), 2),
+        "days_elapsed": through,
+        "days_in_year": days_in_year,
+    }
+
+    rolling = {}
+    for window in ROLLING_WINDOWS:
+        averages = rolling_average(totals, window)
+        rolling[f"average_{window}_days"] = round(float(averages[-1]), 2)
+        rolling[f"daily_{window}_days"] = np.round(averages, 1).tolist()
+
+    return {
+        "year": year,
+        "as_of": date(year, 12, 31).isoformat() if today.year > year else today.isoformat(),
+        "pace": pace,
+        "rolling": rolling,
+        "streaks": streaks(totals > 0, date(year, 1, 1)),
+        "exercises": exercise_shares(names, volumes, through, year),
+    }
@@ -0,0 +1,151 @@
+"""
+Validation and JSON helpers shared by the API handlers.
+
+Deployed as a Lambda layer, so every function imports the same copy.
+"""
+import json
+import os
+import re
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from fitness_metrics import timed_phase
+
+MAX_EXERCISES = 50
+MAX_EXERCISE_NAME_LENGTH = 100
+MAX_WEIGHT = 10000
+MAX_REPS = 1000
+MAX_EMAIL_LENGTH = 254  # RFC 5321 limit
+
+# Yearly volume goal, in lbs, that pace is measured against
+GOAL_ANNUAL_VOLUME = Decimal(os.environ.get("GOAL_ANNUAL_VOLUME", "15000000"))
+
+# raw_data days are spread over this many exercise-date-index partitions,
+# "DAILY_SUMMARY#0" to "DAILY_SUMMARY#15", so the index has no single hot
+# key. A reader of a date range has to query all of them, and the legacy
+# "DAILY_SUMMARY" until scripts/migrate_gsi_shards.py has run; changing the
+# count means rewriting every day with it.
+DAILY_SUMMARY = 'DAILY_SUMMARY'
+DAILY_SUMMARY_SHARDS = 16
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+DATE_FORMAT = '%Y-%m-%d'
+
+# Built once: json.dumps constructs a new encoder whenever it gets options.
+# DynamoDB hands numbers back as Decimal, the only non-JSON type the handlers
+# serialize, so the C encoder converts them with float() as it goes.
+_encoder = json.JSONEncoder(default=float)
+
+
+@timed_phase("serialize")
+def dumps(obj):
+    """Serialize a response body, converting Decimals in the same pass"""
+    return _encoder.encode(obj)
+
+
+def daily_summary_key(user, date):
+    """exercise-date-index partition of a user's raw day"""
+    shard = zlib.crc32(f"{user}#{date}".encode('utf-8')) % DAILY_SUMMARY_SHARDS
+    return f"{DAILY_SUMMARY}#{shard}"
+
+
+def authorizer_context(event):
+    """Context lambda_authorizer returned for the request, or {} when there was none"""
+    authorizer = (event.get('requestContext') or {}).get('authorizer') or {}
+    # Payload format 2.0 nests a Lambda authorizer's context under "lambda"
+    return authorizer.get('lambda') or authorizer
+
+
+@timed_phase("validate")
+def validate_user_email(email):
+    """Validate user email format"""
+    if not email or not isinstance(email, str):
+        raise ValueError("User email is required and must be a string")
+
+    if not EMAIL_PATTERN.match(email):
+        raise ValueError("Invalid email format")
+
+    if len(email) > MAX_EMAIL_LENGTH:
+        raise ValueError("Email address too long")
+
+    return email.strip().lower()
+
+
+@timed_phase("validate")
+def validate_date(date_str):
+    """Validate date format and range"""
+    if not date_str or not isinstance(date_str, str):
+        raise ValueError("Date is required and must be a string")
+
+    try:
+        date_obj = datetime.strptime(date_str, DATE_FORMAT)
+    except ValueError:
+        raise ValueError("Invalid date format. Use YYYY-MM-DD")
+
+    today = datetime.now().date()
+    one_year_ago = today - timedelta(days=365)
+
+    if date_obj.date() > today:
+        raise ValueError("Date cannot be in the future")
+
+    if date_obj.date() < one_year_ago:
+        raise ValueError("Date cannot be more than 1 year ago")
+
+    return date_str
+
+
+@timed_phase("validate")
+def validate_exercises(exercises):
+    """Validate exercises array"""
+    if not isinstance(exercises, list):
+        raise ValueError("Exercises must be an array")
+
+    if len(exercises) == 0:
+        raise ValueError("At least one exercise is required")
+
+    if len(exercises) > MAX_EXERCISES:
+        raise ValueError(f"Maximum {MAX_EXERCISES} exercises per workout")
+
+    validated_exercises = []
+    for i, exercise in enumerate(exercises):
+        if not isinstance(exercise, dict):
+            raise ValueError(f"Exercise {i+1} must be an object")
+
+        name = exercise.get('name')
+        if not name or not isinstance(name, str) or len(name.strip()) == 0:
+            raise ValueError(f"Exercise {i+1} must have a valid name")
+
+        if len(name) > MAX_EXERCISE_NAME_LENGTH:
+            raise ValueError(f"Exercise {i+1} name too long (max {MAX_EXERCISE_NAME_LENGTH} characters)")
+
+        name = name.strip()
+        if name.startswith('#'):
+            raise ValueError(f"Exercise {i+1} name cannot start with '#'")
+
+        weight = exercise.get('weight')
+        if not isinstance(weight, (int, float)) or weight < 0:
+            raise ValueError(f"Exercise {i+1} weight must be a positive number")
+
+        if weight > MAX_WEIGHT:
+            raise ValueError(f"Exercise {i+1} weight seems unrealistic (max 10,000 lbs)")
+
+        reps = exercise.get('reps')
+        if not isinstance(reps, int) or reps < 0:
+            raise ValueError(f"Exercise {i+1} reps must be a positive integer")
+
+        if reps > MAX_REPS:
+            raise ValueError(f"Exercise {i+1} reps seem unrealistic (max 1,000)")
+
+        validated_exercises.append({
+            'name': name,
+            'weight': Decimal(str(weight)),
+            'reps': int(reps)
+        })
+
+    return validated_exercises
+
+
+def normalize_exercise_name(name):
+    """Lower-case a name and collapse its whitespace"""
+    return ' '.join(name.lower().split())
@@ -0,0 +1,258 @@
+"""
+Lightweight DynamoDB access for the handlers.
+
+Clients come straight from botocore and are created on first use, so a
+cold start skips the boto3 resource layer and a request that never
+reaches AWS doesn't pay for a client at all. DynamoDBClient and Table take
+and return plain Python values like boto3's resource API does (numbers as
+Decimal), using the serializer below instead of boto3's TypeSerializer.
+Every call is reported to fitness_metrics with the capacity it consumed.
+"""
+import base64
+import threading
+import time
+from decimal import Decimal
+
+import fitness_metrics
+
+_session = None
+# Handlers call DynamoDB from worker threads; botocore sessions aren't thread safe
+_lock = threading.RLock()
+
+
+def create_client(service_name):
+    global _session
+    with _lock:
+        if _session is None:
+            import botocore.session
+            _session = botocore.session.get_session()
+        return _session.create_client(service_name)
+
+
+def serialize(value):
+    """Python value -> DynamoDB AttributeValue"""
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            raise TypeError("Infinity and NaN not supported")
+        return {"N": str(value)}
+    if isinstance(value, int):
+        return {"N": str(value)}
+    if isinstance(value, dict):
+        return {"M": {key: serialize(item) for key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"L": [serialize(item) for item in value]}
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, (bytes, bytearray)):
+        return {"B": bytes(value)}
+    if isinstance(value, (set, frozenset)) and value:
+        if all(isinstance(item, str) for item in value):
+            return {"SS": list(value)}
+        if all(isinstance(item, (bytes, bytearray)) for item in value):
+            return {"BS": [bytes(item) for item in value]}
+        return {"NS": [serialize(item)["N"] for item in value]}
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    raise TypeError(f"Unsupported type {type(value).__name__} for value {value!r}")
+
+
+def _deserialize_map(data):
+    return {key: deserialize(item) for key, item in data.items()}
+
+
+def _deserialize_binary(data):
+    # botocore decodes binary values; stream records in a Lambda event are JSON, so they arrive as base64
+    return base64.b64decode(data) if isinstance(data, str) else bytes(data)
+
+
+_DESERIALIZERS = {
+    "S": lambda data: data,
+    "N": Decimal,
+    "M": _deserialize_map,
+    "L": lambda data: [deserialize(item) for item in data],
+    "BOOL": lambda data: data,
+    "NULL": lambda data: None,
+    "B": _deserialize_binary,
+    "SS": set,
+    "NS": lambda data: {Decimal(item) for item in data},
+    "BS": lambda data: {_deserialize_binary(item) for item in data},
+}
+
+
+def deserialize(value):
+    """DynamoDB AttributeValue -> Python value"""
+    for tag, data in value.items():
+        return _DESERIALIZERS[tag](data)
+    raise TypeError("Empty AttributeValue")
+
+
+def serialize_item(item):
+    return {key: serialize(value) for key, value in item.items()}
+
+
+def deserialize_item(item):
+    return {key: deserialize(value) for key, value in item.items()}
+
+
+# Request and response members that hold attribute maps
+_ITEM_PARAMS = ("Key", "Item", "ExpressionAttributeValues", "ExclusiveStartKey")
+_ITEM_RESULTS = ("Item", "Attributes", "LastEvaluatedKey")
+
+
+def _serialize_params(params):
+    for name in _ITEM_PARAMS:
+        if name in params:
+            params[name] = serialize_item(params[name])
+    return params
+
+
+def _deserialize_result(response):
+    for name in _ITEM_RESULTS:
+        if name in response:
+            response[name] = deserialize_item(response[name])
+    if "Items" in response:
+        response["Items"] = [deserialize_item(item) for item in response["Items"]]
+    return response
+
+
+def _map_batch_get(request_items, convert):
+    return {
+        table: dict(request, Keys=[convert(key) for key in request["Keys"]])
+        for table, request in request_items.items()
+    }
+
+
+def _map_batch_write(request_items, convert):
+    mapped = {}
+    for table, requests in request_items.items():
+        mapped[table] = []
+        for request in requests:
+            if "PutRequest" in request:
+                mapped[table].append({"PutRequest": {"Item": convert(request["PutRequest"]["Item"])}})
+            else:
+                mapped[table].append({"DeleteRequest": {"Key": convert(request["DeleteRequest"]["Key"])}})
+    return mapped
+
+
+class DynamoDBClient:
+    """
+    The DynamoDB operations the handlers use, on a lazily created low-level client.
+
+    Other attributes (exceptions, meta, ...) are passed through to the client.
+    """
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            with _lock:
+                if self._client is None:
+                    self._client = create_client("dynamodb")
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def Table(self, name):
+        return Table(self, name)
+
+    def _call(self, operation_name, method, params):
+        """Make one call, reporting its latency and consumed capacity to fitness_metrics"""
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+        response = None
+        start = time.perf_counter()
+        try:
+            response = method(**params)
+            return response
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            fitness_metrics.record_dynamodb_call(operation_name, elapsed_ms, (response or {}).get("ConsumedCapacity"))
+
+    def get_item(self, **params):
+        return _deserialize_result(self._call("GetItem", self.client.get_item, _serialize_params(params)))
+
+    def put_item(self, **params):
+        return _deserialize_result(self._call("PutItem", self.client.put_item, _serialize_params(params)))
+
+    def update_item(self, **params):
+        return _deserialize_result(self._call("UpdateItem", self.client.update_item, _serialize_params(params)))
+
+    def delete_item(self, **params):
+        return _deserialize_result(self._call("DeleteItem", self.client.delete_item, _serialize_params(params)))
+
+    def query(self, **params):
+        return _deserialize_result(self._call("Query", self.client.query, _serialize_params(params)))
+
+    def scan(self, **params):
+        return _deserialize_result(self._call("Scan", self.client.scan, _serialize_params(params)))
+
+    def batch_get_item(self, RequestItems, **params):
+        params["RequestItems"] = _map_batch_get(RequestItems, serialize_item)
+        response = self._call("BatchGetItem", self.client.batch_get_item, params)
+        response["Responses"] = {
+            table: [deserialize_item(item) for item in items]
+            for table, items in response.get("Responses", {}).items()
+        }
+        response["UnprocessedKeys"] = _map_batch_get(response.get("UnprocessedKeys", {}), deserialize_item)
+        return response
+
+    def batch_write_item(self, RequestItems, **params):
+        params["RequestItems"] = _map_batch_write(RequestItems, serialize_item)
+        response = self._call("BatchWriteItem", self.client.batch_write_item, params)
+        response["UnprocessedItems"] = _map_batch_write(response.get("UnprocessedItems", {}), deserialize_item)
+        return response
+
+    def transact_write_items(self, TransactItems, **params):
+        params["TransactItems"] = [
+            {action: _serialize_params(dict(request)) for action, request in item.items()}
+            for item in TransactItems
+        ]
+        return self._call("TransactWriteItems", self.client.transact_write_items, params)
+
+
+class Table:
+    """Table-scoped operations, called like boto3's dynamodb.Table"""
+
+    def __init__(self, dynamodb_client, name):
+        self.dynamodb_client = dynamodb_client
+        self.name = name
+
+    def get_item(self, **params):
+        return self.dynamodb_client.get_item(TableName=self.name, **params)
+
+    def put_item(self, **params):
+        return self.dynamodb_client.put_item(TableName=self.name, **params)
+
+    def update_item(self, **params):
+        return self.dynamodb_client.update_item(TableName=self.name, **params)
+
+    def delete_item(self, **params):
+        return self.dynamodb_client.delete_item(TableName=self.name, **params)
+
+    def query(self, **params):
+        return self.dynamodb_client.query(TableName=self.name, **params)
+
+    def scan(self, **params):
+        return self.dynamodb_client.scan(TableName=self.name, **params)
+
+
+class LazyClient:
+    """Any other botocore client, created the first time it is used"""
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with _lock:
+                if self._client is None:
+                    self._client = create_client(self.service_name)
+        return getattr(self._client, name)
+
@@ -0,0 +1,131 @@
+"""
+Export of a user's raw workout history as gzip NDJSON or CSV on S3.
+
+Every stage is a generator, so only one Query page, one batch of rows and
+one upload part are held at a time however long the history is:
+
+    query_days -> set_rows -> ndjson_lines / csv_lines -> gzip_parts -> upload_parts
+
+The parts go to S3 as a multipart upload, which is aborted if anything
+fails half way, and the caller hands out a presigned link to the object.
+"""
+import csv
+import io
+import json
+import zlib
+
+from fitness_sets import day_sets
+
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_COLUMNS = ("date", "set", "name", "weight", "reps", "volume")
+# S3 multipart parts other than the last one must be at least 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+# Rows formatted per csv.writer call
+CSV_BATCH_ROWS = 500
+
+
+def query_days(table, user):
+    """The user's raw days in date order, one Query page at a time"""
+    params = {
+        "KeyConditionExpression": "#user = :user",
+        "ProjectionExpression": "#date, raw_exercises, raw_sets",
+        "ExpressionAttributeNames": {"#user": "user", "#date": "date"},
+        "ExpressionAttributeValues": {":user": user},
+    }
+    while True:
+        response = table.query(**params)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def set_rows(days):
+    """One row per set, numbered from 1 within its day"""
+    for day in days:
+        for number, exercise_set in enumerate(day_sets(day), 1):
+            weight = exercise_set["weight"]
+            reps = int(exercise_set["reps"])
+            yield {
+                "date": day["date"],
+                "set": number,
+                "name": exercise_set["name"],
+                "weight": weight,
+                "reps": reps,
+                "volume": weight * reps,
+            }
+
+
+_encoder = json.JSONEncoder(default=float, separators=(",", ":"))
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield _encoder.encode(row) + "\n"
+
+
+def csv_lines(rows):
+    """A header line, then the rows formatted in batches through one csv.writer"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    batch = []
+    for row in rows:
+        batch.append([row[column] for column in EXPORT_COLUMNS])
+        if len(batch) < CSV_BATCH_ROWS:
+            continue
+        writer.writerows(batch)
+        batch.clear()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    writer.writerows(batch)
+    yield buffer.getvalue()
+
+
+def gzip_parts(chunks, part_size=MIN_PART_SIZE):
+    """Compress text chunks into one gzip stream, cut into parts of at least part_size bytes"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    part = bytearray()
+    for chunk in chunks:
+        part += compressor.compress(chunk.encode("utf-8"))
+        if len(part) >= part_size:
+            yield bytes(part)
+            part.clear()
+    part += compressor.flush()
+    yield bytes(part)
+
+
+def upload_parts(s3, bucket, key, parts):
+    """Upload parts as one multipart object; returns the number of parts"""
+    # A .gz download, not Content-Encoding: gzip, which browsers would undo
+    upload = s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType="application/gzip")
+    completed = []
+    try:
+        for number, body in enumerate(parts, 1):
+            response = s3.upload_part(
+                Bucket=bucket, Key=key, UploadId=upload["UploadId"], PartNumber=number, Body=body
+            )
+            completed.append({"PartNumber": number, "ETag": response["ETag"]})
+        s3.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload["UploadId"], MultipartUpload={"Parts": completed}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload["UploadId"])
+        raise
+    return len(completed)
+
+
+def export_history(table, s3, bucket, key, user, export_format, part_size=MIN_PART_SIZE):
+    """Write the user's history to s3://bucket/key; returns (sets, parts)"""
+    counted = {"sets": 0}
+
+    def counting(rows):
+        for row in rows:
+            counted["sets"] += 1
+            yield row
+
+    rows = counting(set_rows(query_days(table, user)))
+    lines = ndjson_lines(rows) if export_format == "ndjson" else csv_lines(rows)
+    parts = upload_parts(s3, bucket, key, gzip_parts(lines, part_size))
+    return counted["sets"], parts
@@ -0,0 +1,170 @@
+"""
+Per-invocation metrics, written as CloudWatch Embedded Metric Format lines.
+
+instrument_handler wraps a lambda_handler: it times the invocation, logs
+the full event for a sampled fraction of requests only, and prints one EMF
+JSON line to stdout when the invocation ends. Inside it, phase() adds up
+time per phase and fitness_data reports every DynamoDB call with the
+capacity it consumed. Everything goes to sys.stdout, so capturing stdout
+is enough to read the metrics locally.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "FitnessApp")
+# Fraction of invocations whose full event (and response body) is logged
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get("EVENT_LOG_SAMPLE_RATE", "0.01"))
+# Headers never written to the logs, even for sampled events
+REDACTED_HEADERS = frozenset(("x-api-key", "authorization"))
+READ_OPERATIONS = frozenset(("GetItem", "Query", "Scan", "BatchGetItem", "TransactGetItems"))
+
+# The invocation in progress. Worker threads report into it through
+# propagate(), hence the lock around updates.
+_current = contextvars.ContextVar("fitness_metrics", default=None)
+_lock = threading.Lock()
+
+
+class Metrics:
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.timings = {}
+        self.counts = {"DynamoDBCalls": 0, "ReadCapacityUnits": 0.0, "WriteCapacityUnits": 0.0}
+        self.properties = {}
+        self.sampled = False
+
+    def add_time(self, name, elapsed_ms):
+        with _lock:
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+
+    def add_count(self, name, value=1):
+        with _lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_emf(self):
+        definitions = [{"Name": f"Time.{name}", "Unit": "Milliseconds"} for name in self.timings]
+        definitions += [{"Name": name, "Unit": "Count"} for name in self.counts]
+        line = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Function"]],
+                    "Metrics": definitions,
+                }],
+            },
+            "Function": self.function_name,
+        }
+        line.update(self.properties)
+        line.update({f"Time.{name}": round(value, 3) for name, value in self.timings.items()})
+        line.update(self.counts)
+        return json.dumps(line, default=str)
+
+
+def sampled():
+    """Whether the invocation in progress logs its full payloads"""
+    metrics = _current.get()
+    return metrics is not None and metrics.sampled
+
+
+def set_property(name, value):
+    """Attach a searchable, non-metric field (action, mode, status) to the EMF line"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.properties[name] = value
+
+
+def add_count(name, value=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_count(name, value)
+
+
+def propagate(func):
+    """Bind func to the invocation in progress, for running it on a worker thread"""
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to the named phase of the current invocation"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, (time.perf_counter() - start) * 1000)
+
+
+def timed_phase(name):
+    """Decorator form of phase()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_dynamodb_call(operation_name, elapsed_ms, consumed_capacity):
+    """Count one DynamoDB call, its latency and the capacity units it consumed"""
+    metrics = _current.get()
+    if metrics is None:
+        return
+    metrics.add_time(operation_name, elapsed_ms)
+    metrics.add_count("DynamoDBCalls")
+    if isinstance(consumed_capacity, dict):
+        consumed_capacity = [consumed_capacity]
+    units = sum(entry.get("CapacityUnits", 0) for entry in consumed_capacity or [])
+    if units:
+        kind = "ReadCapacityUnits" if operation_name in READ_OPERATIONS else "WriteCapacityUnits"
+        metrics.add_count(kind, float(units))
+
+
+def redact(event):
+    headers = event.get("headers") if isinstance(event, dict) else None
+    if not headers:
+        return event
+    return dict(event, headers={
+        key: "[redacted]" if key.lower() in REDACTED_HEADERS else value for key, value in headers.items()
+    })
+
+
+def instrument_handler(function_name):
+    """Wrap a lambda_handler so each invocation emits one EMF line"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            metrics = Metrics(os.environ.get("AWS_LAMBDA_FUNCTION_NAME", function_name))
+            metrics.sampled = random.random() < EVENT_LOG_SAMPLE_RATE
+            token = _current.set(metrics)
+            start = time.perf_counter()
+            try:
+                if metrics.sampled:
+                    logger.info("Received event: %s", json.dumps(redact(event), default=str))
+                result = handler(event, context)
+                if isinstance(result, dict) and "statusCode" in result:
+                    metrics.properties["statusCode"] = result["statusCode"]
+                return result
+            finally:
+                metrics.timings["Duration"] = (time.perf_counter() - start) * 1000
+                _current.reset(token)
+                # One write per line keeps lines whole when threads share stdout
+                sys.stdout.write(metrics.to_emf() + "\n")
+        return wrapper
+    return decorator
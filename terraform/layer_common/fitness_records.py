@@ -0,0 +1,133 @@
+"""
+Personal records per exercise: heaviest weight, best set volume and best estimated 1RM.
+
+Each exercise's records live on one aggregates row, "#record#<exercise>",
+holding every metric with the date it was set. lambda_aggregate raises them
+from the raw_data stream with updates that only succeed while the record is
+still lower. When a re-posted or deleted day held a record, the user's history
+is read again to find the next best; lambda_post reads it the same way to
+recompute an exercise's records after a merge.
+"""
+from decimal import Decimal
+
+from fitness_common import normalize_exercise_name
+from fitness_sets import day_sets
+from fitness_sync import CHANGE_SEQUENCE
+
+RECORD_PREFIX = "#record#"
+RECORD_METRICS = ("max_weight", "best_set_volume", "best_e1rm")
+# Epley stops being a useful estimate well before this many reps
+MAX_E1RM_REPS = 30
+
+_CENTS = Decimal("0.01")
+
+
+def record_row(exercise_name):
+    return f"{RECORD_PREFIX}{exercise_name}"
+
+
+def estimated_1rm(weight, reps):
+    """Epley estimate of the one-rep max of a set, or None when it doesn't make sense"""
+    if reps < 1 or reps > MAX_E1RM_REPS:
+        return None
+    if reps == 1:
+        return weight
+    return (weight * (1 + Decimal(reps) / 30)).quantize(_CENTS)
+
+
+def day_bests(raw_exercises, aliases=None):
+    """Best value of each metric per canonical exercise name in one day's sets, named like the volumes"""
+    aliases = aliases or {}
+    bests = {}
+    for exercise_set in raw_exercises:
+        weight = Decimal(exercise_set.get("weight", 0))
+        reps = int(exercise_set.get("reps", 0))
+        if weight <= 0 or reps < 1:
+            continue
+        name = normalize_exercise_name(exercise_set["name"])
+        name = aliases.get(name, name)
+        best = bests.setdefault(name, {})
+        values = {"max_weight": weight, "best_set_volume": weight * reps, "best_e1rm": estimated_1rm(weight, reps)}
+        for metric, value in values.items():
+            if value is not None and value > best.get(metric, 0):
+                best[metric] = value
+    return bests
+
+
+def query_history_bests(raw_data_table, user, aliases):
+    """Best (value, date) of every metric per exercise over all of the user's days"""
+    best = {}
+    query_kwargs = {
+        "KeyConditionExpression": "#user = :user",
+        "ProjectionExpression": "#date, raw_exercises, raw_sets",
+        "ExpressionAttributeNames": {"#user": "user", "#date": "date"},
+        "ExpressionAttributeValues": {":user": user},
+        "ConsistentRead": True
+    }
+    while True:
+        response = raw_data_table.query(**query_kwargs)
+        for day in response.get("Items", []):
+            for exercise_name, metrics in day_bests(day_sets(day), aliases).items():
+                for metric, value in metrics.items():
+                    current = best.setdefault(exercise_name, {}).get(metric)
+                    if current is None or value > current[0]:
+                        best[exercise_name][metric] = (value, day["date"])
+        if "LastEvaluatedKey" not in response:
+            return best
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def build_record_update(user, exercise_name, raised, replaced, row, change_seq=None):
+    """
+    UpdateItem parameters (without TableName) for one exercise's records.
+
+    raised maps metrics to a higher (value, date): each is written only if
+    the stored record is still lower. replaced maps metrics to the
+    (value, date) that takes over from a record whose day got worse, or None
+    if no day has the metric any more. Each is written only if the record is
+    still the one in row. change_seq, when given, is stamped on the row.
+    """
+    assignments = []
+    removals = []
+    conditions = []
+    values = {}
+    if change_seq is not None:
+        assignments.append(f"{CHANGE_SEQUENCE} = :change_seq")
+        values[":change_seq"] = change_seq
+    for metric, (value, date) in raised.items():
+        assignments += [f"{metric} = :{metric}", f"{metric}_date = :{metric}_date"]
+        values.update({f":{metric}": value, f":{metric}_date": date})
+        conditions.append(f"(attribute_not_exists({metric}) OR {metric} < :{metric})")
+    for metric, replacement in replaced.items():
+        if replacement is None:
+            removals += [metric, f"{metric}_date"]
+        else:
+            assignments += [f"{metric} = :{metric}", f"{metric}_date = :{metric}_date"]
+            values.update({f":{metric}": replacement[0], f":{metric}_date": replacement[1]})
+        conditions.append(f"{metric} = :old_{metric} AND {metric}_date = :old_{metric}_date")
+        values.update({f":old_{metric}": row[metric], f":old_{metric}_date": row[f"{metric}_date"]})
+
+    update_expression = ""
+    if assignments:
+        update_expression = "SET " + ", ".join(assignments)
+    if removals:
+        update_expression += " REMOVE " + ", ".join(removals)
+    return {
+        "Key": {"user": user, "exercise_name": record_row(exercise_name)},
+        "UpdateExpression": update_expression.strip(),
+        "ConditionExpression": " AND ".join(conditions),
+        "ExpressionAttributeValues": values,
+    }
+
+
+def records_from_items(items):
+    """exercise -> metric -> {"value", "date"} from the user's record rows"""
+    records = {}
+    for item in items:
+        metrics = {
+            metric: {"value": item[metric], "date": item.get(f"{metric}_date")}
+            for metric in RECORD_METRICS if metric in item
+        }
+        if metrics:
+            records[item["exercise_name"][len(RECORD_PREFIX):]] = metrics
+    return records
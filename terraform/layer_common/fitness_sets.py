@@ -0,0 +1,135 @@
+"""
+Compact storage for the sets of a raw day.
+
+Typed DynamoDB JSON repeats "name", "weight" and "reps" with their type tags
+for every set in a raw_exercises list. Days written by record_workout and
+import_days keep their sets in raw_sets instead: one binary attribute with
+a dictionary of the exercise names followed by each set as a name index,
+reps and the weight's decimal digits and exponent, all varints, deflated
+when that comes out smaller. Sets logged afterwards with append_set still
+go to the raw_exercises list, and days written before this only have the
+list. day_sets() reads every shape, decoding raw_sets on first use.
+scripts/migrate_compact_sets.py packs the sets of legacy days, and the ones
+appended since, into raw_sets.
+"""
+import zlib
+from collections.abc import Sequence
+from decimal import Decimal
+
+FORMAT_PLAIN = 1
+FORMAT_DEFLATE = 2
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def encode_sets(sets):
+    """[{name, weight, reps}, ...] -> raw_sets bytes; weights keep their exact Decimal digits"""
+    names = {}
+    body = bytearray()
+    _write_varint(body, len(sets))
+    for exercise_set in sets:
+        index = names.setdefault(exercise_set["name"], len(names))
+        sign, digits, exponent = Decimal(exercise_set["weight"]).as_tuple()
+        mantissa = int("".join(map(str, digits)))
+        _write_varint(body, index)
+        _write_varint(body, int(exercise_set["reps"]))
+        _write_varint(body, mantissa * 2 + sign)
+        _write_varint(body, _zigzag(exponent))
+
+    out = bytearray()
+    _write_varint(out, len(names))
+    for name in names:
+        encoded = name.encode("utf-8")
+        _write_varint(out, len(encoded))
+        out += encoded
+    out += body
+
+    deflated = zlib.compress(out, 6, wbits=-15)
+    if len(deflated) < len(out):
+        return bytes([FORMAT_DEFLATE]) + deflated
+    return bytes([FORMAT_PLAIN]) + bytes(out)
+
+
+def decode_sets(data):
+    """raw_sets bytes -> [{name, weight, reps}, ...] as validate_exercises returns them"""
+    data = bytes(data)
+    if data[0] == FORMAT_DEFLATE:
+        data = zlib.decompress(data[1:], -15)
+    elif data[0] == FORMAT_PLAIN:
+        data = data[1:]
+    else:
+        raise ValueError(f"Unknown raw_sets format {data[0]}")
+
+    count, position = _read_varint(data, 0)
+    names = []
+    for _ in range(count):
+        length, position = _read_varint(data, position)
+        names.append(data[position:position + length].decode("utf-8"))
+        position += length
+
+    count, position = _read_varint(data, position)
+    sets = []
+    for _ in range(count):
+        index, position = _read_varint(data, position)
+        reps, position = _read_varint(data, position)
+        signed, position = _read_varint(data, position)
+        exponent, position = _read_varint(data, position)
+        weight = Decimal(signed // 2).scaleb(_unzigzag(exponent))
+        if signed % 2:
+            weight = weight.copy_negate()
+        sets.append({"name": names[index], "weight": weight, "reps": reps})
+    return sets
+
+
+class PackedSets(Sequence):
+    """A day's packed sets followed by its appended ones, decoded on first access"""
+
+    def __init__(self, packed, appended=()):
+        self._packed = packed
+        self._appended = list(appended)
+        self._sets = None
+
+    def _decoded(self):
+        if self._sets is None:
+            self._sets = decode_sets(self._packed) + self._appended
+        return self._sets
+
+    def __getitem__(self, index):
+        return self._decoded()[index]
+
+    def __len__(self):
+        return len(self._decoded())
+
+
+def day_sets(item):
+    """Every set of a raw day, whichever way it is stored"""
+    appended = item.get("raw_exercises") or []
+    packed = item.get("raw_sets")
+    if not packed:
+        return appended
+    return PackedSets(packed, appended)
@@ -0,0 +1,108 @@
+"""
+Exercise-name typeahead behind lambda_get's suggest mode.
+
+An ExerciseIndex is a trie of a user's exercise names and aliases,
+flattened into one dict from every prefix of every word to the canonical
+names it leads to, so "pre" finds "overhead press" and an alias finds the
+name it was merged into. A lookup is one dict hit and picking the best k of
+the names under it; short prefixes that lead to many names walk a ranking of
+all names instead, kept until the next update. Names rank by how much they
+are used, the total_reps of their aggregate row, plus how recently: that
+row's change_seq, the time it last changed, against the latest one the
+index has seen.
+
+lambda_get keeps an index per user in the warm container and applies the
+aggregate rows that changed since it was built, read from the change index
+(fitness_sync), instead of building it again.
+"""
+import heapq
+import itertools
+import math
+
+from fitness_common import normalize_exercise_name
+from fitness_sync import CHANGE_SEQUENCE
+
+# Longer prefixes share the entry of their first characters and are filtered from it
+MAX_PREFIX_LENGTH = 12
+# A name last used this many milliseconds before the latest one gets half its recency
+RECENCY_HALF_LIFE = 14 * 24 * 3600 * 1000
+# Recency of the latest name used, in the units of log(1 + total_reps)
+RECENCY_WEIGHT = 2.0
+# Prefixes leading to more names than this are answered from the ranking of all names
+RANKED_MIN_CANDIDATES = 100
+
+
+def word_starts(key):
+    """The key from the start of each of its words"""
+    return [key[i:] for i in range(len(key)) if i == 0 or key[i - 1] == " "]
+
+
+class ExerciseIndex:
+    """Prefix index of one user's exercise names, ranked by use and recency"""
+
+    def __init__(self, rows=(), aliases=None):
+        self.prefixes = {}
+        self.starts = {}
+        self.usage = {}
+        self.latest = 0
+        self._ranked = None
+        for row in rows:
+            self.update(row)
+        for alias, canonical in (aliases or {}).items():
+            self.add(canonical, alias)
+
+    def add(self, name, alias=None):
+        """Make name reachable from its own prefixes and those of an alias of it"""
+        if name not in self.usage:
+            self.usage[name] = (0.0, 0)
+            self._ranked = None
+        starts = self.starts.setdefault(name, set())
+        for start in word_starts(name) + (word_starts(alias) if alias else []):
+            if start in starts:
+                continue
+            starts.add(start)
+            for length in range(1, min(len(start), MAX_PREFIX_LENGTH) + 1):
+                self.prefixes.setdefault(start[:length], set()).add(name)
+
+    def update(self, row):
+        """Add the name of an aggregate row, or take its new totals"""
+        name = row["exercise_name"]
+        change_seq = int(row.get(CHANGE_SEQUENCE, 0))
+        if name not in self.starts:
+            self.add(name)
+        self.usage[name] = (math.log1p(max(int(row.get("total_reps", 0)), 0)), change_seq)
+        self.latest = max(self.latest, change_seq)
+        self._ranked = None
+
+    def score(self, name):
+        log_reps, change_seq = self.usage[name]
+        return log_reps + RECENCY_WEIGHT * 2 ** ((change_seq - self.latest) / RECENCY_HALF_LIFE)
+
+    def rank_key(self, name):
+        # Ties go to the alphabetically first name, so answers don't depend on set order
+        return -self.score(name), name
+
+    def ranked(self):
+        """Every name, best first"""
+        if self._ranked is None:
+            self._ranked = sorted(self.usage, key=self.rank_key)
+        return self._ranked
+
+    def top(self, prefix, k):
+        """The k best names with a word starting with prefix, best first; all names for an empty one"""
+        prefix = normalize_exercise_name(prefix)
+        if not prefix:
+            candidates = self.usage
+        else:
+            candidates = self.prefixes.get(prefix[:MAX_PREFIX_LENGTH], ())
+            if len(prefix) > MAX_PREFIX_LENGTH:
+                candidates = {
+                    name for name in candidates
+                    if any(start.startswith(prefix) for start in self.starts[name])
+                }
+        if len(candidates) > RANKED_MIN_CANDIDATES:
+            return list(itertools.islice((name for name in self.ranked() if name in candidates), k))
+        return heapq.nsmallest(k, candidates, key=self.rank_key)
+
+    def __len__(self):
+        return len(self.usage)
@@ -0,0 +1,46 @@
+"""
+Per-user change stamps behind lambda_get's sync and suggest modes.
+
+Every write a client has to see stamps the items it writes with a
+change_seq: the time of the write in milliseconds, set in the write
+itself. lambda_post stamps raw days and lambda_aggregate stamps aggregate
+and record rows. raw_data and aggregates both have a sparse
+user-change-index on (user, change_seq) that only holds stamped items, so
+a sync queries the changes after a client's cursor instead of reading the
+whole history. No shared counter is written per change, so concurrent
+writes of one user don't queue up on a single item.
+
+A stamp is taken just before the write that carries it lands, the indexes
+are eventually consistent and the lambdas' clocks can be slightly apart,
+so a write can show up after a sync has read past its stamp. A sync only
+moves a client's cursor up to the stamp of SETTLE_SECONDS ago, so the
+latest changes are sent again until they settle, which is harmless because
+clients apply rows by key.
+
+A deleted item leaves nothing in an index. Merges and aggregate repairs
+delete aggregate rows, so the transaction that bumps the user's version
+row also stamps reset_sequence on it, and a client whose cursor is older
+than that gets all of the user's aggregate rows again. Cursors trail by
+SETTLE_SECONDS, so rows a merge deletes just after its transaction are
+still covered.
+"""
+import time
+
+CHANGE_SEQUENCE = "change_seq"
+CHANGES_INDEX = "user-change-index"
+# The user's data version row in the aggregates table, which also keeps reset_sequence
+VERSION_ROW = "#version"
+# Longer than a write takes to land and reach the index after taking its stamp,
+# plus how far apart the lambdas' clocks can be
+SETTLE_SECONDS = 30
+
+
+def change_sequence(count=1):
+    """
+    Stamp for items written now; returns the first of count stamps.
+
+    Items written together in order take one stamp each, a millisecond
+    apart and ending now, so a sync can page between them.
+    """
+    return time.time_ns() // 1_000_000 - count + 1
+
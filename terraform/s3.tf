@@ -75,4 +75,50 @@ resource "aws_s3_object" "website_object" {
   content_type = lookup(local.mime_types, split(".", each.value)[length(split(".", each.value)) - 1])
 
   tags = var.tags
-}
\ No newline at end of file
+}
+
+# History exports written by lambda_get and downloaded through presigned links
+module "exports_s3_bucket" {
+  source  = "terraform-aws-modules/s3-bucket/aws"
+  version = "4.2.2"
+
+  # No dots, so the virtual-hosted presigned URLs match S3's certificate
+  bucket = "${local.environment}-exports-${data.aws_caller_identity.current.account_id}"
+
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+
+  control_object_ownership = true
+  object_ownership         = "BucketOwnerEnforced"
+
+  expected_bucket_owner = data.aws_caller_identity.current.account_id
+
+  server_side_encryption_configuration = {
+    rule = {
+      apply_server_side_encryption_by_default = {
+        sse_algorithm = "AES256"
+      }
+    }
+  }
+
+  lifecycle_rule = [
+    {
+      id     = "expire-exports"
+      status = "Enabled"
+
+      filter = {
+        prefix = "exports/"
+      }
+
+      expiration = {
+        days = 7
+      }
+
+      abort_incomplete_multipart_upload_days = 1
+    }
+  ]
+
+  tags = var.tags
+}
@@ -0,0 +1,11 @@
+# Shard and sequence range of raw_data stream batches lambda_aggregate gave up
+# on; replay them while the stream still holds them (24 hours), or run
+# scripts/rebuild_aggregates.py for the users in them
+resource "aws_sqs_queue" "aggregate_failures" {
+  name = "${var.environment}_aggregate_failures"
+
+  message_retention_seconds = 1209600
+  sqs_managed_sse_enabled   = true
+
+  tags = var.tags
+}
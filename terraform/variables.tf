@@ -2,6 +2,13 @@ locals {
   environment = replace(var.environment, "_", "-")
 }
 
+variable "alarm_email" {
+  description = "Address subscribed to the alarms topic; empty for none"
+  type        = string
+
+  default = ""
+}
+
 variable "domain" {
   description = "Base domain for the website"
   type        = string
@@ -16,6 +23,13 @@ variable "environment" {
   default = null
 }
 
+variable "firebase_project_id" {
+  description = "Firebase project whose ID tokens the API authorizer verifies; empty to trust x-user-email"
+  type        = string
+
+  default = ""
+}
+
 variable "region" {
   description = "AWS region"
   type        = string
@@ -23,6 +37,13 @@ variable "region" {
   default = null
 }
 
+variable "require_id_token" {
+  description = "With firebase_project_id set, reject web API key requests that carry no Firebase ID token"
+  type        = bool
+
+  default = true
+}
+
 variable "tags" {
   description = "Universal tags"
   type        = map(string)